@@ -1,9 +1,23 @@
+import argparse
 import json
 import os
-from datetime import datetime
+import sys
 import time
-from typing import List, Dict, Any, Union
+import warnings
+from typing import List, Any, Union
 import getpass
+from qcm_leaderboard import LeaderboardIndex
+from qcm_metrics import metrics
+from qcm_quizgen import ADAPTIVE_TITLE, DifficultyIndex, QuizGenerator
+from qcm_reports import ReportIndex, export_csv, iter_attempts, iter_pages
+from qcm_search import SearchHit, SearchIndex
+from qcm_auth import Authenticator
+from qcm_bank import Question, QuestionBank
+from qcm_batch import run_batch
+from qcm_grading import AnswerKey
+from qcm_session import QuizEngine
+from qcm_stats import StatsIndex, UserStats
+from qcm_storage import open_storage, save_json
 
 
 class Colors:
@@ -16,33 +30,85 @@ class Colors:
     BOLD = '\033[1m'
     UNDERLINE = '\033[4m'
 
+class Renderer:
+    """Terminal output, either animated (typewriter) or instant.
+
+    The mode comes from the QCM_RENDER environment variable: 'typewriter',
+    'instant' or 'auto' (the default). The typewriter animation and the pauses
+    are only used when stdout is an interactive terminal, so scripted and batch
+    runs never wait.
+    """
+
+    MODES = ('auto', 'typewriter', 'instant')
+
+    def __init__(self, mode: str = None):
+        if mode is None:
+            mode = os.environ.get('QCM_RENDER', 'auto')
+            if mode not in self.MODES:
+                # A typo in the environment must not keep the app (or the server) from starting
+                warnings.warn(f"Unknown QCM_RENDER value {mode!r}, using 'auto' (one of {', '.join(self.MODES)})")
+                mode = 'auto'
+        self.set_mode(mode)
+
+    def set_mode(self, mode: str):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown render mode: {mode}")
+        self.instant = mode == 'instant' or not sys.stdout.isatty()
+
+    def fancy(self, text: str, color: str, bold: bool, delay: float):
+        prefix = f"{color}{Colors.BOLD if bold else ''}"
+        if self.instant or delay <= 0:
+            sys.stdout.write(f"{prefix}{text}{Colors.ENDC}\n")
+            return
+        # Escape sequences are written at once, only the visible characters are animated
+        sys.stdout.write(prefix)
+        for char in text:
+            sys.stdout.write(char)
+            sys.stdout.flush()
+            time.sleep(delay)
+        sys.stdout.write(f"{Colors.ENDC}\n")
+        sys.stdout.flush()
+
+    def clear(self):
+        if self.instant:
+            sys.stdout.write('\033[2J\033[H')
+        else:
+            os.system('cls' if os.name == 'nt' else 'clear')
+
+    def pause(self, seconds: float):
+        if not self.instant:
+            sys.stdout.flush()
+            time.sleep(seconds)
+
+
+renderer = Renderer()
+
 def clear_screen():
-    os.system('cls' if os.name == 'nt' else 'clear')
+    renderer.clear()
+
+def pause(seconds: float):
+    renderer.pause(seconds)
 
 def print_fancy(text: str, color: str = Colors.BLUE, bold: bool = False, delay: float = 0.02):
-    text = f"{color}{Colors.BOLD if bold else ''}{text}{Colors.ENDC}"
-    for char in text:
-        print(char, end='', flush=True)
-        time.sleep(delay)
-    print()
+    renderer.fancy(text, color, bold, delay)
 
-def handle_question_input(question: dict) -> Union[int, list]:
+def handle_question_input(question: Question) -> Union[int, list]:
     """Handle user input for both single and multiple choice questions"""
-    if question.get('type') == 'multiple':
+    if question.multiple:
         print(f"\n{Colors.YELLOW}This is a multiple choice question. Select multiple answers.{Colors.ENDC}")
-        num_answers = len(question['correct'])
+        num_answers = question.answer_count
         print(f"{Colors.BLUE}(Select {num_answers} answers){Colors.ENDC}")
         answers = []
         while len(answers) < num_answers:
             try:
                 remaining = num_answers - len(answers)
                 answer = int(input(f"\n{Colors.GREEN}Enter answer #{len(answers)+1} ({remaining} more needed): {Colors.ENDC}"))
-                if 1 <= answer <= len(question['options']) and answer not in answers:
+                if 1 <= answer <= len(question.options) and answer not in answers:
                     answers.append(answer)
                 elif answer in answers:
                     print(f"{Colors.RED}You've already selected this answer! Try another one.{Colors.ENDC}")
                 else:
-                    print(f"{Colors.RED}Invalid choice! Please enter a number between 1 and {len(question['options'])}{Colors.ENDC}")
+                    print(f"{Colors.RED}Invalid choice! Please enter a number between 1 and {len(question.options)}{Colors.ENDC}")
             except ValueError:
                 print(f"{Colors.RED}Please enter a number!{Colors.ENDC}")
         return sorted(answers)
@@ -50,45 +116,60 @@ def handle_question_input(question: dict) -> Union[int, list]:
         while True:
             try:
                 answer = int(input(f"\n{Colors.GREEN}Your answer (number): {Colors.ENDC}"))
-                if 1 <= answer <= len(question['options']):
+                if 1 <= answer <= len(question.options):
                     return answer
-                print(f"{Colors.RED}Invalid choice! Please enter a number between 1 and {len(question['options'])}{Colors.ENDC}")
+                print(f"{Colors.RED}Invalid choice! Please enter a number between 1 and {len(question.options)}{Colors.ENDC}")
             except ValueError:
                 print(f"{Colors.RED}Please enter a number!{Colors.ENDC}")
 
-def check_answer(question: dict, user_answer: Union[int, list]) -> bool:
-    """Check if the answer is correct for both single and multiple choice questions"""
-    if question.get('type') == 'multiple':
-        return sorted(user_answer) == sorted(question['correct'])
-    else:
-        # For single choice questions, convert single correct answer to int if it's in a list
-        correct = question['correct'] if isinstance(question['correct'], int) else question['correct'][0]
-        return user_answer == correct
-    
-def display_correct_answer(question: dict):
+def display_correct_answer(question: Question):
     """Display the correct answer(s) for both types of questions"""
-    if question.get('type') == 'multiple':
+    if question.multiple:
         print(f"{Colors.GREEN}Correct answers:{Colors.ENDC}")
-        for ans in question['correct']:
+        for ans in question.correct_indexes():
             # Subtract 1 from the answer index since options are 0-based
-            print(f"{Colors.GREEN}- {question['options'][ans-1]}{Colors.ENDC}")
+            print(f"{Colors.GREEN}- {question.options[ans-1]}{Colors.ENDC}")
     else:
-        # For single choice questions, correct is a single number
-        correct_idx = question['correct'] if isinstance(question['correct'], int) else question['correct'][0]
-        print(f"{Colors.GREEN}Correct answer: {question['options'][correct_idx-1]}{Colors.ENDC}")
+        correct_idx = question.correct_indexes()[0]
+        print(f"{Colors.GREEN}Correct answer: {question.options[correct_idx-1]}{Colors.ENDC}")
 
 
 class QCMApp:
-    def __init__(self):
-        self.data_dir = "qcm_data"
+    def __init__(self, data_dir: str = "qcm_data", qcms_file: str = "qcms.json", storage: str = None):
+        self.data_dir = data_dir
+        self.qcms_file = qcms_file
         os.makedirs(self.data_dir, exist_ok=True)
+        # Timed only when metrics are enabled, see qcm_metrics
+        metrics.instrument(self, ('register', 'login', 'take_qcm', 'take_adaptive_quiz', 'find_qcm', 'save_data', 'load_data',
+                                 'display_leaderboard'))
         
-        # Load QCMs directly from qcms.json
-        self.qcms = self.load_data('qcms.json', {})
-        self.users = self.load_data(os.path.join(self.data_dir, 'users.json'), {})
-        self.history = self.load_data(os.path.join(self.data_dir, 'history.json'), {})
-        self.user_scores = self.load_data(os.path.join(self.data_dir, 'scores.json'), {})
+        # Only the bank index is read here, each QCM is loaded on first use (qcms.json seeds the bank)
+        self.qcms = QuestionBank(os.path.join(self.data_dir, 'bank'), self.qcms_file,
+                                 load=self.load_data, save=self.save_data)
+        # Correct answers compiled once per QCM into bitmasks, see qcm_grading. A key leaves with the
+        # cached questions it was compiled from, so it is bounded by the bank cache and never outlives a rewrite
+        self.answer_keys = {}
+        self.qcms.subscribe(lambda qcm: self.answer_keys.pop(qcm, None))
+        # Users, history and scores live behind a storage backend: 'json' (default) or 'sqlite'
+        self.storage = open_storage(storage or os.environ.get('QCM_STORAGE', 'json'),
+                                    self.data_dir, self.load_data)
+        self.leaderboards = LeaderboardIndex(self.storage)
+        self.auth = Authenticator(self.storage)
+        self.reports = ReportIndex(self.storage, self.answer_key)
+        self.stats = StatsIndex(self.storage)
+        self.difficulty = DifficultyIndex(self.storage, self.answer_key)
+        self.quizgen = QuizGenerator(self.qcms, self.difficulty)
+        # Full-text index of titles, questions and options, built in the background from now, see qcm_search
+        self.search = SearchIndex(self.qcms)
+        self.search.start()
+        # Indexes follow every stored event, including those written by other processes
+        self.storage.subscribe(self.apply_event)
+        # Sessions hold the quiz state, the terminal menu is only one of their clients
+        self.engine = QuizEngine(self)
         self.current_user = None
+        metrics.instrument(self.engine, ('start', 'submit', 'finish'), 'engine_')
+        metrics.instrument(self.auth, ('hash_async', 'verify_async'), 'auth_')
+        metrics.gauge('active_sessions', lambda: len(self.engine.sessions))
 
     def load_data(self, filename: str, default: Any) -> Any:
         try:
@@ -103,40 +184,103 @@ class QCMApp:
 
     def save_data(self, filename: str, data: Any):
         try:
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=4, ensure_ascii=False)
+            save_json(filename, data)
         except Exception as e:
             print(f"{Colors.RED}Error saving data: {str(e)}{Colors.ENDC}")
 
+    def close(self):
+        """Flush pending writes of the storage backend"""
+        self.search.close()
+        self.auth.close()
+        self.storage.close()
+        metrics.dump()
+
     def register(self, username: str, password: str) -> tuple[bool, str]:
-        if username in self.users:
+        if self.storage.user_exists(username):
             return False, f"{Colors.RED}Username already exists!{Colors.ENDC}"
-        self.users[username] = password
-        self.history[username] = []
-        self.user_scores[username] = {'total_score': 0, 'quizzes_taken': 0}
-        self.save_data(os.path.join(self.data_dir, 'users.json'), self.users)
-        self.save_data(os.path.join(self.data_dir, 'history.json'), self.history)
-        self.save_data(os.path.join(self.data_dir, 'scores.json'), self.user_scores)
+        try:
+            self.add_user(username, self.auth.hash(password))
+        except ValueError as e:
+            return False, f"{Colors.RED}{e}{Colors.ENDC}"
         return True, f"{Colors.GREEN}Registration successful!{Colors.ENDC}"
 
+    def answer_key(self, category: str, title: str) -> AnswerKey:
+        """Compiled answers of a QCM, None if it does not exist"""
+        key = self.answer_keys.get((category, title))
+        if key is None:
+            if category not in self.qcms or title not in self.qcms[category]:
+                return None
+            key = self.answer_keys[(category, title)] = AnswerKey(self.qcms[category][title])
+        return key
+
+    def add_user(self, username: str, password_hash: str):
+        """Create an account from an already hashed password, see qcm_auth"""
+        self.storage.add_user(username, password_hash)
+
+    def authenticate(self, username: str, password: str) -> bool:
+        return self.auth.verify(username, password) is not None
+
     def login(self, username: str, password: str) -> tuple[bool, str]:
-        if username in self.users and self.users[username] == password:
+        if self.authenticate(username, password):
             self.current_user = username
             return True, f"{Colors.GREEN}Welcome back, {username}!{Colors.ENDC}"
         return False, f"{Colors.RED}Invalid username or password!{Colors.ENDC}"
 
+    def record_attempt(self, username: str, result: dict):
+        """Store a finished attempt and update the running scores"""
+        self.record_attempts([(username, result)])
+
+    def record_attempts(self, attempts: list):
+        self.storage.record_attempts(attempts)
+
+    def apply_event(self, event: dict):
+        """Keep the leaderboards and reports in sync with one stored event"""
+        if event['op'] == 'register':
+            self.leaderboards.add_user(event['user'])
+        elif event['op'] == 'attempt':
+            self.leaderboards.record(event['user'], event['result'])
+            self.reports.record(event['user'], event['result'])
+            self.stats.record(event['user'], event['result'])
+            self.difficulty.record(event['user'], event['result'])
+        elif event['op'] == 'replace':
+            for index in (self.leaderboards, self.reports, self.stats, self.difficulty):
+                index.replace(event['user'], event['result'])
+        elif event['op'] == 'scores':
+            self.leaderboards.set_scores(event['user'], event['total_score'], event['quizzes_taken'])
+
     def take_qcm(self, category: str, title: str, time_limit: int = 200 ) -> tuple[bool, str]: #that time is for testing we will take it later dont forget guys
         if not self.current_user:
             return False, f"{Colors.RED}Please login first!{Colors.ENDC}"
 
-        if category not in self.qcms or title not in self.qcms[category]:
-            return False, f"{Colors.RED}QCM not found!{Colors.ENDC}"
+        try:
+            session = self.engine.start(self.current_user, category, title, time_limit)
+        except KeyError as e:
+            return False, f"{Colors.RED}{e.args[0]}{Colors.ENDC}"
+        return self.run_session(session)
 
-        questions = self.qcms[category][title]
-        score = 0
-        user_answers = []
-        start_time = time.time()
-        end_time = start_time + time_limit
+    def take_adaptive_quiz(self, pool: str, count: int = 10, time_limit: int = 200) -> tuple[bool, str]:
+        """Quiz of `count` questions drawn from a category (or a "#tag"), favouring the ones often missed"""
+        if not self.current_user:
+            return False, f"{Colors.RED}Please login first!{Colors.ENDC}"
+        if pool.startswith('#'):
+            if not self.qcms.tag_questions(pool[1:]):
+                return False, f"{Colors.RED}Unknown tag: {pool}{Colors.ENDC}"
+            questions, sources = self.quizgen.generate(self.current_user, count, tag=pool[1:])
+        elif pool in self.qcms:
+            questions, sources = self.quizgen.generate(self.current_user, count, category=pool)
+        else:
+            return False, f"{Colors.RED}Unknown category: {pool}{Colors.ENDC}"
+        try:
+            session = self.engine.start_generated(self.current_user, pool, ADAPTIVE_TITLE, questions,
+                                                  sources, time_limit)
+        except KeyError as e:
+            return False, f"{Colors.RED}{e.args[0]}{Colors.ENDC}"
+        return self.run_session(session)
+
+    def run_session(self, session) -> tuple[bool, str]:
+        """Ask the questions of a started session in the terminal and show the result"""
+        category, title, time_limit = session.category, session.title, session.time_limit
+        questions = session.questions
 
         clear_screen()
         print_fancy(f"🎯 Starting QCM: {title}", Colors.YELLOW, bold=True)
@@ -144,53 +288,44 @@ class QCMApp:
         print_fancy(f"Total questions: {len(questions)}\n", Colors.BLUE)
         print_fancy(f"⏳ You have {time_limit // 60} minutes to complete the quiz.\n", Colors.RED)
 
-        for i, q in enumerate(questions, 1):
-            # this is the function that calculates the time and if it runs out its stops and then it stops the quiz
-            remaining_time = int(end_time - time.time())
-            if remaining_time <= 0:
-                print_fancy("⏰ Time's up! Quiz stopped.", Colors.RED)
+        while True:
+            q = session.next_question()
+            if q is None:
+                # this is where the time limit stops the quiz
+                if session.expired():
+                    print_fancy("⏰ Time's up! Quiz stopped.", Colors.RED)
                 break
 
-            print(f"\n{Colors.BOLD}Question {i}/{len(questions)}{Colors.ENDC}")
-            print(f"{Colors.YELLOW}{q['question']}{Colors.ENDC}\n")
+            print(f"\n{Colors.BOLD}Question {session.index + 1}/{len(questions)}{Colors.ENDC}")
+            print(f"{Colors.YELLOW}{q.question}{Colors.ENDC}\n")
 
-            for j, option in enumerate(q['options'], 1):
+            for j, option in enumerate(q.options, 1):
                 print(f"{Colors.BLUE}{j}. {option}{Colors.ENDC}")
 
-            print(f"\n{Colors.YELLOW}⏳ Time remaining: {remaining_time} seconds{Colors.ENDC}")
+            print(f"\n{Colors.YELLOW}⏳ Time remaining: {session.remaining_time()} seconds{Colors.ENDC}")
             answer = handle_question_input(q)
-            user_answers.append(answer)
 
-            if check_answer(q, answer):
-                score += 1
+            try:
+                correct = self.engine.submit(session.id, answer)
+            except ValueError:
+                if not session.expired():
+                    raise
+                # Answered after the time limit: not counted, the quiz stops with the answers given in time
+                print_fancy("⏰ Time's up! Quiz stopped.", Colors.RED)
+                break
+            if correct:
                 print(f"{Colors.GREEN}✓ Correct!{Colors.ENDC}")
             else:
                 print(f"{Colors.RED}✗ Incorrect!{Colors.ENDC}")
                 print("\nThe correct answer(s):")
                 display_correct_answer(q)
 
-            time.sleep(1)
-
-        time_taken = time.time() - start_time
-        percentage = (score / len(questions)) * 100
+            pause(1)
 
-        self.user_scores[self.current_user]['total_score'] += percentage
-        self.user_scores[self.current_user]['quizzes_taken'] += 1
-        self.save_data(os.path.join(self.data_dir, 'scores.json'), self.user_scores)
-
-        result = {
-            'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'category': category,
-            'title': title,
-            'score': percentage,
-            'time_taken': time_taken,
-            'answers': user_answers,
-            'total_questions': len(questions),
-            'correct_answers': score
-        }
-
-        self.history[self.current_user].append(result)
-        self.save_data(os.path.join(self.data_dir, 'history.json'), self.history)
+        result = self.engine.finish(session.id)
+        percentage = result['score']
+        time_taken = result['time_taken']
+        score = result['correct_answers']
 
         clear_screen()
         print_fancy("🎉 Quiz Completed! 🎉", Colors.YELLOW, bold=True)
@@ -201,17 +336,26 @@ class QCMApp:
         self.display_leaderboard()
         return True, ""
 
-    def view_history(self) -> tuple[bool, Any]:
+    def view_history(self, page: int = 0, page_size: int = 10) -> tuple[bool, Any]:
+        """One page of the current user's attempts, most recent first"""
         if not self.current_user:
             return False, f"{Colors.RED}Please login first!{Colors.ENDC}"
         
-        user_history = self.history[self.current_user]
+        user_history = self.storage.history_page(self.current_user, page * page_size, page_size)
         if not user_history:
             return False, f"{Colors.YELLOW}No history found!{Colors.ENDC}"
         
         return True, user_history
+
+    def user_stats(self) -> UserStats:
+        """Precomputed statistics of the current user, see qcm_stats"""
+        return self.stats.get(self.current_user)
     
 
+    def find_qcm(self, query: str, limit: int = 10) -> List[SearchHit]:
+        """QCMs matching every word of the query (prefixes and typos included), best first"""
+        return self.search.search(query, limit)
+
     def show_correct_answers(self, category: str, title: str) -> tuple[bool, str]:
         if category not in self.qcms or title not in self.qcms[category]:
             return False, f"{Colors.RED}QCM not found!{Colors.ENDC}"
@@ -219,43 +363,117 @@ class QCMApp:
         questions = self.qcms[category][title]
         print_fancy(f"\n📝 Correct answers for {title}:", Colors.YELLOW, bold=True)
         for i, q in enumerate(questions, 1):
-            print(f"\n{Colors.BOLD}Question {i}:{Colors.ENDC} {q['question']}")
+            print(f"\n{Colors.BOLD}Question {i}:{Colors.ENDC} {q.question}")
             display_correct_answer(q)
         return True, ""
 
-    def display_leaderboard(self):
-        print_fancy("\n📊 LEADERBOARD 📊", Colors.YELLOW, bold=True)
-        sorted_scores = sorted(
-            self.user_scores.items(),
-            key=lambda x: x[1]['total_score'] / max(x[1]['quizzes_taken'], 1),
-            reverse=True
-        )
-        for i, (user, stats) in enumerate(sorted_scores[:5], 1):
-            avg_score = stats['total_score'] / max(stats['quizzes_taken'], 1)
+    def display_leaderboard(self, category: str = None, title: str = None):
+        board = self.leaderboards.board(category, title)
+        scope = f" - {category}" if category else ""
+        scope += f" / {title}" if category and title else ""
+        print_fancy(f"\n📊 LEADERBOARD{scope} 📊", Colors.YELLOW, bold=True)
+        for i, (user, avg_score) in enumerate(board.top(5), 1):
             print(f"{Colors.BLUE}{i}. {user}: {Colors.GREEN}{avg_score:.1f}%{Colors.ENDC}")
+        rank = board.rank(self.current_user) if self.current_user else None
+        if rank:
+            print(f"{Colors.YELLOW}You are #{rank} of {len(board)}{Colors.ENDC}")
+
+RESULTS_PAGE_SIZE = 20
+
+
+def print_search_hits(app, hits: List[SearchHit]):
+    for i, (_, category, title, index) in enumerate(hits, 1):
+        print(f"{Colors.BLUE}{i}. {category} / {title}{Colors.ENDC}")
+        if index is not None:
+            print(f"   {app.qcms[category][title][index].question}")
+
+
+def display_user_stats(stats: UserStats):
+    print_fancy("\n📈 Your Statistics:", Colors.YELLOW, bold=True)
+    print(f"{Colors.BLUE}Quizzes taken: {stats.attempts}   Average: {stats.average:.1f}%   "
+          f"Streak: {stats.streak} (best {stats.best_streak}){Colors.ENDC}")
+    for category, average in sorted(stats.category_averages().items()):
+        print(f"{Colors.GREEN}{category}:{Colors.ENDC} {average:.1f}% average")
+        for (qcm_category, title), qcm in sorted(stats.qcms.items()):
+            if qcm_category == category:
+                print(f"  - {title}: best {qcm.best:.1f}%, last {qcm.last:.1f}%, "
+                      f"average {qcm.average:.1f}% over {qcm.attempts} attempt(s)")
+
+
+def ask_report_filters() -> dict:
+    """Demande les filtres d'un rapport, une réponse vide ignore le filtre."""
+    print(f"\n{Colors.BLUE}Filtres (laissez vide pour tout afficher) :{Colors.ENDC}")
+    filters = {}
+    for name, label in (('username', "Étudiant"), ('category', "Catégorie"), ('title', "Titre"),
+                        ('date_from', "Depuis le (AAAA-MM-JJ)"), ('date_to', "Jusqu'au (AAAA-MM-JJ)")):
+        filters[name] = input(f"{Colors.GREEN}{label} : {Colors.ENDC}").strip() or None
+    return filters
+
 
 def display_student_results(app):
     clear_screen()
     print_fancy("📊 Résultats des Étudiants 📊", Colors.YELLOW, bold=True)
+    filters = ask_report_filters()
+
+    # Les tentatives sont lues page par page, jamais toutes à la fois
+    shown = 0
+    for page in iter_pages(iter_attempts(app.storage, **filters), RESULTS_PAGE_SIZE):
+        for username, result in page:
+            shown += 1
+            print(f"\n{Colors.BLUE}Étudiant : {username}{Colors.ENDC}")
+            print(f"  - {Colors.GREEN}Date :{Colors.ENDC} {result['date']}")
+            print(f"    {Colors.GREEN}Catégorie :{Colors.ENDC} {result['category']}")
+            print(f"    {Colors.GREEN}Titre :{Colors.ENDC} {result['title']}")
+            print(f"    {Colors.GREEN}Score :{Colors.ENDC} {result['score']}%")
+            print(f"    {Colors.GREEN}Réponses correctes :{Colors.ENDC} {result['answers']}")
+        more = input(f"\n{Colors.YELLOW}Entrée pour la page suivante, q pour revenir au menu : {Colors.ENDC}")
+        if more.strip().lower() == 'q':
+            return
 
-    if not app.history:
+    if not shown:
         print(f"{Colors.RED}Aucun résultat trouvé !{Colors.ENDC}")
-        time.sleep(2)
-        return
+    input(f"\n{Colors.YELLOW}Appuyez sur Entrée pour retourner au menu...{Colors.ENDC}")
 
-    # Parcourt l'historique des étudiants
-    for username, results in app.history.items():
-        print(f"\n{Colors.BLUE}Étudiant : {username}{Colors.ENDC}")
-        if not results:
-            print(f"{Colors.RED}Aucun QCM complété.{Colors.ENDC}")
-        else:
-            for result in results:
-                print(f"  - {Colors.GREEN}Date :{Colors.ENDC} {result['date']}")
-                print(f"    {Colors.GREEN}Catégorie :{Colors.ENDC} {result['category']}")
-                print(f"    {Colors.GREEN}Titre :{Colors.ENDC} {result['title']}")
-                print(f"    {Colors.GREEN}Score :{Colors.ENDC} {result['score']}%")
-                print(f"    {Colors.GREEN}Réponses correctes :{Colors.ENDC} {result['answers']}")
+
+def display_qcm_statistics(app):
+    """Affiche les statistiques précalculées de chaque QCM."""
+    clear_screen()
+    print_fancy("📈 Statistiques par QCM 📈", Colors.YELLOW, bold=True)
+    category = input(f"\n{Colors.GREEN}Catégorie (laissez vide pour toutes) : {Colors.ENDC}").strip() or None
+
+    aggregates = sorted(app.reports.all().items())
+    if category:
+        aggregates = [(qcm, aggregate) for qcm, aggregate in aggregates if qcm[0] == category]
+    if not aggregates:
+        print(f"{Colors.RED}Aucun résultat trouvé !{Colors.ENDC}")
+
+    for (qcm_category, title), aggregate in aggregates:
+        print(f"\n{Colors.BLUE}{qcm_category} - {title}{Colors.ENDC} ({aggregate.count} tentatives)")
+        print(f"    {Colors.GREEN}Moyenne :{Colors.ENDC} {aggregate.mean():.1f}%   "
+              f"{Colors.GREEN}Médiane :{Colors.ENDC} {aggregate.median():.1f}%   "
+              f"{Colors.GREEN}Temps moyen :{Colors.ENDC} {aggregate.mean_time():.1f} s")
+        for i, rate in enumerate(aggregate.success_rates(), 1):
+            rate_text = f"{rate:.1f}%" if rate is not None else "-"
+            print(f"    {Colors.GREEN}Question {i} :{Colors.ENDC} {rate_text} de réussite")
+        distribution = ", ".join(f"{label}: {count}" for label, count in aggregate.time_distribution())
+        print(f"    {Colors.GREEN}Temps :{Colors.ENDC} {distribution}")
     input(f"\n{Colors.YELLOW}Appuyez sur Entrée pour retourner au menu...{Colors.ENDC}")
+
+
+def export_student_results(app):
+    """Exporte les résultats filtrés dans un fichier CSV, écrit au fil de l'eau."""
+    print_fancy("\n💾 Export CSV", Colors.YELLOW, bold=True)
+    filters = ask_report_filters()
+    filename = input(f"{Colors.GREEN}Fichier CSV (resultats.csv par défaut) : {Colors.ENDC}").strip() or "resultats.csv"
+    try:
+        with open(filename, 'w', encoding='utf-8', newline='') as f:
+            count = export_csv(iter_attempts(app.storage, **filters), f)
+        print(f"{Colors.GREEN}{count} résultats exportés dans {filename}{Colors.ENDC}")
+    except OSError as e:
+        print(f"{Colors.RED}Erreur : {str(e)}{Colors.ENDC}")
+    input(f"\n{Colors.YELLOW}Appuyez sur Entrée pour retourner au menu...{Colors.ENDC}")
+
+
 def add_qcm(app):
     """Permet au professeur d'ajouter une nouvelle catégorie ou un nouveau titre avec des questions."""
     print_fancy("\n🔧 Professeur - Ajouter un QCM", Colors.YELLOW, bold=True)
@@ -285,7 +503,6 @@ def add_qcm(app):
         if category in app.qcms:
             print(f"{Colors.RED}Cette catégorie existe déjà!{Colors.ENDC}")
             return
-        app.qcms[category] = {}
 
     else:
         print(f"{Colors.RED}Choix invalide!{Colors.ENDC}")
@@ -293,15 +510,23 @@ def add_qcm(app):
 
     # Ajouter un nouveau titre à la catégorie
     title = input(f"\n{Colors.GREEN}Entrez le titre du nouveau QCM: {Colors.ENDC}")
-    if title in app.qcms[category]:
+    if category in app.qcms and title in app.qcms[category]:
         print(f"{Colors.RED}Ce titre existe déjà dans la catégorie!{Colors.ENDC}")
         return
 
-    app.qcms[category][title] = []
+    questions = []
 
     print_fancy("\nAjout des questions pour le titre.", Colors.YELLOW)
     while True:
         question_text = input(f"\n{Colors.GREEN}Entrez la question: {Colors.ENDC}")
+        similar = app.search.similar_questions(question_text)
+        if similar:
+            print(f"{Colors.YELLOW}Questions similaires déjà dans la banque :{Colors.ENDC}")
+            for _, other_category, other_title, index in similar:
+                print(f"{Colors.YELLOW}- {other_category} / {other_title} : "
+                      f"{app.qcms[other_category][other_title][index].question}{Colors.ENDC}")
+            if input(f"{Colors.GREEN}Garder quand même cette question ? (o/n): {Colors.ENDC}").lower() != 'o':
+                continue
         options = []
 
         print(f"\n{Colors.BLUE}Ajoutez les options (entrez une option vide pour arrêter):{Colors.ENDC}")
@@ -322,7 +547,7 @@ def add_qcm(app):
         correct_answers = list(map(int, correct_answers.split()))
 
         question_type = "multiple" if len(correct_answers) > 1 else "single"
-        app.qcms[category][title].append({
+        questions.append({
             "question": question_text,
             "options": options,
             "correct": correct_answers,
@@ -333,10 +558,21 @@ def add_qcm(app):
         if another != 'o':
             break
 
-    # Sauvegarder les modifications
-    app.save_data('qcms.json', app.qcms)
+    # Sauvegarder les modifications (seul ce QCM est écrit)
+    app.qcms.save_qcm(category, title, questions)
     print_fancy("\n✅ QCM ajouté avec succès!", Colors.GREEN)
 
+def search_qcms(app):
+    """Recherche des QCM par mots du titre, des questions ou des options."""
+    query = input(f"\n{Colors.GREEN}Rechercher : {Colors.ENDC}")
+    hits = app.find_qcm(query)
+    if hits:
+        print_fancy(f"\n🔎 {len(hits)} QCM trouvé(s) :", Colors.YELLOW, bold=True)
+        print_search_hits(app, hits)
+    else:
+        print(f"{Colors.RED}Aucun QCM ne correspond.{Colors.ENDC}")
+    input(f"\n{Colors.YELLOW}Appuyez sur Entrée pour continuer...{Colors.ENDC}")
+
 def display_menu_professeur(app):
     """Affiche le menu pour l'espace professeur."""
     while True:
@@ -344,9 +580,12 @@ def display_menu_professeur(app):
         print_fancy("👨‍🏫 Espace Professeur 👩‍🏫", Colors.YELLOW, bold=True)
         print(f"{Colors.BLUE}1.{Colors.ENDC} Voir les résultats des étudiants")
         print(f"{Colors.BLUE}2.{Colors.ENDC} Ajouter un QCM")
-        print(f"{Colors.RED}3.{Colors.ENDC} Retour au menu principal")
+        print(f"{Colors.BLUE}3.{Colors.ENDC} Statistiques par QCM")
+        print(f"{Colors.BLUE}4.{Colors.ENDC} Exporter les résultats en CSV")
+        print(f"{Colors.BLUE}5.{Colors.ENDC} Rechercher un QCM")
+        print(f"{Colors.RED}6.{Colors.ENDC} Retour au menu principal")
 
-        choice = input(f"\n{Colors.GREEN}Entrez votre choix (1-3) : {Colors.ENDC}")
+        choice = input(f"\n{Colors.GREEN}Entrez votre choix (1-6) : {Colors.ENDC}")
 
         if choice == '1':
             # Voir les résultats des étudiants
@@ -355,11 +594,17 @@ def display_menu_professeur(app):
                         # Ajouter un QCM
             add_qcm(app)
         elif choice == '3':
+            display_qcm_statistics(app)
+        elif choice == '4':
+            export_student_results(app)
+        elif choice == '5':
+            search_qcms(app)
+        elif choice == '6':
             # Retour au menu principal
             break
         else:
             print(f"{Colors.RED}Choix invalide. Veuillez réessayer.{Colors.ENDC}")
-            time.sleep(1)
+            pause(1)
 
 
 def display_menu_student(app):
@@ -369,31 +614,33 @@ def display_menu_student(app):
         print(f"{Colors.BLUE}1.{Colors.ENDC} Register")
         print(f"{Colors.BLUE}2.{Colors.ENDC} Login")
         print(f"{Colors.BLUE}3.{Colors.ENDC} Take QCM")
-        print(f"{Colors.BLUE}4.{Colors.ENDC} View History")
-        print(f"{Colors.BLUE}5.{Colors.ENDC} Show Correct Answers")
-        print(f"{Colors.BLUE}6.{Colors.ENDC} View Leaderboard")
-        print(f"{Colors.RED}7.{Colors.ENDC} Retour au menu principal")
+        print(f"{Colors.BLUE}4.{Colors.ENDC} Adaptive Quiz")
+        print(f"{Colors.BLUE}5.{Colors.ENDC} View History")
+        print(f"{Colors.BLUE}6.{Colors.ENDC} Show Correct Answers")
+        print(f"{Colors.BLUE}7.{Colors.ENDC} View Leaderboard")
+        print(f"{Colors.BLUE}8.{Colors.ENDC} Find QCM")
+        print(f"{Colors.RED}9.{Colors.ENDC} Retour au menu principal")
 
-        choice = input(f"\n{Colors.GREEN}Enter your choice (1-7): {Colors.ENDC}")
+        choice = input(f"\n{Colors.GREEN}Enter your choice (1-9): {Colors.ENDC}")
 
         if choice == '1':
             username = input(f"\n{Colors.BLUE}Enter username: {Colors.ENDC}")
             password = getpass.getpass(f"{Colors.BLUE}Enter password: {Colors.ENDC}")
             success, message = app.register(username, password)
             print(message)
-            time.sleep(1)
+            pause(1)
 
         elif choice == '2':
             username = input(f"\n{Colors.BLUE}Enter username: {Colors.ENDC}")
             password = getpass.getpass(f"{Colors.BLUE}Enter password: {Colors.ENDC}")
             success, message = app.login(username, password)
             print(message)
-            time.sleep(1)
+            pause(1)
 
         elif choice == '3':
             if not app.current_user:
                 print(f"{Colors.RED}Please login first!{Colors.ENDC}")
-                time.sleep(1)
+                pause(1)
                 continue
 
             print_fancy("\nAvailable Categories:", Colors.YELLOW)
@@ -413,26 +660,54 @@ def display_menu_student(app):
                 input(f"\n{Colors.YELLOW}Press Enter to continue...{Colors.ENDC}")
             else:
                 print(f"{Colors.RED}Category not found!{Colors.ENDC}")
-                time.sleep(1)
+                pause(1)
 
         elif choice == '4':
+            if not app.current_user:
+                print(f"{Colors.RED}Please login first!{Colors.ENDC}")
+                pause(1)
+                continue
+
+            print_fancy("\nAvailable Categories:", Colors.YELLOW)
+            for category in app.qcms:
+                print(f"{Colors.BLUE}- {category}{Colors.ENDC}")
+
+            pool = input(f"\n{Colors.GREEN}Enter a category or a #tag: {Colors.ENDC}").strip()
+            count = input(f"{Colors.GREEN}Number of questions (default 10): {Colors.ENDC}").strip()
+            success, message = app.take_adaptive_quiz(pool, int(count) if count.isdigit() and int(count) > 0 else 10)
+            if message:
+                print(message)
+            input(f"\n{Colors.YELLOW}Press Enter to continue...{Colors.ENDC}")
+
+        elif choice == '5':
             success, history = app.view_history()
-            if success:
-                print_fancy("\n📜 Your QCM History:", Colors.YELLOW, bold=True)
+            if not success:
+                print(history)
+                input(f"\n{Colors.YELLOW}Press Enter to continue...{Colors.ENDC}")
+                continue
+            display_user_stats(app.user_stats())
+            page = 0
+            while success:
+                print_fancy(f"\n📜 Your QCM History (page {page + 1}, most recent first):", Colors.YELLOW, bold=True)
                 for entry in history:
                     print(f"\n{Colors.BLUE}Date: {entry['date']}")
                     print(f"QCM: {entry['category']} - {entry['title']}")
                     print(f"Score: {entry['score']:.1f}%")
                     print(f"Correct answers: {entry['correct_answers']}/{entry['total_questions']}")
                     print(f"Time taken: {entry['time_taken']:.1f} seconds{Colors.ENDC}")
+                more = input(f"\n{Colors.YELLOW}Press Enter for older attempts, q to go back: {Colors.ENDC}")
+                if more.strip().lower() == 'q':
+                    break
+                page += 1
+                success, history = app.view_history(page)
             else:
-                print(history)
-            input(f"\n{Colors.YELLOW}Press Enter to continue...{Colors.ENDC}")
+                print(f"{Colors.YELLOW}No older attempts.{Colors.ENDC}")
+                input(f"\n{Colors.YELLOW}Press Enter to continue...{Colors.ENDC}")
 
-        elif choice == '5':
+        elif choice == '6':
             if not app.current_user:
                 print(f"{Colors.RED}Please login first!{Colors.ENDC}")
-                time.sleep(1)
+                pause(1)
                 continue
 
             print_fancy("\nAvailable Categories:", Colors.YELLOW)
@@ -453,16 +728,40 @@ def display_menu_student(app):
                 print(f"{Colors.RED}Category not found!{Colors.ENDC}")
             input(f"\n{Colors.YELLOW}Press Enter to continue...{Colors.ENDC}")
 
-        elif choice == '6':
-            app.display_leaderboard()
+        elif choice == '7':
+            category = input(f"\n{Colors.GREEN}Category (leave empty for overall): {Colors.ENDC}").strip() or None
+            title = None
+            if category:
+                title = input(f"{Colors.GREEN}QCM title (leave empty for the whole category): {Colors.ENDC}").strip() or None
+            app.display_leaderboard(category, title)
             input(f"\n{Colors.YELLOW}Press Enter to continue...{Colors.ENDC}")
 
-        elif choice == '7':
+        elif choice == '8':
+            query = input(f"\n{Colors.GREEN}Search (title, question or option words): {Colors.ENDC}")
+            hits = app.find_qcm(query)
+            if not hits:
+                print(f"{Colors.RED}No QCM found!{Colors.ENDC}")
+                input(f"\n{Colors.YELLOW}Press Enter to continue...{Colors.ENDC}")
+                continue
+            print_fancy(f"\n🔎 {len(hits)} QCM(s) found:", Colors.YELLOW, bold=True)
+            print_search_hits(app, hits)
+            if not app.current_user:
+                input(f"\n{Colors.YELLOW}Login to take one. Press Enter to continue...{Colors.ENDC}")
+                continue
+            number = input(f"\n{Colors.GREEN}Number of the QCM to take (Enter to go back): {Colors.ENDC}").strip()
+            if number.isdigit() and 1 <= int(number) <= len(hits):
+                _, category, title, _ = hits[int(number) - 1]
+                success, message = app.take_qcm(category, title)
+                if message:
+                    print(message)
+                input(f"\n{Colors.YELLOW}Press Enter to continue...{Colors.ENDC}")
+
+        elif choice == '9':
             break
 
         else:
             print(f"{Colors.RED}Invalid choice! Please try again.{Colors.ENDC}")
-            time.sleep(1)
+            pause(1)
 
 
 def display_menu(app):
@@ -484,15 +783,78 @@ def display_menu(app):
             display_menu_professeur(app)
         elif choice == '3':
             print_fancy("\n👋 Merci d'avoir utilisé l'application QCM ! Au revoir !", Colors.GREEN, bold=True)
-            time.sleep(1)
+            pause(1)
             break
         else:
             print(f"{Colors.RED}Choix invalide. Veuillez réessayer.{Colors.ENDC}")
-            time.sleep(1)
+            pause(1)
+def grade_sheets(app, args):
+    """Note un fichier de feuilles de réponses sans passer par les menus, renvoie le code de sortie."""
+    if args.category not in app.qcms or args.title not in app.qcms[args.category]:
+        print(f"{Colors.RED}QCM not found: {args.category} / {args.title}{Colors.ENDC}")
+        return 2
+    try:
+        with open(args.sheets, 'r', encoding='utf-8', newline='') as sheets_file:
+            results_file = open(args.results, 'w', encoding='utf-8') if args.results else None
+            try:
+                report = run_batch(app, args.category, args.title, sheets_file, args.format,
+                                   args.batch_size, results_file)
+            finally:
+                if results_file:
+                    results_file.close()
+    except OSError as e:
+        print(f"{Colors.RED}{e.filename or args.sheets}: {e.strerror or e}{Colors.ENDC}")
+        return 2
+    print(f"{report['sheets']} sheets graded in {report['seconds']:.2f} s "
+          f"({report['sheets_per_second']:.0f} sheets/s, {report['microseconds_per_sheet']:.1f} µs/sheet)")
+    print(f"Mean score: {report['mean_score']:.1f}%")
+    if report['rejected']:
+        print(f"{Colors.YELLOW}{report['rejected']} sheets rejected:{Colors.ENDC}")
+        for number, reason in report['rejected_lines']:
+            print(f"  line {number}: {reason}")
+        if report['rejected'] > len(report['rejected_lines']):
+            print(f"  ... and {report['rejected'] - len(report['rejected_lines'])} more")
+        return 1
+    return 0
+
+
 def main():
     """Point d'entrée principal de l'application."""
-    app = QCMApp()  # Crée une instance de l'application
-    display_menu(app)  # Appelle le menu principal
+    parser = argparse.ArgumentParser(description="Application QCM")
+    parser.add_argument('--data-dir', default='qcm_data')
+    parser.add_argument('--qcms', default='qcms.json')
+    parser.add_argument('--storage', choices=['json', 'sqlite'], default=None)
+    subcommands = parser.add_subparsers(dest='command')
+    grade = subcommands.add_parser('grade', help="Grade a file of answer sheets (JSONL or CSV) against one QCM")
+    grade.add_argument('category')
+    grade.add_argument('title')
+    grade.add_argument('sheets')
+    grade.add_argument('--format', choices=['jsonl', 'csv'], default=None,
+                       help="Defaults to the file extension")
+    grade.add_argument('--batch-size', type=int, default=10000)
+    grade.add_argument('--results', help="Write one JSON line per graded sheet to this file")
+    parser.add_argument('--metrics', help="Enable instrumentation and write it to this file on exit (.prom or .json)")
+    parser.add_argument('--profile-session', help="Write cProfile stats of the next quiz taken to this file")
+    args = parser.parse_args()
+
+    if args.metrics:
+        metrics.enable(args.metrics)
+    if args.profile_session:
+        if not metrics.enabled:
+            metrics.enable()
+        metrics.profile_next('take_qcm', args.profile_session)
+
+    app = QCMApp(args.data_dir, args.qcms, args.storage)  # Crée une instance de l'application
+    status = 0
+    try:
+        if args.command == 'grade':
+            args.format = args.format or ('csv' if args.sheets.endswith('.csv') else 'jsonl')
+            status = grade_sheets(app, args)
+        else:
+            display_menu(app)  # Appelle le menu principal
+    finally:
+        app.close()  # Enregistre les écritures en attente (journal des tentatives, base SQLite)
+    sys.exit(status)
 
 
 if __name__ == "__main__":
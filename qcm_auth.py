@@ -0,0 +1,150 @@
+"""Password hashing and verification for QCMApp.
+
+Passwords are stored as salted scrypt hashes:
+
+    scrypt$<n>$<r>$<p>$<salt, base64>$<hash, base64>
+
+Accounts created before hashing still hold their plaintext password; they
+are rehashed the first time their owner logs in successfully.
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, Optional, Tuple
+
+from qcm_storage import StorageBackend
+
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_BYTES = 16
+HASH_BYTES = 32
+PREFIX = 'scrypt$'
+
+
+def hash_password(password: str, n: int = SCRYPT_N, r: int = SCRYPT_R, p: int = SCRYPT_P) -> str:
+    salt = os.urandom(SALT_BYTES)
+    digest = hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p, dklen=HASH_BYTES)
+    return '$'.join([
+        'scrypt', str(n), str(r), str(p),
+        base64.b64encode(salt).decode('ascii'), base64.b64encode(digest).decode('ascii')
+    ])
+
+
+def verify_password(stored: str, password: str) -> Tuple[bool, bool]:
+    """Check a password against its stored form: (matches, needs to be rehashed)"""
+    if not stored.startswith(PREFIX):
+        # Legacy plaintext entry, still compared in constant time
+        return hmac.compare_digest(stored.encode('utf-8'), password.encode('utf-8')), True
+    _, n, r, p, salt, expected = stored.split('$')
+    expected = base64.b64decode(expected)
+    digest = hashlib.scrypt(password.encode('utf-8'), salt=base64.b64decode(salt),
+                            n=int(n), r=int(r), p=int(p), dklen=len(expected))
+    return hmac.compare_digest(digest, expected), (int(n), int(r), int(p)) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+
+class Authenticator:
+    """Verifies credentials against a storage backend.
+
+    Hashing is deliberately slow, so the async methods run it on a thread pool
+    and the event loop keeps serving other sessions meanwhile. Storage is only
+    touched from the caller's thread, or from `storage_executor` when the
+    server keeps storage off its event loop. Successful logins hand out a session
+    token kept in a bounded LRU cache, so a client can resume without sending
+    its password (and paying for a hash) again. With a `secret` shared by
+    several server processes, tokens are signed instead, so any of them can
+    check a token another one issued.
+    """
+
+    def __init__(self, storage: StorageBackend, workers: Optional[int] = None, cache_size: int = 10000,
+                 secret: Optional[bytes] = None, token_ttl: int = 12 * 3600):
+        self.storage = storage
+        self.secret = secret
+        self.token_ttl = token_ttl
+        self.storage_executor: Optional[Executor] = None
+        self.executor = ThreadPoolExecutor(max_workers=workers or min(4, os.cpu_count() or 1),
+                                           thread_name_prefix='qcm-auth')
+        self.cache_size = cache_size
+        self.tokens: 'OrderedDict[str, str]' = OrderedDict()
+        # Unknown users are checked against this hash so they take as long as known ones
+        self._dummy_hash = hash_password(secrets.token_hex(8))
+
+    def hash(self, password: str) -> str:
+        return hash_password(password)
+
+    def verify(self, username: str, password: str) -> Optional[str]:
+        """Check the credentials and return a session token, None if they are wrong"""
+        stored = self.storage.get_password(username)
+        ok, rehash = verify_password(stored if stored is not None else self._dummy_hash, password)
+        if not ok or stored is None:
+            return None
+        if rehash:
+            self.storage.set_password(username, hash_password(password))
+        return self.issue_token(username)
+
+    async def _storage_call(self, function: Callable[..., Any], *args) -> Any:
+        if self.storage_executor is None:
+            return function(*args)
+        return await asyncio.get_running_loop().run_in_executor(self.storage_executor, function, *args)
+
+    async def hash_async(self, password: str) -> str:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, hash_password, password)
+
+    async def verify_async(self, username: str, password: str) -> Optional[str]:
+        loop = asyncio.get_running_loop()
+        stored = await self._storage_call(self.storage.get_password, username)
+        ok, rehash = await loop.run_in_executor(
+            self.executor, verify_password, stored if stored is not None else self._dummy_hash, password
+        )
+        if not ok or stored is None:
+            return None
+        if rehash:
+            await self._storage_call(self.storage.set_password, username, await self.hash_async(password))
+        return self.issue_token(username)
+
+    def _sign(self, payload: str) -> str:
+        return hmac.new(self.secret, payload.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    def issue_token(self, username: str) -> str:
+        if self.secret is not None:
+            payload = f"{int(time.time())}:{username}"
+            return f"{base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')}.{self._sign(payload)}"
+        token = secrets.token_urlsafe(24)
+        self.tokens[token] = username
+        if len(self.tokens) > self.cache_size:
+            self.tokens.popitem(last=False)
+        return token
+
+    def check_token(self, token: str) -> Optional[str]:
+        """User of a cached session token, None if it is unknown or was evicted"""
+        if self.secret is not None:
+            return self._check_signed(token)
+        username = self.tokens.get(token)
+        if username is not None:
+            self.tokens.move_to_end(token)
+        return username
+
+    def _check_signed(self, token: str) -> Optional[str]:
+        encoded, _, signature = token.partition('.')
+        try:
+            payload = base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8')
+        except (ValueError, UnicodeError):
+            return None
+        if not hmac.compare_digest(signature, self._sign(payload)):
+            return None
+        issued, _, username = payload.partition(':')
+        if time.time() - int(issued) > self.token_ttl:
+            return None
+        return username
+
+    def revoke_token(self, token: str):
+        self.tokens.pop(token, None)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
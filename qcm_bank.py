@@ -0,0 +1,389 @@
+"""Question bank stored as an index plus one JSON file per QCM.
+
+    bank/index.jsonl         one line per QCM written: {"category", "title", "file", "questions", "tags"}
+    bank/qcms/<file>.json    the questions of that QCM
+
+Only the index is read at startup. A QCM's questions are read the first time
+they are needed and kept in a bounded LRU cache. Adding or editing a QCM
+writes its own file and appends one index line, whatever the size of the bank.
+The bank is imported once from qcms.json when it does not exist yet.
+
+"tags" maps each tag found in the questions' optional "tags" lists to the
+indexes of the questions carrying it, so tag lookups never read the QCM
+files. QCMs from index lines written before tags were recorded are read once,
+on the first lookup.
+
+Appends hold index.jsonl.lock, so several processes can share the bank; each
+one reads the lines the others appended before looking a QCM up.
+
+Loaded questions are Question records rather than the JSON dicts: text and
+options are interned, equal option lists share one tuple and the correct
+answer is a bitmask. `python qcm_bank.py memory` measures the difference.
+The shared tuples are reference counted by the cached questions and dropped
+with the last QCM using them, so the table stays bounded by the cache.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Optional, Set, Tuple, Union
+
+from qcm_storage import FileLock, load_json, save_json
+
+
+class Question:
+    """One question of the bank, read-only.
+
+    `mask` has bit i set when option i + 1 is correct, the form grading
+    compares answers against (see qcm_grading). Fields other than the four
+    known ones ('tags', ...) are kept in `extra`. question['correct'] and
+    question.get('type') still work for code written against the JSON dicts.
+    """
+
+    __slots__ = ('question', 'options', 'mask', 'multiple', 'extra')
+
+    FIELDS = ('question', 'options', 'correct', 'type')
+
+    def __init__(self, question: str, options: tuple, mask: int, multiple: bool, extra: Optional[dict] = None):
+        self.question = question
+        self.options = options
+        self.mask = mask
+        self.multiple = multiple
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, data: dict, option_sets: Dict[tuple, tuple]) -> 'Question':
+        """Record of a qcms.json question; `option_sets` holds the option tuples shared so far"""
+        options = tuple(sys.intern(option) for option in data['options'])
+        options = option_sets.setdefault(options, options)
+        multiple = data.get('type') == 'multiple'
+        correct = data['correct']
+        if multiple:
+            mask = 0
+            for choice in correct:
+                mask |= 1 << (choice - 1)
+        else:
+            # Single choice questions may store their answer as an int or a one element list
+            mask = 1 << ((correct if isinstance(correct, int) else correct[0]) - 1)
+        extra = {key: value for key, value in data.items() if key not in cls.FIELDS} or None
+        return cls(sys.intern(data['question']), options, mask, multiple, extra)
+
+    def correct_indexes(self) -> List[int]:
+        """Correct option numbers, starting at 1"""
+        return [i + 1 for i in range(self.mask.bit_length()) if self.mask >> i & 1]
+
+    @property
+    def correct(self) -> Union[int, List[int]]:
+        indexes = self.correct_indexes()
+        return indexes if self.multiple else indexes[0]
+
+    @property
+    def answer_count(self) -> int:
+        """Number of options to select"""
+        return bin(self.mask).count('1') if self.multiple else 1
+
+    def __getitem__(self, key: str) -> Any:
+        if key in ('question', 'options', 'correct'):
+            return getattr(self, key)
+        if key == 'type' and self.multiple:
+            return 'multiple'
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def to_dict(self) -> dict:
+        """The question as stored in the JSON files"""
+        data = {'question': self.question, 'options': list(self.options), 'correct': self.correct}
+        if self.multiple:
+            data['type'] = 'multiple'
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+
+def question_tags(questions: List[Union[dict, Question]]) -> Dict[str, List[int]]:
+    """Indexes of the questions carrying each tag"""
+    tags: Dict[str, List[int]] = {}
+    for index, question in enumerate(questions):
+        for tag in question.get('tags', []):
+            indexes = tags.setdefault(tag, [])
+            if not indexes or indexes[-1] != index:
+                indexes.append(index)
+    return tags
+
+
+class CategoryView(Mapping):
+    """Titles of one category, mapping each title to its questions"""
+
+    def __init__(self, bank: 'QuestionBank', category: str):
+        self.bank = bank
+        self.category = category
+
+    def __getitem__(self, title: str) -> List[Question]:
+        if title not in self.bank.index.get(self.category, {}):
+            raise KeyError(title)
+        return self.bank.questions(self.category, title)
+
+    def __contains__(self, title: object) -> bool:
+        return title in self.bank.index.get(self.category, {})
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self.bank.index.get(self.category, {})))
+
+    def __len__(self) -> int:
+        return len(self.bank.index.get(self.category, {}))
+
+
+class QuestionBank(Mapping):
+    """Categories of the bank, read like the old qcms.json dict: bank[category][title]"""
+
+    def __init__(self, bank_dir: str, seed_file: str = None, cache_size: int = 256,
+                 load: Callable[[str, Any], Any] = load_json, save: Callable[[str, Any], None] = save_json):
+        self.bank_dir = bank_dir
+        self.index_path = os.path.join(bank_dir, 'index.jsonl')
+        self.cache_size = cache_size
+        self.load = load
+        self.save = save
+        self.cache: 'OrderedDict[tuple, List[Question]]' = OrderedDict()
+        # Distinct option tuples of the cached questions, shared by every question using them,
+        # and how many cached questions use each one
+        self.option_sets: Dict[tuple, tuple] = {}
+        self.option_refs: Dict[tuple, int] = {}
+        # Called with (category, title) when a QCM leaves the cache, see subscribe()
+        self.listeners: List[Callable[[tuple], None]] = []
+        os.makedirs(os.path.join(bank_dir, 'qcms'), exist_ok=True)
+        self.lock = FileLock(f"{self.index_path}.lock")
+
+        self.index: Dict[str, Dict[str, str]] = {}
+        # Question count of each QCM, so pools of questions can be built without reading the files
+        self.sizes: Dict[tuple, int] = {}
+        # (category, title) of every index line read, in order: what was added or rewritten since a given point
+        self.changes: List[tuple] = []
+        # Tag -> (category, title) -> indexes of the questions with that tag, and the tags of each QCM
+        self.tags: Dict[str, Dict[tuple, List[int]]] = {}
+        self.qcm_tags: Dict[tuple, List[str]] = {}
+        # QCMs indexed before tags were recorded
+        self.untagged: Set[tuple] = set()
+        self._offset = 0
+        with self.lock:
+            if os.path.exists(self.index_path):
+                self.refresh()
+            elif seed_file and os.path.exists(seed_file):
+                self.import_json(seed_file)
+
+    def refresh(self):
+        """Read the index lines appended since the last call, by this process or another one"""
+        try:
+            if os.path.getsize(self.index_path) <= self._offset:
+                return
+        except FileNotFoundError:
+            return
+        with open(self.index_path, 'rb') as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                self._offset += len(line)
+                entry = json.loads(line)
+                self.changes.append((entry['category'], entry['title']))
+                self.index.setdefault(entry['category'], {})[entry['title']] = entry['file']
+                if 'questions' in entry:
+                    self.sizes[(entry['category'], entry['title'])] = entry['questions']
+                self._set_tags((entry['category'], entry['title']), entry.get('tags'))
+                # Another process may have rewritten this QCM
+                self._evict((entry['category'], entry['title']))
+
+    def subscribe(self, listener: Callable[[tuple], None]):
+        """Call `listener((category, title))` whenever a QCM leaves the cache, evicted or rewritten,
+        so what was computed from its questions can be dropped with them"""
+        self.listeners.append(listener)
+
+    def _set_tags(self, key: tuple, tags: Optional[Dict[str, List[int]]]):
+        """Replace the tags recorded for one QCM, None when its index line has none"""
+        for tag in self.qcm_tags.pop(key, ()):
+            refs = self.tags[tag]
+            del refs[key]
+            if not refs:
+                del self.tags[tag]
+        if tags is None:
+            self.untagged.add(key)
+            return
+        self.untagged.discard(key)
+        for tag, indexes in tags.items():
+            self.tags.setdefault(tag, {})[key] = indexes
+        self.qcm_tags[key] = list(tags)
+
+    def tag_questions(self, tag: str) -> List[Tuple[str, str, int]]:
+        """(category, title, question index) of every question with this tag"""
+        self.refresh()
+        for key in list(self.untagged):
+            self._set_tags(key, question_tags(self.questions(*key)))
+        return [(category, title, index)
+                for (category, title), indexes in self.tags.get(tag, {}).items() for index in indexes]
+
+    @property
+    def version(self) -> int:
+        """Changes whenever a QCM is added or rewritten"""
+        return len(self.changes)
+
+    def __getitem__(self, category: str) -> CategoryView:
+        self.refresh()
+        if category not in self.index:
+            raise KeyError(category)
+        return CategoryView(self, category)
+
+    def __contains__(self, category: object) -> bool:
+        self.refresh()
+        return category in self.index
+
+    def __iter__(self) -> Iterator[str]:
+        self.refresh()
+        return iter(list(self.index))
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    @staticmethod
+    def _filename(category: str, title: str) -> str:
+        digest = hashlib.sha1(f"{category}\0{title}".encode('utf-8')).hexdigest()[:20]
+        return f"{digest}.json"
+
+    def _payload_path(self, filename: str) -> str:
+        return os.path.join(self.bank_dir, 'qcms', filename)
+
+    def questions(self, category: str, title: str) -> List[Question]:
+        """Questions of a QCM, read from disk on a cache miss"""
+        key = (category, title)
+        questions = self.cache.get(key)
+        if questions is not None:
+            self.cache.move_to_end(key)
+            return questions
+        questions = [Question.from_dict(data, self.option_sets)
+                     for data in self.load(self._payload_path(self.index[category][title]), [])]
+        for question in questions:
+            self.option_refs[question.options] = self.option_refs.get(question.options, 0) + 1
+        self.cache[key] = questions
+        if len(self.cache) > self.cache_size:
+            self._evict(next(iter(self.cache)))
+        return questions
+
+    def _evict(self, key: tuple):
+        """Drop a QCM from the cache, and the option tuples no other cached question uses"""
+        questions = self.cache.pop(key, None)
+        for question in questions or ():
+            refs = self.option_refs[question.options] - 1
+            if refs:
+                self.option_refs[question.options] = refs
+            else:
+                del self.option_refs[question.options]
+                del self.option_sets[question.options]
+        for listener in self.listeners:
+            listener(key)
+
+    def stored_questions(self, category: str, title: str) -> List[dict]:
+        """Questions of a QCM as written in its file, read without going through the cache"""
+        return self.load(self._payload_path(self.index[category][title]), [])
+
+    def question_count(self, category: str, title: str) -> int:
+        """Number of questions of a QCM, read from the index (older index lines need the file)"""
+        count = self.sizes.get((category, title))
+        if count is None:
+            count = self.sizes[(category, title)] = len(self.questions(category, title))
+        return count
+
+    def save_qcm(self, category: str, title: str, questions: List[Union[dict, Question]]):
+        """Write (or overwrite) one QCM"""
+        filename = self._filename(category, title)
+        questions = [q.to_dict() if isinstance(q, Question) else q for q in questions]
+        with self.lock:
+            self.save(self._payload_path(filename), questions)
+            # Appended even for a rewrite, so other processes drop their cached copy
+            line = json.dumps({'category': category, 'title': title, 'file': filename, 'questions': len(questions),
+                               'tags': question_tags(questions)}, ensure_ascii=False) + '\n'
+            with open(self.index_path, 'ab') as f:
+                f.write(line.encode('utf-8'))
+            self.refresh()
+
+    def import_json(self, filename: str):
+        """Split a qcms.json style file into the bank"""
+        for category, titles in self.load(filename, {}).items():
+            for title, questions in titles.items():
+                self.save_qcm(category, title, questions)
+
+    def export_json(self, filename: str):
+        """Write the whole bank back as a single qcms.json style file"""
+        qcms = {
+            category: {title: self.load(self._payload_path(payload), []) for title, payload in titles.items()}
+            for category, titles in self.index.items()
+        }
+        self.save(filename, qcms)
+
+
+def measure_memory(qcm_count: int, seed: int = 0) -> Dict[str, int]:
+    """Bytes allocated to hold a synthetic bank of `qcm_count` QCMs as JSON dicts and as Question records"""
+    import random
+    import shutil
+    import tempfile
+    import tracemalloc
+
+    from qcm_bench import QUESTIONS_PER_QCM, generate_qcms
+
+    directory = tempfile.mkdtemp(prefix='qcm-bank-memory-')
+    try:
+        bank = QuestionBank(directory, cache_size=qcm_count)
+        qcms = generate_qcms(qcm_count, random.Random(seed))
+        for category, titles in qcms.items():
+            for title, questions in titles.items():
+                # Question texts are unique, only option lists repeat across QCMs
+                for i, question in enumerate(questions):
+                    question['question'] = f"{title}, question {i + 1}: which option is right?"
+                bank.save_qcm(category, title, questions)
+        del qcms
+        files = [(category, title, bank._payload_path(filename))
+                 for category, titles in bank.index.items() for title, filename in titles.items()]
+
+        tracemalloc.start()
+        dicts = [load_json(path, []) for _, _, path in files]
+        as_dicts = tracemalloc.get_traced_memory()[0]
+        del dicts
+        tracemalloc.stop()
+
+        tracemalloc.start()
+        for category, title, _ in files:
+            bank.questions(category, title)
+        as_records = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return {'questions': qcm_count * QUESTIONS_PER_QCM, 'dicts': as_dicts, 'records': as_records,
+                'option_sets': len(bank.option_sets)}
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import or export the question bank as a single qcms.json file")
+    parser.add_argument('action', choices=['import', 'export', 'memory'])
+    parser.add_argument('qcms_file', nargs='?', default='qcms.json')
+    parser.add_argument('--bank-dir', default=os.path.join('qcm_data', 'bank'))
+    parser.add_argument('--qcms', type=int, default=10000, help="memory: size of the synthetic bank, in QCMs")
+    args = parser.parse_args()
+    if args.action == 'memory':
+        figures = measure_memory(args.qcms)
+        print(f"{figures['questions']} questions, {figures['option_sets']} distinct option lists")
+        print(f"  JSON dicts:       {figures['dicts'] / 1e6:8.2f} MB ({figures['dicts'] / figures['questions']:.0f} B/question)")
+        print(f"  Question records: {figures['records'] / 1e6:8.2f} MB "
+              f"({figures['records'] / figures['questions']:.0f} B/question, {figures['dicts'] / figures['records']:.1f}x less)")
+        sys.exit(0)
+    bank = QuestionBank(args.bank_dir)
+    if args.action == 'import':
+        bank.import_json(args.qcms_file)
+    else:
+        bank.export_json(args.qcms_file)
+    print(f"{sum(len(titles) for titles in bank.index.values())} QCMs in {args.bank_dir}")
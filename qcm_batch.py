@@ -0,0 +1,152 @@
+"""Headless grading of answer sheet files against one QCM.
+
+Sheets are read one line at a time, so memory does not grow with the file:
+
+    JSONL: {"user": "chakib", "answers": [[1, 2, 4, 5], 1, [1, 2, 3]], "time_taken": 42.0}
+    CSV:   chakib,1 2 4 5,1,1 2 3      (first column is the user, an empty cell
+                                        is an unanswered question, an optional
+                                        header row starts with "user")
+
+Every answer is checked like one given during a quiz (qcm_session.validate_answer).
+Sheets that fail are skipped and reported with their line number instead of
+stopping the run.
+"""
+import csv
+import json
+import time
+from datetime import datetime
+from typing import Iterator, List, Optional, Sequence, TextIO, Tuple, Union
+
+from qcm_bank import Question
+from qcm_grading import grade_batch
+from qcm_session import validate_answer
+
+# Rejected sheets listed in the report, the others are only counted
+REJECTED_SHOWN = 20
+
+
+class InvalidSheet(ValueError):
+    """A line of the sheets file that cannot be graded"""
+
+
+def _parse_cell(cell: str) -> Union[int, list, None]:
+    try:
+        choices = [int(choice) for choice in cell.split()]
+    except ValueError:
+        raise InvalidSheet(f"{cell!r} is not a list of option numbers")
+    if not choices:
+        return None
+    return choices[0] if len(choices) == 1 else choices
+
+
+def _read_line(line: str, fmt: str, questions: Sequence[Question]) -> Optional[Tuple[str, list, float]]:
+    """(user, answers, time_taken) of one line, None for a CSV header row"""
+    if fmt == 'jsonl':
+        try:
+            sheet = json.loads(line)
+        except ValueError:
+            raise InvalidSheet("not a JSON line")
+        if not isinstance(sheet, dict):
+            raise InvalidSheet("not a JSON object")
+        user, answers, time_taken = sheet.get('user'), sheet.get('answers'), sheet.get('time_taken', 0.0)
+        if not isinstance(answers, list):
+            raise InvalidSheet("'answers' must be a list")
+        if not isinstance(time_taken, (int, float)) or isinstance(time_taken, bool):
+            raise InvalidSheet("'time_taken' must be a number")
+    else:
+        row = next(csv.reader([line]))
+        if row[0] == 'user':
+            return None
+        user, answers, time_taken = row[0], [_parse_cell(cell) for cell in row[1:]], 0.0
+        # A multiple choice question answered with a single option is still a list
+        answers = [[a] if isinstance(a, int) and question.multiple else a
+                   for a, question in zip(answers, questions)] + answers[len(questions):]
+    if not isinstance(user, str) or not user:
+        raise InvalidSheet("no user")
+    if len(answers) > len(questions):
+        raise InvalidSheet(f"{len(answers)} answers for {len(questions)} questions")
+    for number, (question, answer) in enumerate(zip(questions, answers), 1):
+        error = answer is not None and validate_answer(question, answer)
+        if error:
+            raise InvalidSheet(f"question {number}: {error}")
+    return user, answers, float(time_taken)
+
+
+def iter_sheets(f: TextIO, fmt: str, questions: Sequence[Question]) -> Iterator[Tuple[int, Union[tuple, str]]]:
+    """Yield (line number, (user, answers, time_taken)) for each sheet of the file,
+    or (line number, reason) for a sheet that cannot be graded"""
+    for number, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            sheet = _read_line(line, fmt, questions)
+        except InvalidSheet as e:
+            yield number, str(e)
+            continue
+        if sheet is not None:
+            yield number, sheet
+
+
+def run_batch(app, category: str, title: str, sheets_file: TextIO, fmt: str = 'jsonl',
+              batch_size: int = 10000, results_file: Optional[TextIO] = None) -> dict:
+    """Grade every valid sheet of the file and store the attempts, returns throughput figures
+    and the sheets rejected"""
+    if category not in app.qcms or title not in app.qcms[category]:
+        raise KeyError("QCM not found!")
+    questions = app.qcms[category][title]
+    key = app.answer_key(category, title)
+
+    total = 0
+    rejected = 0
+    rejected_lines: List[Tuple[int, str]] = []
+    total_score = 0.0
+    start = time.perf_counter()
+    batch: List[Tuple[str, list, float]] = []
+
+    def flush():
+        nonlocal total, total_score
+        date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        attempts = []
+        for (user, answers, time_taken), correct in zip(batch, grade_batch(key, [s[1] for s in batch])):
+            # Same history entry as a quiz taken through QuizSession
+            result = {
+                'date': date,
+                'category': category,
+                'title': title,
+                'score': (correct / len(questions)) * 100,
+                'time_taken': time_taken,
+                'answers': answers,
+                'total_questions': len(questions),
+                'correct_answers': correct
+            }
+            attempts.append((user, result))
+            total_score += result['score']
+            if results_file is not None:
+                results_file.write(json.dumps({'user': user, 'score': result['score'], 'correct_answers': correct}) + '\n')
+        app.record_attempts(attempts)
+        total += len(batch)
+        batch.clear()
+
+    with app.storage.transaction():
+        for number, sheet in iter_sheets(sheets_file, fmt, questions):
+            if isinstance(sheet, str):
+                rejected += 1
+                if len(rejected_lines) < REJECTED_SHOWN:
+                    rejected_lines.append((number, sheet))
+                continue
+            batch.append(sheet)
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+    elapsed = time.perf_counter() - start
+
+    return {
+        'sheets': total,
+        'mean_score': total_score / total if total else 0.0,
+        'seconds': elapsed,
+        'sheets_per_second': total / elapsed if elapsed else 0.0,
+        'microseconds_per_sheet': elapsed / total * 1e6 if total else 0.0,
+        'rejected': rejected,
+        'rejected_lines': rejected_lines
+    }
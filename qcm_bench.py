@@ -0,0 +1,312 @@
+"""Benchmarks of the grading, persistence, leaderboard and report paths.
+
+Synthetic data sets are generated in the same shape as qcms.json and the
+users/history/scores files: N users, M QCMs, K attempts per user. For each
+size the suite times
+
+    load_data / save_data   reading and writing the generated history.json whole
+    startup                 QCMApp construction on that data directory
+    check_answer            grading one answer
+    leaderboard             building the overall and per-category boards
+    display_leaderboard     showing a board once built
+    report                  per-QCM aggregates and a full CSV export
+    submission              start, answer and finish one quiz (stored through the log)
+
+Results are written as JSON. Compared against a baseline saved earlier, any
+benchmark slower than the baseline by more than the tolerance is reported as a
+regression and the exit status is 1:
+
+    python qcm_bench.py --sizes small,medium --save-baseline
+    python qcm_bench.py --sizes small,medium --baseline qcm_bench_baseline.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Tuple
+
+from qcm_app import QCMApp
+from qcm_grading import AnswerKey, check_answer
+from qcm_leaderboard import LeaderboardIndex
+from qcm_reports import ReportIndex, export_csv, iter_attempts
+
+# users, QCMs, attempts per user
+SIZES = {
+    'small': (100, 10, 10),
+    'medium': (1000, 50, 20),
+    'large': (10000, 200, 20),
+}
+QUESTIONS_PER_QCM = 10
+OPTIONS_PER_QUESTION = 5
+DEFAULT_BASELINE = 'qcm_bench_baseline.json'
+
+
+def generate_qcms(qcm_count: int, rng: random.Random, categories: int = 5) -> Dict[str, Dict[str, list]]:
+    """QCMs shaped like qcms.json: single and multiple choice questions"""
+    qcms: Dict[str, Dict[str, list]] = {}
+    for i in range(qcm_count):
+        questions = []
+        for q in range(QUESTIONS_PER_QCM):
+            options = [f"Option {o + 1} of question {q + 1}" for o in range(OPTIONS_PER_QUESTION)]
+            if rng.random() < 0.3:
+                correct = sorted(rng.sample(range(1, OPTIONS_PER_QUESTION + 1), rng.randint(2, 3)))
+                questions.append({'question': f"Question {q + 1}?", 'options': options,
+                                  'correct': correct, 'type': 'multiple'})
+            else:
+                questions.append({'question': f"Question {q + 1}?", 'options': options,
+                                  'correct': rng.randint(1, OPTIONS_PER_QUESTION)})
+        qcms.setdefault(f"Category {i % categories}", {})[f"QCM {i}"] = questions
+    return qcms
+
+
+def random_answers(questions: List[dict], rng: random.Random, accuracy: float = 0.6) -> list:
+    """Answers a student could give, right with probability `accuracy`"""
+    answers = []
+    for question in questions:
+        if question.get('type') == 'multiple':
+            if rng.random() < accuracy:
+                answers.append(list(question['correct']))
+            else:
+                answers.append(sorted(rng.sample(range(1, len(question['options']) + 1), len(question['correct']))))
+        elif rng.random() < accuracy:
+            answers.append(question['correct'])
+        else:
+            answers.append(rng.randint(1, len(question['options'])))
+    return answers
+
+
+def generate_history(qcms: Dict[str, Dict[str, list]], users: int, attempts: int,
+                     rng: random.Random) -> Tuple[dict, dict, dict]:
+    """users.json, history.json and scores.json contents for `users` users with `attempts` attempts each"""
+    keys = {(c, t): AnswerKey(questions) for c, titles in qcms.items() for t, questions in titles.items()}
+    choices = [(c, t, questions) for c, titles in qcms.items() for t, questions in titles.items()]
+    start = datetime(2024, 1, 1)
+    users_data, history, scores = {}, {}, {}
+    for u in range(users):
+        username = f"user{u}"
+        # Legacy plaintext password: hashing is not what is measured here
+        users_data[username] = 'password'
+        results = []
+        total = 0.0
+        for _ in range(attempts):
+            category, title, questions = rng.choice(choices)
+            answers = random_answers(questions, rng)
+            correct = keys[(category, title)].grade(answers)
+            score = correct / len(questions) * 100
+            total += score
+            results.append({
+                'date': (start + timedelta(minutes=rng.randrange(525600))).strftime('%Y-%m-%d %H:%M:%S'),
+                'category': category,
+                'title': title,
+                'score': score,
+                'time_taken': rng.uniform(10, 600),
+                'answers': answers,
+                'total_questions': len(questions),
+                'correct_answers': correct
+            })
+        history[username] = results
+        scores[username] = {'total_score': total, 'quizzes_taken': attempts}
+    return users_data, history, scores
+
+
+def write_dataset(directory: str, users: int, qcm_count: int, attempts: int, seed: int = 0) -> Tuple[str, str]:
+    """Write a data directory and its qcms.json seed, returns their paths"""
+    rng = random.Random(seed)
+    qcms = generate_qcms(qcm_count, rng)
+    users_data, history, scores = generate_history(qcms, users, attempts, rng)
+    data_dir = os.path.join(directory, 'qcm_data')
+    os.makedirs(data_dir, exist_ok=True)
+    qcms_file = os.path.join(directory, 'qcms.json')
+    for filename, data in ((qcms_file, qcms), (os.path.join(data_dir, 'users.json'), users_data),
+                           (os.path.join(data_dir, 'history.json'), history),
+                           (os.path.join(data_dir, 'scores.json'), scores)):
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=4, ensure_ascii=False)
+    return data_dir, qcms_file
+
+
+def timed(run: Callable[[], None], repeat: int, ops: int = 1) -> dict:
+    """Median and best wall time of `repeat` runs, and the median per operation"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    median = statistics.median(times)
+    return {'seconds': median, 'best': min(times), 'ops': ops, 'us_per_op': median / ops * 1e6}
+
+
+def run_size(name: str, repeat: int = 3, seed: int = 0) -> Dict[str, dict]:
+    users, qcm_count, attempts = SIZES[name]
+    directory = tempfile.mkdtemp(prefix=f"qcm-bench-{name}-")
+    try:
+        data_dir, qcms_file = write_dataset(directory, users, qcm_count, attempts, seed)
+        return _run_benchmarks(data_dir, qcms_file, repeat, random.Random(seed))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _run_benchmarks(data_dir: str, qcms_file: str, repeat: int, rng: random.Random) -> Dict[str, dict]:
+    results = {}
+    history_file = os.path.join(data_dir, 'history.bench.json')
+    copy_file = os.path.join(data_dir, 'history.bench.copy.json')
+    # Kept aside: the app rewrites history.json as its per-user history file (see JSONStorage)
+    shutil.copyfile(os.path.join(data_dir, 'history.json'), history_file)
+
+    # The first construction imports qcms.json into the bank, it is not timed
+    app = QCMApp(data_dir, qcms_file)
+    app.close()
+    history = app.load_data(history_file, {})
+    results['load_data'] = timed(lambda: app.load_data(history_file, {}), repeat)
+    results['save_data'] = timed(lambda: app.save_data(copy_file, history), repeat)
+    results['save_data']['bytes'] = os.path.getsize(copy_file)
+    os.remove(copy_file)
+    os.remove(history_file)
+    del history
+
+    def startup():
+        QCMApp(data_dir, qcms_file).close()
+    results['startup'] = timed(startup, repeat)
+
+    app = QCMApp(data_dir, qcms_file)
+    try:
+        qcms = [(c, t, app.qcms[c][t]) for c in app.qcms for t in app.qcms[c]]
+        samples = []
+        for _ in range(10000):
+            category, title, questions = rng.choice(qcms)
+            index = rng.randrange(len(questions))
+            samples.append((questions[index], random_answers([questions[index]], rng)[0]))
+
+        def grade():
+            for question, answer in samples:
+                check_answer(question, answer)
+        results['check_answer'] = timed(grade, repeat, len(samples))
+
+        category = qcms[0][0]
+
+        def leaderboard():
+            index = LeaderboardIndex(app.storage)
+            index.board(category)
+        results['leaderboard'] = timed(leaderboard, repeat)
+
+        app.current_user = 'user0'
+        app.leaderboards.board(category)
+
+        def display():
+            with contextlib.redirect_stdout(io.StringIO()):
+                for _ in range(100):
+                    app.display_leaderboard()
+                    app.display_leaderboard(category)
+        results['display_leaderboard'] = timed(display, repeat, 100)
+
+        def report():
+            ReportIndex(app.storage, app.answer_key).all()
+            export_csv(iter_attempts(app.storage), io.StringIO())
+        results['report'] = timed(report, repeat)
+
+        # Last, since every quiz adds an attempt to the data set
+        quizzes = 200
+
+        def submission():
+            for i in range(quizzes):
+                category, title, questions = qcms[i % len(qcms)]
+                session = app.engine.start(f"user{i}", category, title)
+                for answer in random_answers(questions, rng):
+                    app.engine.submit(session.id, answer)
+                app.engine.finish(session.id)
+        results['submission'] = timed(submission, repeat, quizzes)
+    finally:
+        app.close()
+    return results
+
+
+def compare(results: Dict[str, Dict[str, dict]], baseline: Dict[str, Dict[str, dict]], tolerance: float,
+            min_delta: float = 0.0005) -> List[Tuple[str, str, float, float, bool]]:
+    """(size, benchmark, baseline seconds, seconds, regressed) for every benchmark in both runs.
+
+    Best times are compared, they are the least noisy, and slowdowns under
+    `min_delta` seconds are never regressions.
+    """
+    rows = []
+    for size, benchmarks in results.items():
+        for benchmark, figures in benchmarks.items():
+            previous = baseline.get(size, {}).get(benchmark)
+            if previous is None:
+                continue
+            before, after = previous['best'], figures['best']
+            rows.append((size, benchmark, before, after,
+                         after > before * (1 + tolerance) and after - before > min_delta))
+    return rows
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark grading, persistence, leaderboards and reports")
+    parser.add_argument('--sizes', default='small,medium', help=f"Comma separated, among {', '.join(SIZES)}")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='qcm_bench_results.json')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help="Store these results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed slowdown before a regression")
+    args = parser.parse_args()
+
+    sizes = args.sizes.split(',')
+    for size in sizes:
+        if size not in SIZES:
+            parser.error(f"unknown size: {size}")
+
+    results = {}
+    for size in sizes:
+        users, qcm_count, attempts = SIZES[size]
+        print(f"{size}: {users} users, {qcm_count} QCMs, {attempts} attempts per user")
+        results[size] = run_size(size, args.repeat, args.seed)
+        for benchmark, figures in results[size].items():
+            print(f"  {benchmark:<20} {figures['seconds'] * 1000:>10.2f} ms {figures['us_per_op']:>12.2f} µs/op")
+
+    report = {
+        'meta': {
+            'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'repeat': args.repeat,
+            'sizes': {size: SIZES[size] for size in sizes}
+        },
+        'results': results
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=4)
+    print(f"Results written to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --save-baseline first")
+        return 0
+
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)['results']
+    regressions = 0
+    print(f"\nCompared with {args.baseline} (tolerance {args.tolerance:.0%}):")
+    for size, benchmark, before, after, regressed in compare(results, baseline, args.tolerance):
+        regressions += regressed
+        flag = "REGRESSION" if regressed else "ok"
+        print(f"  {size:<8} {benchmark:<20} {before * 1000:>10.2f} ms -> {after * 1000:>10.2f} ms "
+              f"({after / before - 1:+.0%}) {flag}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
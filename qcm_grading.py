@@ -0,0 +1,187 @@
+"""Answer keys compiled once per QCM, and grading of whole batches of answer sheets.
+
+A key stores each question's correct option(s) as a bitmask (bit i set for
+option i + 1). A submitted answer is encoded the same way, so grading does
+one integer comparison per question.
+"""
+import argparse
+import os
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from qcm_bank import Question, QuestionBank
+from qcm_storage import JSONStorage, StorageBackend, attempt_qcm, open_storage
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, the pure Python path grades the same way
+    np = None
+
+
+def answer_mask(answer: Union[int, list]) -> int:
+    """Bitmask of the options chosen in an answer (an int or a list of ints)"""
+    if isinstance(answer, int):
+        return 1 << (answer - 1)
+    mask = 0
+    for choice in answer:
+        mask |= 1 << (choice - 1)
+    return mask
+
+
+def correct_mask(question: Union[dict, Question]) -> int:
+    """Bitmask of the correct option(s) of a question"""
+    if isinstance(question, Question):
+        return question.mask
+    correct = question['correct']
+    if question.get('type') == 'multiple':
+        return answer_mask(correct)
+    # Single choice questions may store their answer as an int or a one element list
+    return answer_mask(correct if isinstance(correct, int) else correct[0])
+
+
+def check_answer(question: Union[dict, Question], user_answer: Union[int, list]) -> bool:
+    """Check if the answer is correct for both single and multiple choice questions"""
+    return answer_mask(user_answer) == correct_mask(question)
+
+
+class AnswerKey:
+    """Compiled correct answers of one QCM"""
+
+    __slots__ = ('masks', 'option_counts')
+
+    def __init__(self, questions: Sequence[dict]):
+        self.masks = [correct_mask(q) for q in questions]
+        self.option_counts = [len(q['options']) for q in questions]
+
+    def __len__(self) -> int:
+        return len(self.masks)
+
+    def is_correct(self, index: int, answer: Union[int, list]) -> bool:
+        return answer_mask(answer) == self.masks[index]
+
+    def encode(self, answers: Sequence[Union[int, list, None]]) -> List[int]:
+        """Answer sheet as a row of masks, 0 for a question left unanswered"""
+        row = [answer_mask(a) if a is not None else 0 for a in answers[:len(self.masks)]]
+        row.extend([0] * (len(self.masks) - len(row)))
+        return row
+
+    def grade(self, answers: Sequence[Union[int, list, None]]) -> int:
+        """Number of correct answers on one sheet"""
+        return sum(1 for mask, expected in zip(self.encode(answers), self.masks) if mask == expected)
+
+    def correct_flags(self, answers: Sequence[Union[int, list, None]]) -> List[bool]:
+        return [mask == expected for mask, expected in zip(self.encode(answers), self.masks)]
+
+
+def compile_answer_keys(qcms: Dict[str, Dict[str, list]]) -> Dict[Tuple[str, str], AnswerKey]:
+    return {
+        (category, title): AnswerKey(questions)
+        for category, titles in qcms.items()
+        for title, questions in titles.items()
+    }
+
+
+def grade_masks(key: AnswerKey, rows: Sequence[Sequence[int]]) -> List[int]:
+    """Correct answer counts for sheets already encoded as rows of masks"""
+    if np is not None and len(rows) and max(key.option_counts, default=0) <= 64:
+        sheets = np.asarray(rows, dtype=np.uint64).reshape(len(rows), len(key.masks))
+        expected = np.asarray(key.masks, dtype=np.uint64)
+        return (sheets == expected).sum(axis=1).tolist()
+    masks = key.masks
+    return [sum(map(int.__eq__, row, masks)) for row in rows]
+
+
+def grade_batch(key: AnswerKey, sheets: Iterable[Sequence[Union[int, list, None]]]) -> List[int]:
+    """Correct answer counts for a batch of answer sheets, in one pass"""
+    return grade_masks(key, [key.encode(sheet) for sheet in sheets])
+
+
+def _grade_generated(result: dict, keys: Dict[Tuple[str, str], AnswerKey]) -> Optional[int]:
+    """Correct answers of a generated quiz (see qcm_quizgen), graded question by question
+    against the QCMs they come from; None when one of those questions no longer exists"""
+    correct = 0
+    for (category, title, index), answer in zip(result['questions'], result['answers']):
+        key = keys.get((category, title))
+        if key is None or index >= len(key):
+            return None
+        correct += answer is not None and key.is_correct(index, answer)
+    return correct
+
+
+def regrade_results(results: Iterable[dict], keys: Dict[Tuple[str, str], AnswerKey],
+                    batch_size: int = 10000) -> Iterator[Tuple[dict, bool]]:
+    """Yield each history result regraded against the current keys, and whether it changed"""
+    batch: List[dict] = []
+
+    def flush() -> Iterator[Tuple[dict, bool]]:
+        groups: Dict[Tuple[str, str], List[dict]] = {}
+        regraded = {}
+        for result in batch:
+            qcm = attempt_qcm(result)
+            if qcm is not None:
+                groups.setdefault(qcm, []).append(result)
+                continue
+            correct = _grade_generated(result, keys)
+            if correct is not None:
+                regraded[id(result)] = correct
+        for qcm, group in groups.items():
+            key = keys.get(qcm)
+            if key is None or any(len(r['answers']) > len(key) for r in group):
+                continue
+            for result, correct in zip(group, grade_batch(key, [r['answers'] for r in group])):
+                regraded[id(result)] = correct
+        for result in batch:
+            correct = regraded.get(id(result))
+            if correct is None or correct == result['correct_answers']:
+                yield result, False
+                continue
+            yield dict(result, correct_answers=correct, score=(correct / result['total_questions']) * 100), True
+
+    for result in results:
+        batch.append(result)
+        if len(batch) >= batch_size:
+            yield from flush()
+            batch = []
+    yield from flush()
+
+
+def regrade_history(storage: StorageBackend, qcms: Dict[str, Dict[str, list]]) -> int:
+    """Regrade the stored history after a key correction and carry the differences into the scores.
+
+    The regrade is stored like any other write (logged, or recorded in the
+    database), so processes sharing the data pick it up.
+    """
+    keys = compile_answer_keys(qcms)
+    replacements = [(username, index, result)
+                    for username in storage.iter_users()
+                    for index, (result, changed) in enumerate(regrade_results(storage.user_history(username), keys))
+                    if changed]
+    storage.replace_attempts(replacements)
+    return len(replacements)
+
+
+def regrade_json_history(data_dir: str, qcms: Dict[str, Dict[str, list]]) -> int:
+    """regrade_history() of a JSON data directory, under its lock so no write comes in between"""
+    storage = JSONStorage(data_dir)
+    try:
+        with storage.attempt_log.lock:
+            storage.refresh(repair=True)
+            return regrade_history(storage, qcms)
+    finally:
+        storage.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Regrade the stored history against the current answer keys")
+    parser.add_argument('--data-dir', default='qcm_data')
+    parser.add_argument('--storage', choices=['json', 'sqlite'], default=os.environ.get('QCM_STORAGE', 'json'))
+    args = parser.parse_args()
+    bank = QuestionBank(os.path.join(args.data_dir, 'bank'), 'qcms.json')
+    if args.storage == 'json':
+        count = regrade_json_history(args.data_dir, bank)
+    else:
+        storage = open_storage(args.storage, args.data_dir)
+        try:
+            count = regrade_history(storage, bank)
+        finally:
+            storage.close()
+    print(f"{count} attempts regraded")
@@ -0,0 +1,216 @@
+import random
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from qcm_storage import StorageBackend, attempt_category, attempt_qcm
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key: Any, levels: int):
+        self.key = key
+        self.next = [None] * levels
+        self.width = [1] * levels
+
+
+class IndexableSkipList:
+    """Sorted collection of unique keys with O(log n) insert, remove and rank"""
+
+    MAX_LEVELS = 32
+
+    def __init__(self):
+        self.head = _Node(None, self.MAX_LEVELS)
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self) -> Iterator[Any]:
+        node = self.head.next[0]
+        while node is not None:
+            yield node.key
+            node = node.next[0]
+
+    def _find_chain(self, key: Any) -> Tuple[List[_Node], List[int]]:
+        """Last node before `key` on every level, and the distance walked on each level"""
+        chain = [None] * self.MAX_LEVELS
+        steps = [0] * self.MAX_LEVELS
+        node = self.head
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level] is not None and node.next[level].key < key:
+                steps[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+        return chain, steps
+
+    def insert(self, key: Any):
+        chain, steps = self._find_chain(key)
+        levels = 1
+        while levels < self.MAX_LEVELS and random.random() < 0.5:
+            levels += 1
+        new = _Node(key, levels)
+        walked = 0
+        for level in range(levels):
+            prev = chain[level]
+            new.next[level] = prev.next[level]
+            prev.next[level] = new
+            new.width[level] = prev.width[level] - walked
+            prev.width[level] = walked + 1
+            walked += steps[level]
+        for level in range(levels, self.MAX_LEVELS):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, key: Any):
+        chain, _ = self._find_chain(key)
+        target = chain[0].next[0]
+        if target is None or target.key != key:
+            raise KeyError(key)
+        for level in range(len(target.next)):
+            prev = chain[level]
+            prev.width[level] += target.width[level] - 1
+            prev.next[level] = target.next[level]
+        for level in range(len(target.next), self.MAX_LEVELS):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    def rank(self, key: Any) -> int:
+        """Number of keys strictly smaller than `key`"""
+        _, steps = self._find_chain(key)
+        return sum(steps)
+
+    def __getitem__(self, index: int) -> Any:
+        if not 0 <= index < self.size:
+            raise IndexError(index)
+        node = self.head
+        remaining = index + 1
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        return node.key
+
+
+class Leaderboard:
+    """Users ranked by average score, updated in place on every new score.
+
+    Keys are (-average, username) so the skip list keeps the best user first.
+    The top entries are cached until an update reaches them.
+    """
+
+    TOP_CACHE = 10
+
+    def __init__(self):
+        self.stats: Dict[str, List[float]] = {}
+        self.keys: Dict[str, tuple] = {}
+        self.ranking = IndexableSkipList()
+        self._top: Optional[List[tuple]] = None
+
+    def __len__(self) -> int:
+        return len(self.ranking)
+
+    def set(self, username: str, total_score: float, quizzes_taken: int):
+        self.stats[username] = [total_score, quizzes_taken]
+        key = (-(total_score / max(quizzes_taken, 1)), username)
+        old_key = self.keys.get(username)
+        if old_key == key:
+            return
+        if old_key is not None:
+            self.ranking.remove(old_key)
+        self.ranking.insert(key)
+        self.keys[username] = key
+        if self._top is not None and (
+            len(self._top) < self.TOP_CACHE
+            or key <= self._top[-1]
+            or (old_key is not None and old_key <= self._top[-1])
+        ):
+            self._top = None
+
+    def add(self, username: str, score: float):
+        total, taken = self.stats.get(username, (0, 0))
+        self.set(username, total + score, taken + 1)
+
+    def top(self, limit: int) -> List[Tuple[str, float]]:
+        """Best `limit` users with their average score"""
+        if limit > self.TOP_CACHE:
+            keys = self._first(limit)
+        else:
+            if self._top is None:
+                self._top = self._first(self.TOP_CACHE)
+            keys = self._top[:limit]
+        return [(username, -negative_average) for negative_average, username in keys]
+
+    def _first(self, limit: int) -> List[tuple]:
+        keys = []
+        for key in self.ranking:
+            if len(keys) >= limit:
+                break
+            keys.append(key)
+        return keys
+
+    def rank(self, username: str) -> Optional[int]:
+        """1-based position of the user, None if they are not ranked"""
+        key = self.keys.get(username)
+        if key is None:
+            return None
+        return self.ranking.rank(key) + 1
+
+
+class LeaderboardIndex:
+    """Overall, per-category and per-QCM leaderboards kept in sync with submissions.
+
+    The overall board is loaded from the stored scores at startup. The
+    per-category and per-QCM boards need the whole history, so they are built
+    from one scan on first use and then updated like the overall one.
+    """
+
+    def __init__(self, storage: StorageBackend):
+        self.storage = storage
+        self.overall = Leaderboard()
+        for username, stats in storage.iter_scores():
+            self.overall.set(username, stats['total_score'], stats['quizzes_taken'])
+        self.categories: Optional[Dict[str, Leaderboard]] = None
+        self.qcms: Optional[Dict[Tuple[str, str], Leaderboard]] = None
+
+    def _build_details(self):
+        history = self.storage.scan_history()
+        self.categories = {}
+        self.qcms = {}
+        for username, result in history:
+            self._add_details(username, result)
+
+    def _add_details(self, username: str, result: dict):
+        # Generated quizzes only rank in the category they were drawn from, they are no QCM of their own
+        category, qcm = attempt_category(result), attempt_qcm(result)
+        if category is not None:
+            self.categories.setdefault(category, Leaderboard()).add(username, result['score'])
+        if qcm is not None:
+            self.qcms.setdefault(qcm, Leaderboard()).add(username, result['score'])
+
+    def add_user(self, username: str):
+        if username not in self.overall.stats:
+            self.overall.set(username, 0, 0)
+
+    def set_scores(self, username: str, total_score: float, quizzes_taken: int):
+        """Running totals replaced by a rebuild from the history"""
+        self.overall.set(username, total_score, quizzes_taken)
+
+    def record(self, username: str, result: dict):
+        self.overall.add(username, result['score'])
+        if self.categories is not None:
+            self._add_details(username, result)
+
+    def replace(self, username: str, result: dict):
+        """An attempt was regraded in place: the detailed boards are rebuilt on next use"""
+        self.categories = self.qcms = None
+
+    def board(self, category: Optional[str] = None, title: Optional[str] = None) -> Leaderboard:
+        """Leaderboard for everyone, one category, or one QCM"""
+        self.storage.refresh()
+        if category is None:
+            return self.overall
+        if self.categories is None:
+            self._build_details()
+        if title is None:
+            return self.categories.get(category, Leaderboard())
+        return self.qcms.get((category, title), Leaderboard())
@@ -0,0 +1,200 @@
+"""Local load generator for qcm_server: how many quizzes per second does it finish?
+
+Client processes each open many connections to the server; every connection
+registers its own user, logs in once, then takes the same QCM again and again
+(first option for single choice, the first options for multiple choice).
+Only the quiz phase is timed, password hashing is left out.
+
+    python qcm_loadgen.py --port 8765                 # against a running server
+    python qcm_loadgen.py --workers 1,2,4             # start a server per worker count, compare
+
+With --workers, each server runs on a fresh temporary data directory seeded
+from qcms.json, so the real history is never touched. Only loopback
+addresses are accepted.
+"""
+import argparse
+import asyncio
+import ipaddress
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import time
+from typing import List, Optional, Tuple
+
+from qcm_server import run_workers
+
+
+class LoadClient:
+    """One connection speaking the qcm_server line protocol"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.requests = 0
+
+    async def request(self, **request) -> dict:
+        self.writer.write(json.dumps(request).encode('utf-8') + b'\n')
+        await self.writer.drain()
+        self.requests += 1
+        response = json.loads(await self.reader.readline())
+        if not response.get('ok'):
+            raise RuntimeError(response.get('error'))
+        return response
+
+    async def take_quiz(self, category: str, title: str):
+        response = await self.request(cmd='start', category=category, title=title)
+        while response.get('question'):
+            question = response['question']
+            if question['type'] == 'multiple':
+                answer = list(range(1, question['answers_expected'] + 1))
+            else:
+                answer = 1
+            response = await self.request(cmd='answer', answer=answer)
+
+    async def close(self):
+        self.writer.write(b'{"cmd": "quit"}\n')
+        await self.writer.drain()
+        self.writer.close()
+
+
+async def _run_clients(host: str, port: int, prefix: str, clients: int, quizzes: int,
+                       category: str, title: str) -> Tuple[int, int, float]:
+    connections = []
+    for i in range(clients):
+        connection = LoadClient(*await asyncio.open_connection(host, port))
+        connections.append(connection)
+    await asyncio.gather(*(c.request(cmd='register', username=f"{prefix}-{i}", password='load')
+                           for i, c in enumerate(connections)))
+    await asyncio.gather(*(c.request(cmd='login', username=f"{prefix}-{i}", password='load')
+                           for i, c in enumerate(connections)))
+    for connection in connections:
+        connection.requests = 0
+
+    async def run(connection: LoadClient):
+        for _ in range(quizzes):
+            await connection.take_quiz(category, title)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run(c) for c in connections))
+    elapsed = time.perf_counter() - start
+    requests = sum(c.requests for c in connections)
+    for connection in connections:
+        await connection.close()
+    return clients * quizzes, requests, elapsed
+
+
+def _client_process(host: str, port: int, prefix: str, clients: int, quizzes: int,
+                    category: str, title: str, results: multiprocessing.Queue):
+    results.put(asyncio.run(_run_clients(host, port, prefix, clients, quizzes, category, title)))
+
+
+async def _first_qcm(host: str, port: int) -> Tuple[str, str]:
+    connection = LoadClient(*await asyncio.open_connection(host, port))
+    category = (await connection.request(cmd='categories'))['categories'][0]
+    title = (await connection.request(cmd='titles', category=category))['titles'][0]
+    await connection.close()
+    return category, title
+
+
+def measure(host: str, port: int, processes: int = 4, clients: int = 50, quizzes: int = 20,
+            category: Optional[str] = None, title: Optional[str] = None) -> dict:
+    """Run the load once and return the throughput figures"""
+    if category is None or title is None:
+        category, title = asyncio.run(_first_qcm(host, port))
+    results = multiprocessing.Queue()
+    # Distinct user names across runs against the same server
+    prefix = f"load-{os.getpid()}-{int(time.time() * 1000) % 10 ** 8}"
+    workers = [
+        multiprocessing.Process(target=_client_process,
+                                args=(host, port, f"{prefix}-{p}", clients, quizzes, category, title, results))
+        for p in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    figures = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    done = sum(f[0] for f in figures)
+    requests = sum(f[1] for f in figures)
+    # The client processes run side by side, the slowest one bounds the run
+    elapsed = max(f[2] for f in figures)
+    return {
+        'quizzes': done,
+        'requests': requests,
+        'seconds': elapsed,
+        'quizzes_per_second': done / elapsed if elapsed else 0.0,
+        'requests_per_second': requests / elapsed if elapsed else 0.0
+    }
+
+
+def _wait_for_port(host: str, port: int, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def compare_workers(counts: List[int], host: str, port: int, qcms_file: str, storage: Optional[str],
+                    **load) -> List[Tuple[int, dict]]:
+    """Start a fresh server for each worker count and measure it"""
+    rows = []
+    for count in counts:
+        data_dir = tempfile.mkdtemp(prefix='qcm-load-')
+        server = multiprocessing.Process(target=run_workers,
+                                         args=(count, host, port, data_dir, qcms_file, storage))
+        server.start()
+        try:
+            _wait_for_port(host, port)
+            rows.append((count, measure(host, port, **load)))
+        finally:
+            os.kill(server.pid, signal.SIGINT)
+            server.join()
+            shutil.rmtree(data_dir, ignore_errors=True)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate quiz load against a local qcm_server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--processes', type=int, default=4, help="Client processes")
+    parser.add_argument('--clients', type=int, default=50, help="Connections per client process")
+    parser.add_argument('--quizzes', type=int, default=20, help="Quizzes per connection")
+    parser.add_argument('--category')
+    parser.add_argument('--title')
+    parser.add_argument('--workers', help="Comma separated worker counts, e.g. 1,2,4: start and compare servers")
+    parser.add_argument('--qcms', default='qcms.json', help="Seed of the temporary servers' question bank")
+    parser.add_argument('--storage', choices=['json', 'sqlite'], default=None)
+    args = parser.parse_args()
+
+    if not ipaddress.ip_address(socket.gethostbyname(args.host)).is_loopback:
+        parser.error("the load generator only targets local servers")
+    load = dict(processes=args.processes, clients=args.clients, quizzes=args.quizzes,
+                category=args.category, title=args.title)
+
+    if args.workers is None:
+        rows = [(None, measure(args.host, args.port, **load))]
+    else:
+        counts = [int(count) for count in args.workers.split(',')]
+        rows = compare_workers(counts, args.host, args.port, os.path.abspath(args.qcms), args.storage, **load)
+
+    baseline = rows[0][1]['quizzes_per_second']
+    print(f"{'workers':>8} {'quizzes':>8} {'seconds':>8} {'quizzes/s':>10} {'requests/s':>11} {'speedup':>8}")
+    for count, figures in rows:
+        speedup = figures['quizzes_per_second'] / baseline if baseline else 0.0
+        print(f"{count if count is not None else '-':>8} {figures['quizzes']:>8} {figures['seconds']:>8.2f} "
+              f"{figures['quizzes_per_second']:>10.1f} {figures['requests_per_second']:>11.1f} {speedup:>7.2f}x")
+    print(f"{os.cpu_count()} CPU(s) on this machine")
+
+
+if __name__ == "__main__":
+    main()
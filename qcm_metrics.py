@@ -0,0 +1,182 @@
+"""Lightweight instrumentation: operation timers, counters, gauges and a metrics dump.
+
+Disabled by default, and then nothing is wrapped: instrument() leaves the
+methods untouched and the few explicit hooks cost one attribute check. Once
+enabled (QCM_METRICS=<file> or --metrics <file>), instrumented methods record
+their latency (<operation>_seconds) and the storage records the size of every
+write (save_json_bytes, attempt_log_append_bytes) and how long JSON writes
+and log compactions take (save_json_seconds, compact_seconds). Each summary keeps a
+bounded window of recent samples, from which p50/p95/p99 are computed when a
+snapshot is taken.
+
+Snapshots are JSON, or Prometheus text format when the file name ends with
+.prom. The server also answers {"cmd": "metrics"} with the JSON snapshot.
+
+profile_next(name, path) runs the next call of one instrumented operation
+(a single quiz, for example) under cProfile and writes its stats to `path`.
+"""
+import cProfile
+import functools
+import inspect
+import json
+import os
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable, Optional
+
+WINDOW = 2048
+PERCENTILES = (50, 95, 99)
+
+
+class Summary:
+    """Count, total and recent samples of one measured value"""
+
+    __slots__ = ('count', 'total', 'errors', 'samples')
+
+    def __init__(self, window: int = WINDOW):
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+        self.samples: Deque[float] = deque(maxlen=window)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self.samples.append(value)
+
+    def percentiles(self) -> Dict[str, float]:
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {f"p{p}": 0.0 for p in PERCENTILES}
+        return {f"p{p}": ordered[min(len(ordered) - 1, len(ordered) * p // 100)] for p in PERCENTILES}
+
+
+class Metrics:
+    """Registry of timers, counters and gauges"""
+
+    def __init__(self):
+        self.enabled = False
+        self.path: Optional[str] = None
+        self.interval = 10.0
+        self.summaries: Dict[str, Summary] = {}
+        self.counters: Dict[str, float] = {}
+        self.gauges: Dict[str, Callable[[], float]] = {}
+        self.started = time.time()
+        self._profiles: Dict[str, str] = {}
+
+    def enable(self, path: Optional[str] = None, interval: float = 10.0):
+        """Start recording; `path` is where dump() writes, every `interval` seconds in the server"""
+        self.enabled = True
+        self.path = path
+        self.interval = interval
+
+    def observe(self, name: str, value: float):
+        summary = self.summaries.get(name)
+        if summary is None:
+            summary = self.summaries[name] = Summary()
+        summary.observe(value)
+
+    def count(self, name: str, value: float = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name: str, read: Callable[[], float]):
+        """Register a value read when a snapshot is taken, such as the number of active sessions"""
+        self.gauges[name] = read
+
+    def profile_next(self, name: str, path: str):
+        """Profile the next call of the method `name` and write its cProfile stats to `path`"""
+        self._profiles[f"{name}_seconds"] = path
+
+    def _wrap(self, name: str, method: Callable) -> Callable:
+        if inspect.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def timed_async(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await method(*args, **kwargs)
+                except Exception:
+                    self.summaries.setdefault(name, Summary()).errors += 1
+                    raise
+                finally:
+                    self.observe(name, time.perf_counter() - start)
+            return timed_async
+
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            profile_path = self._profiles.pop(name, None) if self._profiles else None
+            profiler = cProfile.Profile() if profile_path else None
+            start = time.perf_counter()
+            try:
+                if profiler is not None:
+                    return profiler.runcall(method, *args, **kwargs)
+                return method(*args, **kwargs)
+            except Exception:
+                self.summaries.setdefault(name, Summary()).errors += 1
+                raise
+            finally:
+                self.observe(name, time.perf_counter() - start)
+                if profiler is not None:
+                    profiler.dump_stats(profile_path)
+        return timed
+
+    def instrument(self, obj: Any, names: Iterable[str], prefix: str = ''):
+        """Time the given methods of `obj` as <prefix><name>_seconds, only when metrics are enabled"""
+        if not self.enabled:
+            return
+        for name in names:
+            setattr(obj, name, self._wrap(f"{prefix}{name}_seconds", getattr(obj, name)))
+
+    def snapshot(self) -> dict:
+        summaries = {}
+        for name, summary in sorted(self.summaries.items()):
+            summaries[name] = dict(
+                count=summary.count, errors=summary.errors, sum=summary.total,
+                mean=summary.total / summary.count if summary.count else 0.0, **summary.percentiles()
+            )
+        return {
+            'uptime_seconds': time.time() - self.started,
+            'summaries': summaries,
+            'counters': dict(sorted(self.counters.items())),
+            'gauges': {name: read() for name, read in sorted(self.gauges.items())}
+        }
+
+    def prometheus(self) -> str:
+        """Snapshot in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = [f"qcm_uptime_seconds {snapshot['uptime_seconds']:.3f}"]
+        for name, summary in snapshot['summaries'].items():
+            metric = f"qcm_{_metric_name(name)}"
+            lines.append(f"# TYPE {metric} summary")
+            for p in PERCENTILES:
+                lines.append(f'{metric}{{quantile="0.{p:02d}"}} {summary[f"p{p}"]:.6f}')
+            lines.append(f"{metric}_sum {summary['sum']:.6f}")
+            lines.append(f"{metric}_count {summary['count']}")
+            if summary['errors']:
+                lines.append(f"{metric}_errors_total {summary['errors']}")
+        for name, value in snapshot['counters'].items():
+            lines.append(f"# TYPE qcm_{_metric_name(name)}_total counter")
+            lines.append(f"qcm_{_metric_name(name)}_total {value}")
+        for name, value in snapshot['gauges'].items():
+            lines.append(f"# TYPE qcm_{_metric_name(name)} gauge")
+            lines.append(f"qcm_{_metric_name(name)} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path: Optional[str] = None):
+        """Write the snapshot to `path` (or the enabled path): Prometheus text for .prom, JSON otherwise"""
+        path = path or self.path
+        if not self.enabled or not path:
+            return
+        text = self.prometheus() if path.endswith('.prom') else json.dumps(self.snapshot(), indent=4)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+
+def _metric_name(name: str) -> str:
+    return ''.join(c if c.isalnum() else '_' for c in name)
+
+
+metrics = Metrics()
+if os.environ.get('QCM_METRICS'):
+    metrics.enable(os.environ['QCM_METRICS'])
@@ -0,0 +1,240 @@
+"""Adaptive quizzes: N questions drawn from a whole category (or tag) of the bank.
+
+A question is picked with probability proportional to
+
+    difficulty(q) + USER_WEIGHT * error rate of the user on q
+
+where difficulty is the smoothed error rate of everyone, (errors + 1) / (attempts + 2),
+so a question never answered weighs 0.5. Both statistics are built from one
+history scan on first use (per user for the second one) and then updated on
+every attempt, like the leaderboards.
+
+Draws use a mixture of two samplers: an alias table over the whole pool built
+from the difficulties (O(1) per draw, rebuilt only once REBUILD_FRACTION of the
+pool has new answers) and a small weighted list of the questions the user
+already missed (rebuilt once after each of their attempts). Building a quiz
+therefore costs O(N) draws, whatever the size of the bank or of the history,
+and only the files of the chosen QCMs are read.
+
+Tags come from an optional "tags" list on each question; the bank index
+records which questions carry each tag, so a tag pool is built without
+reading the bank.
+
+Generated attempts are stored with a "questions" list of [category, title,
+index], so their answers count towards each question's statistics. Their
+title is no QCM: leaderboards, reports and user statistics leave them out of
+the per-QCM figures, and a regrade grades them question by question.
+"""
+import bisect
+import random
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from qcm_bank import Question, QuestionBank
+from qcm_grading import AnswerKey
+from qcm_storage import StorageBackend
+
+ADAPTIVE_TITLE = "Adaptive quiz"
+USER_WEIGHT = 2.0
+REBUILD_FRACTION = 0.05
+
+QuestionRef = Tuple[str, str, int]
+
+
+class AliasTable:
+    """Vose's alias method: O(n) to build, O(1) per weighted draw"""
+
+    __slots__ = ('prob', 'alias', 'total')
+
+    def __init__(self, weights: Sequence[float]):
+        n = len(weights)
+        self.total = sum(weights)
+        self.prob = [1.0] * n
+        self.alias = list(range(n))
+        if not n or self.total <= 0:
+            return
+        scaled = [w * n / self.total for w in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] += scaled[s] - 1.0
+            (small if scaled[l] < 1.0 else large).append(l)
+
+    def draw(self, rng: random.Random) -> int:
+        i = int(rng.random() * len(self.prob))
+        return i if rng.random() < self.prob[i] else self.alias[i]
+
+
+class DifficultyIndex:
+    """Attempts and errors per question, for everyone and per user"""
+
+    def __init__(self, storage: StorageBackend, answer_key: Callable[[str, str], Optional[AnswerKey]]):
+        self.storage = storage
+        self.answer_key = answer_key
+        self.questions: Optional[Dict[QuestionRef, List[int]]] = None
+        self.users: Dict[str, Dict[QuestionRef, List[int]]] = {}
+        # Answers recorded per category since startup, to tell when an alias table is stale
+        self.versions: Dict[str, int] = {}
+        self.user_versions: Dict[str, int] = {}
+
+    def outcomes(self, result: dict) -> Iterator[Tuple[QuestionRef, bool]]:
+        """(question, answered correctly) for every answered question of an attempt"""
+        if 'questions' in result:
+            for (category, title, index), answer in zip(result['questions'], result['answers']):
+                key = self.answer_key(category, title)
+                if answer is not None and key is not None and index < len(key):
+                    yield (category, title, index), key.is_correct(index, answer)
+            return
+        key = self.answer_key(result['category'], result['title'])
+        if key is None or len(result['answers']) > len(key):
+            return
+        for index, correct in enumerate(key.correct_flags(result['answers'])):
+            yield (result['category'], result['title'], index), correct
+
+    @staticmethod
+    def _add(table: Dict[QuestionRef, List[int]], outcomes: Iterable[Tuple[QuestionRef, bool]]):
+        for ref, correct in outcomes:
+            stats = table.get(ref)
+            if stats is None:
+                stats = table[ref] = [0, 0]
+            stats[0] += 1
+            stats[1] += not correct
+
+    def _build(self):
+        history = self.storage.scan_history()
+        self.questions = {}
+        for _, result in history:
+            self._add(self.questions, self.outcomes(result))
+
+    def difficulty(self, ref: QuestionRef) -> float:
+        if self.questions is None:
+            self._build()
+        attempts, errors = self.questions.get(ref, (0, 0))
+        return (errors + 1) / (attempts + 2)
+
+    def user(self, username: str) -> Dict[QuestionRef, List[int]]:
+        table = self.users.get(username)
+        if table is None:
+            history = self.storage.scan_history(username)
+            table = self.users[username] = {}
+            for _, result in history:
+                self._add(table, self.outcomes(result))
+        return table
+
+    def record(self, username: str, result: dict):
+        outcomes = list(self.outcomes(result))
+        if self.questions is not None:
+            self._add(self.questions, outcomes)
+        if username in self.users:
+            self._add(self.users[username], outcomes)
+        for (category, _, _), _ in outcomes:
+            self.versions[category] = self.versions.get(category, 0) + 1
+        self.user_versions[username] = self.user_versions.get(username, 0) + 1
+
+    def replace(self, username: str, result: dict):
+        """An attempt was regraded in place: the statistics are rebuilt on next use"""
+        self.questions = None
+        self.users.pop(username, None)
+        for ref, _ in self.outcomes(result):
+            self.versions[ref[0]] = self.versions.get(ref[0], 0) + 1
+        self.user_versions[username] = self.user_versions.get(username, 0) + 1
+
+
+class Pool:
+    """Questions a quiz can be drawn from, with the alias table of their difficulties"""
+
+    def __init__(self, refs: List[QuestionRef], categories: Set[str], bank_version: int):
+        self.refs = refs
+        self.bank_version = bank_version
+        self.members = set(refs)
+        self.categories = categories
+        self.table: Optional[AliasTable] = None
+        self.built_at = 0
+
+
+class QuizGenerator:
+    """Builds adaptive quizzes for QCMApp from the bank and the difficulty statistics"""
+
+    def __init__(self, bank: QuestionBank, difficulty: DifficultyIndex):
+        self.bank = bank
+        self.difficulty = difficulty
+        self.pools: Dict[str, Pool] = {}
+        # (username, pool) -> (user version, pool, questions the user missed, cumulative boosts)
+        self.boosts: Dict[Tuple[str, str], tuple] = {}
+
+    def _version(self, pool: Pool) -> int:
+        return sum(self.difficulty.versions.get(category, 0) for category in pool.categories)
+
+    def pool(self, category: Optional[str] = None, tag: Optional[str] = None) -> Pool:
+        name = self._name(category, tag)
+        self.bank.refresh()
+        pool = self.pools.get(name)
+        if pool is None or pool.bank_version != self.bank.version:
+            if tag is not None:
+                refs = self.bank.tag_questions(tag)
+            elif category in self.bank:
+                refs = [(category, title, i) for title in self.bank[category]
+                        for i in range(self.bank.question_count(category, title))]
+            else:
+                refs = []
+            pool = self.pools[name] = Pool(refs, {ref[0] for ref in refs}, self.bank.version)
+        version = self._version(pool)
+        if pool.table is None or version - pool.built_at > len(pool.refs) * REBUILD_FRACTION:
+            pool.table = AliasTable([self.difficulty.difficulty(ref) for ref in pool.refs])
+            pool.built_at = version
+        return pool
+
+    @staticmethod
+    def _name(category: Optional[str], tag: Optional[str]) -> str:
+        return f"#{tag}" if tag is not None else category
+
+    def _boosts(self, username: str, name: str, pool: Pool) -> Tuple[List[Tuple[QuestionRef, float]], List[float]]:
+        """Questions of the pool the user missed and their cumulative boosts, rebuilt after each of their attempts"""
+        version = self.difficulty.user_versions.get(username, 0)
+        cached = self.boosts.get((username, name))
+        if cached is not None and cached[0] == version and cached[1] is pool:
+            return cached[2], cached[3]
+        boosted = [(ref, USER_WEIGHT * errors / attempts)
+                   for ref, (attempts, errors) in self.difficulty.user(username).items()
+                   if errors and ref in pool.members]
+        cumulative = []
+        total = 0.0
+        for _, boost in boosted:
+            total += boost
+            cumulative.append(total)
+        self.boosts[(username, name)] = (version, pool, boosted, cumulative)
+        return boosted, cumulative
+
+    def pick(self, username: str, count: int, category: Optional[str] = None, tag: Optional[str] = None,
+             rng: Optional[random.Random] = None) -> List[QuestionRef]:
+        """`count` distinct questions of the pool, weighted by difficulty and the user's own errors"""
+        rng = rng or random.Random()
+        pool = self.pool(category, tag)
+        boosted, cumulative = self._boosts(username, self._name(category, tag), pool)
+        user_total = cumulative[-1] if cumulative else 0.0
+        if count * 2 >= len(pool.refs):
+            # Small pool: weighted shuffle (Efraimidis-Spirakis keys) of every question
+            boosts = dict(boosted)
+            keys = [(rng.random() ** (1.0 / (self.difficulty.difficulty(ref) + boosts.get(ref, 0.0))), ref)
+                    for ref in pool.refs]
+            return [ref for _, ref in sorted(keys, reverse=True)[:count]]
+
+        chosen: List[QuestionRef] = []
+        seen = set()
+        while len(chosen) < count:
+            if user_total and rng.random() * (pool.table.total + user_total) < user_total:
+                ref = boosted[min(bisect.bisect(cumulative, rng.random() * user_total), len(boosted) - 1)][0]
+            else:
+                ref = pool.refs[pool.table.draw(rng)]
+            if ref not in seen:
+                seen.add(ref)
+                chosen.append(ref)
+        return chosen
+
+    def generate(self, username: str, count: int, category: Optional[str] = None, tag: Optional[str] = None,
+                 rng: Optional[random.Random] = None) -> Tuple[List[Question], List[QuestionRef]]:
+        """Questions of a new quiz and where each of them comes from"""
+        refs = self.pick(username, count, category, tag, rng)
+        return [self.bank.questions(c, t)[i] for c, t, i in refs], refs
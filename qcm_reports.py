@@ -0,0 +1,163 @@
+"""Professor reports: filtered attempt streams, pagination, per-QCM aggregates and CSV export.
+
+Attempts are always consumed as generators, so a report never holds more than
+one page of them. Per-QCM aggregates are built from one history scan on first
+use and then updated on every new attempt.
+"""
+import csv
+import heapq
+import itertools
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from qcm_grading import AnswerKey
+from qcm_storage import StorageBackend, attempt_qcm
+
+# Upper bounds (seconds) of the time_taken histogram buckets, the last bucket is open
+TIME_BUCKETS = [30, 60, 120, 300, 600]
+CSV_COLUMNS = ['user', 'date', 'category', 'title', 'score', 'correct_answers', 'total_questions', 'time_taken', 'answers']
+
+
+def iter_attempts(storage: StorageBackend, username: Optional[str] = None, category: Optional[str] = None,
+                  title: Optional[str] = None, date_from: Optional[str] = None,
+                  date_to: Optional[str] = None) -> Iterator[Tuple[str, dict]]:
+    """Yield the (username, result) pairs matching every given filter.
+
+    Dates are compared as 'YYYY-MM-DD HH:MM:SS' strings, a shorter date_to
+    such as '2024-12-29' includes the whole day.
+    """
+    return storage.find_attempts(username, category, title, date_from, date_to)
+
+
+def iter_pages(attempts: Iterable, page_size: int = 20) -> Iterator[list]:
+    """Split a stream into pages, reading only one page ahead"""
+    attempts = iter(attempts)
+    while True:
+        page = list(itertools.islice(attempts, page_size))
+        if not page:
+            return
+        yield page
+
+
+def export_csv(attempts: Iterable[Tuple[str, dict]], f: TextIO) -> int:
+    """Write attempts as CSV rows as they come, returns the number of rows"""
+    writer = csv.writer(f)
+    writer.writerow(CSV_COLUMNS)
+    count = 0
+    for username, result in attempts:
+        writer.writerow([username] + [result[column] for column in CSV_COLUMNS[1:]])
+        count += 1
+    return count
+
+
+class QCMAggregate:
+    """Running statistics of every attempt of one QCM"""
+
+    def __init__(self, total_questions: int):
+        self.count = 0
+        self.total_score = 0.0
+        self.total_time = 0.0
+        self.question_correct = [0] * total_questions
+        self.question_answered = [0] * total_questions
+        self.time_buckets = [0] * (len(TIME_BUCKETS) + 1)
+        # Running median: max-heap (negated) of the lower half, min-heap of the upper half
+        self._lower: List[float] = []
+        self._upper: List[float] = []
+
+    def add(self, result: dict, key: Optional[AnswerKey]):
+        score = result['score']
+        self.count += 1
+        self.total_score += score
+        self.total_time += result['time_taken']
+        if not self._lower or score <= -self._lower[0]:
+            heapq.heappush(self._lower, -score)
+        else:
+            heapq.heappush(self._upper, score)
+        if len(self._lower) > len(self._upper) + 1:
+            heapq.heappush(self._upper, -heapq.heappop(self._lower))
+        elif len(self._upper) > len(self._lower):
+            heapq.heappush(self._lower, -heapq.heappop(self._upper))
+
+        bucket = 0
+        while bucket < len(TIME_BUCKETS) and result['time_taken'] > TIME_BUCKETS[bucket]:
+            bucket += 1
+        self.time_buckets[bucket] += 1
+
+        if key is not None and len(result['answers']) <= len(key):
+            answered = min(len(result['answers']), len(self.question_answered))
+            for i, correct in enumerate(key.correct_flags(result['answers'])[:answered]):
+                self.question_answered[i] += 1
+                self.question_correct[i] += correct
+
+    def mean(self) -> float:
+        return self.total_score / self.count if self.count else 0.0
+
+    def median(self) -> float:
+        if not self.count:
+            return 0.0
+        if len(self._lower) > len(self._upper):
+            return -self._lower[0]
+        return (-self._lower[0] + self._upper[0]) / 2
+
+    def mean_time(self) -> float:
+        return self.total_time / self.count if self.count else 0.0
+
+    def success_rates(self) -> List[Optional[float]]:
+        """Share of correct answers per question, None for a question never answered"""
+        return [
+            correct / answered * 100 if answered else None
+            for correct, answered in zip(self.question_correct, self.question_answered)
+        ]
+
+    def time_distribution(self) -> List[Tuple[str, int]]:
+        labels = []
+        low = 0
+        for high in TIME_BUCKETS:
+            labels.append(f"{low}-{high}s")
+            low = high
+        labels.append(f">{low}s")
+        return list(zip(labels, self.time_buckets))
+
+
+class ReportIndex:
+    """Per-QCM aggregates, kept in sync with new attempts"""
+
+    def __init__(self, storage: StorageBackend, answer_key: Callable[[str, str], Optional[AnswerKey]]):
+        self.storage = storage
+        self.answer_key = answer_key
+        self.qcms: Optional[Dict[Tuple[str, str], QCMAggregate]] = None
+
+    def _build(self):
+        history = self.storage.scan_history()
+        self.qcms = {}
+        for username, result in history:
+            self._add(result)
+
+    def _add(self, result: dict):
+        qcm = attempt_qcm(result)
+        if qcm is None:
+            # A generated quiz mixes questions of several QCMs, see qcm_quizgen
+            return
+        aggregate = self.qcms.get(qcm)
+        if aggregate is None:
+            aggregate = self.qcms[qcm] = QCMAggregate(result['total_questions'])
+        aggregate.add(result, self.answer_key(*qcm))
+
+    def record(self, username: str, result: dict):
+        if self.qcms is not None:
+            self._add(result)
+
+    def replace(self, username: str, result: dict):
+        """An attempt was regraded in place: the aggregates are rebuilt on next use"""
+        self.qcms = None
+
+    def aggregate(self, category: str, title: str) -> Optional[QCMAggregate]:
+        self.storage.refresh()
+        if self.qcms is None:
+            self._build()
+        return self.qcms.get((category, title))
+
+    def all(self) -> Dict[Tuple[str, str], QCMAggregate]:
+        self.storage.refresh()
+        if self.qcms is None:
+            self._build()
+        return self.qcms
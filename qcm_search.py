@@ -0,0 +1,466 @@
+"""Full-text search over the question bank: titles, question text and options.
+
+Text is lowercased, accents are dropped and it is split into words. Every
+question is a document; each word maps to a sorted array of its postings,
+(document << 2 | field) with field 1 for the question text and 2 for an
+option. Titles and categories have their own small word -> QCMs table.
+
+A query word matches the words equal to it, and also the words it starts
+(for the last word, so a search can be typed incrementally) or, when neither
+exists, the words one typo away (found through a table of one-letter
+deletions kept with the index). Every query word must match, in the question
+or in its QCM's title. Candidates come from the cheapest word, best weighted
+matches first, and the others are looked up among the words kept with each
+candidate; the search stops as soon as `limit` QCMs score as much as any
+candidate left could. Results are QCMs ranked by the idf-weighted
+matches of their best question.
+
+The index is built by one pass over the QCM files, in a background thread
+started with the app (start()) or else on first use; a query arriving before
+the build is over waits for it. It then catches up with the QCMs added or
+rewritten since (QuestionBank.changes), including by other processes. It also
+finds near-duplicates of a question being written.
+
+    python qcm_search.py "python list"            # search the bank
+    python qcm_search.py --bench --qcms 10000     # timings on a synthetic bank
+"""
+import argparse
+import bisect
+import itertools
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+from qcm_bank import Question, QuestionBank
+
+QUESTION_FIELD = 1
+OPTION_FIELD = 2
+FIELD_WEIGHTS = {QUESTION_FIELD: 2.0, OPTION_FIELD: 1.0}
+# A word of the title counts as much as one of the question: no candidate can then outscore the best match
+TITLE_WEIGHT = FIELD_WEIGHTS[QUESTION_FIELD]
+PREFIX_WEIGHT = 0.8
+FUZZY_WEIGHT = 0.6
+MAX_EXPANSIONS = 50
+DUPLICATE_THRESHOLD = 0.8
+
+WORD = re.compile(r'\w+')
+
+# (score, category, title, index of the best matching question or None when only the title matched)
+SearchHit = Tuple[float, str, str, Optional[int]]
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase words of a text, without accents"""
+    text = text.lower()
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(c for c in text if not unicodedata.combining(c))
+    return WORD.findall(text)
+
+
+def _one_edit(a: str, b: str) -> bool:
+    """a and b differ by at most one insertion, deletion, substitution or swap of neighbours"""
+    if abs(len(a) - len(b)) > 1:
+        return False
+    i = 0
+    while i < min(len(a), len(b)) and a[i] == b[i]:
+        i += 1
+    return (a[i + 1:] == b[i + 1:] or a[i:] == b[i + 1:] or a[i + 1:] == b[i:]
+            or (a[i + 1:i + 2] == b[i:i + 1] and a[i:i + 1] == b[i + 1:i + 2] and a[i + 2:] == b[i + 2:]))
+
+
+def _deletions(word: str) -> Set[str]:
+    return {word[:i] + word[i + 1:] for i in range(len(word))}
+
+
+def _field_docs(postings: array, field: int) -> Iterator[int]:
+    """Documents of the postings matching in `field`"""
+    for entry in postings:
+        if entry & 3 == field:
+            yield entry >> 2
+
+
+class SearchIndex:
+    """Inverted index over the bank, kept up to date with the QCMs written to it"""
+
+    def __init__(self, bank: QuestionBank):
+        self.bank = bank
+        self.postings: Dict[str, array] = {}
+        # Every indexed word, sorted again before a prefix lookup when words were added since
+        self.vocabulary: List[str] = []
+        self._vocabulary_sorted = True
+        self.title_postings: Dict[str, Set[int]] = {}
+        # Document -> (QCM, question index, words of the question, words of its options), None once removed
+        self.docs: List[Optional[Tuple[int, int, Tuple[str, ...], Tuple[str, ...]]]] = []
+        self.qcms: List[Tuple[str, str]] = []
+        self.qcm_ids: Dict[Tuple[str, str], int] = {}
+        self.qcm_docs: Dict[int, range] = {}
+        self.qcm_words: Dict[int, Tuple[str, ...]] = {}
+        self.live_docs = 0
+        # One-letter deletions of every word -> words, to find those one typo away
+        self._deletes: Dict[str, List[str]] = {}
+        self._position: Optional[int] = None
+        self._builder: Optional[threading.Thread] = None
+        self._closing = False
+
+    def start(self):
+        """Index the bank as it is now in a background thread, so no query pays for the whole build"""
+        if self._position is not None:
+            return
+        self._position = self.bank.version
+        qcms = [(category, title) for category in self.bank for title in self.bank[category]]
+        self._builder = threading.Thread(target=self._build, args=(qcms,), name='qcm-search-index', daemon=True)
+        self._builder.start()
+
+    def _build(self, qcms: List[Tuple[str, str]]):
+        # The files rather than the cached questions: the build neither fills nor flushes the bank cache
+        for category, title in qcms:
+            if self._closing:
+                return
+            self.add_qcm(category, title, self.bank.stored_questions(category, title))
+
+    def close(self):
+        """Stop a background build still running"""
+        self._closing = True
+        if self._builder is not None:
+            self._builder.join()
+            self._builder = None
+
+    def refresh(self):
+        """Index the whole bank on first use unless start() did, afterwards only the QCMs written since"""
+        if self._builder is not None:
+            # Nothing else touches the index until the build is over
+            self._builder.join()
+            self._builder = None
+        self.bank.refresh()
+        if self._position is None:
+            self._position = self.bank.version
+            self._build([(category, title) for category in self.bank for title in self.bank[category]])
+            return
+        changed = dict.fromkeys(self.bank.changes[self._position:])
+        self._position = self.bank.version
+        self._build(list(changed))
+
+    def _add_word(self, word: str) -> array:
+        postings = self.postings.get(word)
+        if postings is None:
+            postings = self.postings[word] = array('I')
+            self.vocabulary.append(word)
+            self._vocabulary_sorted = False
+            for variant in _deletions(word):
+                self._deletes.setdefault(variant, []).append(word)
+        return postings
+
+    def add_qcm(self, category: str, title: str, questions: Iterable[Union[dict, Question]]):
+        """Index a QCM, replacing what was indexed for it before"""
+        qcm = self.qcm_ids.get((category, title))
+        if qcm is None:
+            qcm = self.qcm_ids[(category, title)] = len(self.qcms)
+            self.qcms.append((category, title))
+        else:
+            self._remove_qcm(qcm)
+        words = tuple(dict.fromkeys(tokenize(category) + tokenize(title)))
+        self.qcm_words[qcm] = words
+        for word in words:
+            self.title_postings.setdefault(word, set()).add(qcm)
+            self._add_word(word)
+
+        first = len(self.docs)
+        postings = self.postings
+        for index, question in enumerate(questions):
+            doc = len(self.docs)
+            text = tuple(dict.fromkeys(tokenize(question['question'])))
+            # Words never span a space, so the options are split in one go
+            options = tuple(dict.fromkeys(tokenize(' '.join(question['options']))))
+            self.docs.append((qcm, index, text, options))
+            self.live_docs += 1
+            # New documents have the highest numbers, so appending keeps every postings array sorted
+            for word in text:
+                (postings.get(word) or self._add_word(word)).append(doc << 2 | QUESTION_FIELD)
+            for word in options:
+                (postings.get(word) or self._add_word(word)).append(doc << 2 | OPTION_FIELD)
+        self.qcm_docs[qcm] = range(first, len(self.docs))
+
+    def _remove_qcm(self, qcm: int):
+        for word in self.qcm_words.pop(qcm, ()):
+            self.title_postings[word].discard(qcm)
+        for doc in self.qcm_docs.pop(qcm, range(0)):
+            _, _, text, options = self.docs[doc]
+            for field, words in ((QUESTION_FIELD, text), (OPTION_FIELD, options)):
+                for word in words:
+                    postings = self.postings[word]
+                    i = bisect.bisect_left(postings, doc << 2 | field)
+                    del postings[i]
+            self.docs[doc] = None
+            self.live_docs -= 1
+
+    def _indexed(self, word: str) -> bool:
+        """The word is in a question, an option or a title (words of removed QCMs stay in the vocabulary)"""
+        return bool(self.postings.get(word) or self.title_postings.get(word))
+
+    def idf(self, frequency: int) -> float:
+        """Weight of a word found in `frequency` postings: the rarer, the heavier"""
+        return math.log(1 + (self.live_docs + 1) / (frequency + 1))
+
+    def _expand(self, word: str, prefix: bool) -> List[Tuple[str, float]]:
+        """(indexed word, match weight) for one query word: exact, then prefix or one typo away"""
+        matches = [(word, 1.0)] if self._indexed(word) else []
+        if prefix:
+            if not self._vocabulary_sorted:
+                self.vocabulary.sort()
+                self._vocabulary_sorted = True
+            start = bisect.bisect_left(self.vocabulary, word)
+            for candidate in self.vocabulary[start:start + MAX_EXPANSIONS + 1]:
+                if not candidate.startswith(word):
+                    break
+                if candidate != word and self._indexed(candidate):
+                    matches.append((candidate, PREFIX_WEIGHT))
+        if not matches and len(word) > 2:
+            candidates = set(self._deletes.get(word, ()))
+            for variant in _deletions(word):
+                if variant in self.postings:
+                    candidates.add(variant)
+                candidates.update(self._deletes.get(variant, ()))
+            matches = [(candidate, FUZZY_WEIGHT) for candidate in sorted(candidates)
+                       if _one_edit(word, candidate) and self._indexed(candidate)]
+        return matches[:MAX_EXPANSIONS]
+
+    def _doc_weights(self, forms: Dict[str, float]) -> Callable[[int], float]:
+        """Best weight of a query word's matches in a document, 0 if none.
+
+        The document's own words are looked up among the forms of the query
+        word: a few dict lookups, however many forms a prefix or a typo has.
+        """
+        docs = self.docs
+        question_weight, option_weight = FIELD_WEIGHTS[QUESTION_FIELD], FIELD_WEIGHTS[OPTION_FIELD]
+        if len(forms) == 1:
+            [(form, weight)] = forms.items()
+
+            def lookup_one(doc: int) -> float:
+                _, _, text, options = docs[doc]
+                if form in text:
+                    return weight * question_weight
+                return weight * option_weight if form in options else 0.0
+            return lookup_one
+
+        get = forms.get
+        best_option = max(forms.values()) * option_weight
+
+        def lookup(doc: int) -> float:
+            _, _, text, options = docs[doc]
+            best = 0.0
+            for word in text:
+                weight = get(word)
+                if weight is not None and weight > best:
+                    best = weight
+            best *= question_weight
+            if best < best_option:
+                for word in options:
+                    weight = get(word)
+                    if weight is not None and weight * option_weight > best:
+                        best = weight * option_weight
+            return best
+        return lookup
+
+    def search(self, query: str, limit: int = 10) -> List[SearchHit]:
+        """QCMs where every word of the query is in one question or in the title, best first"""
+        self.refresh()
+        words = list(dict.fromkeys(tokenize(query)))
+        if not words:
+            return []
+        expansions = [self._expand(word, prefix=(i == len(words) - 1)) for i, word in enumerate(words)]
+        if not all(expansions):
+            return []
+
+        # Per query word: (postings, weight) of each match, the weight its QCM title adds, and the best it can add
+        groups = []
+        for expansion in expansions:
+            matches = [(self.postings.get(word) or array('I'), weight) for word, weight in expansion]
+            # A query word weighs by how often all its forms appear together, so its best match is a common one
+            idf = self.idf(sum(len(postings) for postings, _ in matches))
+            groups.append([(postings, weight * idf) for postings, weight in matches])
+        titles: List[Dict[int, float]] = []
+        for expansion, group in zip(expansions, groups):
+            title_weights: Dict[int, float] = {}
+            # Lightest first, so a QCM keeps the best weight of the matches in its title
+            for (word, _), (_, weight) in sorted(zip(expansion, group), key=lambda match: match[1][1]):
+                if word in self.title_postings:
+                    title_weights.update(dict.fromkeys(self.title_postings[word], TITLE_WEIGHT * weight))
+            titles.append(title_weights)
+        bounds = [max([weight * FIELD_WEIGHTS[QUESTION_FIELD] for postings, weight in group if postings]
+                      + list(title_weights.values())) for group, title_weights in zip(groups, titles)]
+
+        # Candidates come from the most selective word, in tiers of decreasing weight for that word
+        sizes = [sum(len(postings) for postings, _ in group) + sum(map(len, map(self.qcm_docs.__getitem__, title_weights)))
+                 for group, title_weights in zip(groups, titles)]
+        driver = min(range(len(groups)), key=sizes.__getitem__)
+        tiers = [(weight * FIELD_WEIGHTS[field], True, _field_docs(postings, field))
+                 for postings, weight in groups[driver] for field in FIELD_WEIGHTS]
+        by_weight: Dict[float, List[int]] = {}
+        for qcm, weight in titles[driver].items():
+            by_weight.setdefault(weight, []).append(qcm)
+        tiers += [(weight, False, (doc for qcm in qcms for doc in self.qcm_docs[qcm])) for weight, qcms in by_weight.items()]
+        tiers.sort(key=lambda tier: -tier[0])
+        others = [(self._doc_weights({word: weight for (word, _), (_, weight) in zip(expansion, group)}), title_weights)
+                  for i, (expansion, group, title_weights) in enumerate(zip(expansions, groups, titles)) if i != driver]
+        rest = sum(bounds) - bounds[driver]
+
+        best: Dict[int, Tuple[float, Optional[int]]] = {}
+        seen: Set[int] = set()
+        ceiling = math.inf
+        reached = 0
+        for tier_weight, in_postings, docs in tiers:
+            # No document left can score above this: stop once `limit` QCMs reach it
+            if tier_weight + rest - 1e-9 < ceiling:
+                ceiling = tier_weight + rest - 1e-9
+                reached = sum(1 for score, _ in best.values() if score >= ceiling)
+            if reached >= limit:
+                break
+            for doc in docs:
+                if doc in seen:
+                    continue
+                seen.add(doc)
+                qcm, index, _, _ = self.docs[doc]
+                score = tier_weight
+                in_question = in_postings
+                for doc_weight, title_weights in others:
+                    weight = doc_weight(doc)
+                    title = title_weights.get(qcm, 0.0)
+                    if not weight and not title:
+                        break
+                    score += max(weight, title)
+                    in_question = in_question or weight > 0
+                else:
+                    previous = best.get(qcm, (0.0, None))[0]
+                    if score > previous:
+                        best[qcm] = (score, index if in_question else None)
+                        if score >= ceiling > previous:
+                            reached += 1
+                            if reached >= limit:
+                                break
+
+        hits = [(score, *self.qcms[qcm], index) for qcm, (score, index) in best.items()]
+        hits.sort(key=lambda hit: (-hit[0], hit[1], hit[2]))
+        return hits[:limit]
+
+    def similar_questions(self, text: str, threshold: float = DUPLICATE_THRESHOLD,
+                          limit: int = 5) -> List[Tuple[float, str, str, int]]:
+        """(similarity, category, title, index) of questions whose words overlap `text` by `threshold` (Jaccard)"""
+        self.refresh()
+        words = set(tokenize(text))
+        if not words:
+            return []
+        # A question that similar shares at least one of the len - ceil(threshold * len) + 1 rarest words
+        rare = sorted(words, key=lambda word: len(self.postings.get(word, ())))
+        rare = rare[:len(words) - math.ceil(threshold * len(words)) + 1]
+        candidates = {entry >> 2 for word in rare for entry in self.postings.get(word, ())
+                      if entry & 3 == QUESTION_FIELD}
+        # Sets that similar are also close in size
+        shortest, longest = threshold * len(words), len(words) / threshold
+        similar = []
+        for doc in candidates:
+            qcm, index, question_words, _ = self.docs[doc]
+            if not shortest <= len(question_words) <= longest:
+                continue
+            # The words of a question are distinct: the union is counted rather than built
+            common = len(words.intersection(question_words))
+            similarity = common / (len(words) + len(question_words) - common)
+            if similarity >= threshold:
+                similar.append((similarity, *self.qcms[qcm], index))
+        similar.sort(key=lambda match: (-match[0], match[1], match[2], match[3]))
+        return similar[:limit]
+
+
+def bench(qcm_count: int, seed: int = 0, queries: int = 1000) -> Dict[str, float]:
+    """Build and query times on a synthetic bank of `qcm_count` QCMs with a Zipf-like vocabulary"""
+    import random
+    import shutil
+    import tempfile
+
+    from qcm_bench import OPTIONS_PER_QUESTION, QUESTIONS_PER_QCM
+
+    rng = random.Random(seed)
+    syllables = ['ka', 'lo', 'mi', 'ne', 'ra', 'tu', 'vo', 'zi', 'pe', 'sa', 'do', 'fi']
+    vocabulary = list(dict.fromkeys(''.join(rng.choice(syllables) for _ in range(rng.randint(2, 4)))
+                                    for _ in range(20000)))
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+
+    def sentence(length: int) -> str:
+        return ' '.join(rng.choices(vocabulary, cum_weights=cum_weights, k=length))
+
+    directory = tempfile.mkdtemp(prefix='qcm-search-')
+    try:
+        bank = QuestionBank(directory)
+        for i in range(qcm_count):
+            questions = [{'question': sentence(8) + '?', 'options': [sentence(2) for _ in range(OPTIONS_PER_QUESTION)],
+                          'correct': 1} for _ in range(QUESTIONS_PER_QCM)]
+            bank.save_qcm(f"Category {i % 20}", f"{sentence(2)} {i}", questions)
+        index = SearchIndex(bank)
+        start = time.perf_counter()
+        index.refresh()
+        build = time.perf_counter() - start
+
+        figures = {'questions': qcm_count * QUESTIONS_PER_QCM, 'words': len(index.vocabulary), 'build_seconds': build}
+
+        def question_words(count: int) -> List[str]:
+            # Words of one indexed question, as someone looking for it would type them
+            words = index.docs[rng.randrange(len(index.docs))][2]
+            return rng.sample(words, min(count, len(words)))
+
+        for name, make in (('two_words', lambda: ' '.join(question_words(2))),
+                           ('common_words', lambda: sentence(2)),
+                           ('prefix', lambda: ' '.join(word[:3] if i else word
+                                                       for i, word in enumerate(question_words(2)))),
+                           ('typo', lambda: _typo(rng.choice(vocabulary[:2000]), rng)),
+                           ('duplicate', None)):
+            times = []
+            for _ in range(queries):
+                if make is None:
+                    doc = index.docs[rng.randrange(len(index.docs))]
+                    text = ' '.join(doc[2])
+                    start = time.perf_counter()
+                    index.similar_questions(text)
+                else:
+                    query = make()
+                    start = time.perf_counter()
+                    index.search(query)
+                times.append(time.perf_counter() - start)
+            times.sort()
+            figures[f"{name}_p50_ms"] = times[len(times) // 2] * 1000
+            figures[f"{name}_p99_ms"] = times[len(times) * 99 // 100] * 1000
+        return figures
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _typo(word: str, rng) -> str:
+    i = rng.randrange(len(word))
+    return word[:i] + rng.choice('aeiouz') + word[i + 1:]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search the question bank")
+    parser.add_argument('query', nargs='?')
+    parser.add_argument('--bank-dir', default=os.path.join('qcm_data', 'bank'))
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--bench', action='store_true', help="Time building and querying a synthetic bank")
+    parser.add_argument('--qcms', type=int, default=10000, help="--bench: size of the synthetic bank, in QCMs")
+    args = parser.parse_args()
+
+    if args.bench:
+        for name, value in bench(args.qcms).items():
+            print(f"{name:<20} {value:.3f}" if isinstance(value, float) else f"{name:<20} {value}")
+    elif args.query:
+        bank = QuestionBank(args.bank_dir)
+        for score, category, title, index in SearchIndex(bank).search(args.query, args.limit):
+            line = f"{score:6.2f}  {category} / {title}"
+            if index is not None:
+                line += f"  - {bank.questions(category, title)[index].question}"
+            print(line)
+    else:
+        parser.error("give a query, or --bench")
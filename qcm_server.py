@@ -0,0 +1,316 @@
+"""Line-protocol quiz server running many QuizSession objects in one process.
+
+Every request and response is one JSON object per line, for example:
+
+    {"cmd": "login", "username": "chakib", "password": "..."}
+    {"cmd": "start", "category": "Games", "title": "Elden Ring"}
+    {"cmd": "answer", "answer": 2}            (or a list for multiple choice)
+
+Responses carry "ok": true/false, the next question, and the result once the
+quiz is over. Login answers with a session token; {"cmd": "resume", "token": ...}
+logs a new connection in without hashing the password again. Other commands:
+register, categories, titles, finish, metrics, quit.
+
+With --workers N the listening socket is opened once and shared by N worker
+processes, each with its own QCMApp and event loop; the kernel hands every
+new connection to one of them. Workers read the question bank files on their
+own and write users and attempts to the shared storage (the JSON log under its
+lock, or SQLite), picking up each other's writes before ranking. Tokens are
+signed with a secret shared by the workers, so "resume" works on any of them.
+
+Commands touching the app (sessions, storage, leaderboards) run one at a time
+on a single storage thread, so lock waits, fsyncs and log compactions never
+stall the event loop that serves the other connections.
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import multiprocessing
+import os
+import secrets
+import signal
+import socket
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from qcm_app import QCMApp
+from qcm_metrics import metrics
+from qcm_session import QuizSession
+
+
+def public_question(session: QuizSession) -> Optional[dict]:
+    """Question sent to the client, without its correct answer"""
+    question = session.next_question()
+    if question is None:
+        return None
+    return {
+        'number': session.index + 1,
+        'total': len(session.questions),
+        'question': question.question,
+        'options': question.options,
+        'type': 'multiple' if question.multiple else 'single',
+        'answers_expected': question.answer_count,
+        'remaining_time': session.remaining_time()
+    }
+
+
+class ClientConnection:
+    """One connected client: its own user and at most one running session"""
+
+    def __init__(self, app: QCMApp, executor: Optional[Executor] = None):
+        self.app = app
+        self.executor = executor
+        self.username: Optional[str] = None
+        self.session: Optional[QuizSession] = None
+
+    async def call(self, function: Callable[..., Any], *args) -> Any:
+        """Run a blocking call on the storage thread (inline without one)"""
+        if self.executor is None:
+            return function(*args)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def handle(self, request: dict) -> dict:
+        command = request.get('cmd')
+        handler = getattr(self, f"cmd_{command}", None)
+        if handler is None:
+            return {'ok': False, 'error': f"Unknown command: {command}"}
+        try:
+            if inspect.iscoroutinefunction(handler):
+                return await handler(request)
+            return await self.call(handler, request)
+        except (KeyError, TypeError, ValueError) as e:
+            return {'ok': False, 'error': str(e.args[0]) if e.args else type(e).__name__}
+
+    async def cmd_register(self, request: dict) -> dict:
+        if await self.call(self.app.storage.user_exists, request['username']):
+            return {'ok': False, 'error': "Username already exists!"}
+        password_hash = await self.app.auth.hash_async(request['password'])
+        if await self.call(self.app.storage.user_exists, request['username']):
+            return {'ok': False, 'error': "Username already exists!"}
+        await self.call(self.app.add_user, request['username'], password_hash)
+        return {'ok': True}
+
+    async def cmd_login(self, request: dict) -> dict:
+        token = await self.app.auth.verify_async(request['username'], request['password'])
+        if token is None:
+            return {'ok': False, 'error': "Invalid username or password!"}
+        self.username = request['username']
+        return {'ok': True, 'token': token}
+
+    def cmd_resume(self, request: dict) -> dict:
+        username = self.app.auth.check_token(request['token'])
+        if username is None:
+            return {'ok': False, 'error': "Unknown or expired token, please login again"}
+        self.username = username
+        return {'ok': True, 'username': username}
+
+    def cmd_categories(self, request: dict) -> dict:
+        return {'ok': True, 'categories': list(self.app.qcms)}
+
+    def cmd_titles(self, request: dict) -> dict:
+        return {'ok': True, 'titles': list(self.app.qcms[request['category']])}
+
+    def cmd_start(self, request: dict) -> dict:
+        if not self.username:
+            return {'ok': False, 'error': "Please login first!"}
+        self.close_session()
+        self.session = self.app.engine.start(
+            self.username, request['category'], request['title'], request.get('time_limit', 200)
+        )
+        return {'ok': True, 'session': self.session.id, 'question': public_question(self.session)}
+
+    def cmd_answer(self, request: dict) -> dict:
+        if self.session is None:
+            return {'ok': False, 'error': "No quiz in progress"}
+        question = self.session.next_question()
+        correct = self.app.engine.submit(self.session.id, request['answer'])
+        response = {'ok': True, 'correct': correct}
+        if not correct:
+            response['correct_answer'] = [question.options[i - 1] for i in question.correct_indexes()]
+        response['question'] = public_question(self.session)
+        if response['question'] is None:
+            response['result'] = self.finish_session()
+        return response
+
+    def cmd_finish(self, request: dict) -> dict:
+        if self.session is None:
+            return {'ok': False, 'error': "No quiz in progress"}
+        return {'ok': True, 'result': self.finish_session()}
+
+    def cmd_metrics(self, request: dict) -> dict:
+        if request.get('format') == 'prometheus':
+            return {'ok': True, 'metrics': metrics.prometheus()}
+        return {'ok': True, 'metrics': metrics.snapshot()}
+
+    def finish_session(self) -> dict:
+        result = self.app.engine.finish(self.session.id)
+        self.session = None
+        board = self.app.leaderboards.board()
+        return dict(result, rank=board.rank(self.username), players=len(board))
+
+    def close_session(self):
+        if self.session is not None:
+            self.app.engine.discard(self.session.id)
+            self.session = None
+
+
+async def handle_client(app: QCMApp, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                        executor: Optional[Executor] = None):
+    client = ClientConnection(app, executor)
+    if metrics.enabled:
+        metrics.count('connections')
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError:
+                request = None
+            if not isinstance(request, dict):
+                response = {'ok': False, 'error': "Requests are one JSON object per line"}
+            else:
+                if request.get('cmd') == 'quit':
+                    break
+                response = await client.handle(request)
+            writer.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        await client.call(client.close_session)
+        writer.close()
+
+
+async def serve(app: QCMApp, host: str = '127.0.0.1', port: int = 8765, sock: Optional[socket.socket] = None):
+    # One thread, so the app and its storage still see one command at a time
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='qcm-storage')
+    app.auth.storage_executor = executor
+    # Writer of each open connection, by the task serving it
+    connections = {}
+
+    async def connected(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        connections[task] = writer
+        try:
+            await handle_client(app, reader, writer, executor)
+        finally:
+            del connections[task]
+
+    if sock is not None:
+        server = await asyncio.start_server(connected, sock=sock, limit=1 << 16)
+    else:
+        server = await asyncio.start_server(connected, host, port, limit=1 << 16)
+    try:
+        if metrics.enabled and metrics.path:
+            asyncio.ensure_future(dump_metrics(metrics.interval))
+        # Serves until cancelled. Not serve_forever(): once cancelled, it waits for the clients to leave
+        await asyncio.get_running_loop().create_future()
+    finally:
+        # Clients still connected are disconnected and their sessions discarded on the storage
+        # thread, then the writes already queued complete before the app is closed
+        server.close()
+        for writer in list(connections.values()):
+            writer.close()
+        await asyncio.gather(*connections, return_exceptions=True)
+        await server.wait_closed()
+        executor.shutdown(wait=True)
+        app.auth.storage_executor = None
+
+
+async def dump_metrics(interval: float):
+    """Rewrite the metrics file every `interval` seconds"""
+    while True:
+        await asyncio.sleep(interval)
+        metrics.dump()
+
+
+def listen(host: str, port: int, backlog: int = 1024) -> socket.socket:
+    sock = socket.create_server((host, port), backlog=backlog)
+    sock.setblocking(False)
+    return sock
+
+
+def _stop(signum, frame):
+    raise KeyboardInterrupt
+
+
+def run_worker(sock: socket.socket, data_dir: str, qcms_file: str, storage: Optional[str], secret: bytes,
+               index: int = 0):
+    """Body of one worker process: its own app and event loop on the shared socket"""
+    if metrics.path:
+        # One metrics file per worker: qcm.prom becomes qcm.0.prom, qcm.1.prom...
+        base, ext = os.path.splitext(metrics.path)
+        metrics.path = f"{base}.{index}{ext}"
+    # Only the parent reacts to Ctrl+C, it stops the workers with SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, _stop)
+    app = QCMApp(data_dir, qcms_file, storage)
+    app.auth.secret = secret
+    try:
+        asyncio.run(serve(app, sock=sock))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        app.close()
+
+
+def run_workers(workers: int, host: str, port: int, data_dir: str, qcms_file: str, storage: Optional[str]):
+    """Serve from `workers` processes sharing one listening socket, until interrupted"""
+    sock = listen(host, port)
+    secret = secrets.token_bytes(32)
+    processes = [
+        multiprocessing.Process(target=run_worker, args=(sock, data_dir, qcms_file, storage, secret, i),
+                                name=f"qcm-worker-{i}")
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    sock.close()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve QCMs over TCP, one JSON request per line")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--data-dir', default='qcm_data')
+    parser.add_argument('--qcms', default='qcms.json')
+    parser.add_argument('--storage', choices=['json', 'sqlite'], default=None)
+    parser.add_argument('--workers', type=int, default=1, help="Worker processes sharing the listening socket")
+    parser.add_argument('--metrics', help="Enable instrumentation and rewrite this file periodically (.prom or .json)")
+    parser.add_argument('--metrics-interval', type=float, default=10.0)
+    args = parser.parse_args()
+
+    if args.metrics:
+        metrics.enable(args.metrics, args.metrics_interval)
+
+    if args.workers > 1:
+        print(f"Serving QCMs on {args.host}:{args.port} with {args.workers} workers")
+        run_workers(args.workers, args.host, args.port, args.data_dir, args.qcms, args.storage)
+        return
+    app = QCMApp(args.data_dir, args.qcms, args.storage)
+    print(f"Serving QCMs on {args.host}:{args.port}")
+    try:
+        asyncio.run(serve(app, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        app.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import itertools
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Union
+
+from qcm_bank import Question
+from qcm_grading import AnswerKey
+
+
+def validate_answer(question: Question, answer: Union[int, list]) -> Optional[str]:
+    """Return why an answer cannot be accepted for the question, or None if it can"""
+    options = len(question.options)
+    if question.multiple:
+        if not isinstance(answer, list) or not all(isinstance(a, int) for a in answer):
+            return "This is a multiple choice question, send a list of numbers"
+        if len(answer) != question.answer_count:
+            return f"Select {question.answer_count} answers"
+        if len(set(answer)) != len(answer):
+            return "The same answer was selected twice"
+        choices = answer
+    else:
+        if not isinstance(answer, int) or isinstance(answer, bool):
+            return "Send one number"
+        choices = [answer]
+    if any(not 1 <= a <= options for a in choices):
+        return f"Invalid choice! Please enter a number between 1 and {options}"
+    return None
+
+
+class QuizSession:
+    """State of one quiz being taken: no terminal I/O, no global current user"""
+
+    def __init__(self, session_id: int, username: str, category: str, title: str,
+                 questions: List[Question], key: AnswerKey, time_limit: int, sources: Optional[list] = None):
+        self.id = session_id
+        self.username = username
+        self.category = category
+        self.title = title
+        self.questions = questions
+        self.key = key
+        self.time_limit = time_limit
+        # [category, title, index] of each question of a generated quiz, None for a stored QCM
+        self.sources = sources
+        self.start_time = time.time()
+        self.end_time = self.start_time + time_limit
+        self.answers: List[Union[int, list]] = []
+        self.score = 0
+        self.result: Optional[dict] = None
+
+    @property
+    def index(self) -> int:
+        """0-based index of the next question to answer"""
+        return len(self.answers)
+
+    def remaining_time(self) -> int:
+        return int(self.end_time - time.time())
+
+    def expired(self) -> bool:
+        return self.remaining_time() <= 0
+
+    def done(self) -> bool:
+        return self.result is not None or self.index >= len(self.questions) or self.expired()
+
+    def next_question(self) -> Optional[dict]:
+        """Next question to answer, None once the quiz is over or the time is up"""
+        if self.done():
+            return None
+        return self.questions[self.index]
+
+    def submit(self, answer: Union[int, list]) -> bool:
+        """Record the answer to the current question and tell whether it is correct"""
+        question = self.next_question()
+        if question is None:
+            raise ValueError("No question is waiting for an answer")
+        error = validate_answer(question, answer)
+        if error:
+            raise ValueError(error)
+        correct = self.key.is_correct(self.index, answer)
+        self.answers.append(answer)
+        if correct:
+            self.score += 1
+        return correct
+
+    def build_result(self) -> dict:
+        """History entry for this attempt"""
+        result = {
+            'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'category': self.category,
+            'title': self.title,
+            'score': (self.score / len(self.questions)) * 100,
+            'time_taken': time.time() - self.start_time,
+            'answers': self.answers,
+            'total_questions': len(self.questions),
+            'correct_answers': self.score
+        }
+        if self.sources is not None:
+            result['questions'] = self.sources
+        return result
+
+
+class QuizEngine:
+    """Runs any number of quiz sessions side by side for a QCMApp"""
+
+    def __init__(self, app):
+        self.app = app
+        self.sessions: Dict[int, QuizSession] = {}
+        self._ids = itertools.count(1)
+
+    def start(self, username: str, category: str, title: str, time_limit: int = 200) -> QuizSession:
+        if category not in self.app.qcms or title not in self.app.qcms[category]:
+            raise KeyError("QCM not found!")
+        questions = self.app.qcms[category][title]
+        if not questions:
+            raise KeyError("This QCM has no questions!")
+        session = QuizSession(next(self._ids), username, category, title, questions,
+                              self.app.answer_key(category, title), time_limit)
+        self.sessions[session.id] = session
+        return session
+
+    def start_generated(self, username: str, category: str, title: str, questions: List[Question],
+                        sources: list, time_limit: int = 200) -> QuizSession:
+        """Session on questions picked from several QCMs, see qcm_quizgen"""
+        if not questions:
+            raise KeyError("No questions to ask!")
+        session = QuizSession(next(self._ids), username, category, title, questions,
+                              AnswerKey(questions), time_limit, [list(source) for source in sources])
+        self.sessions[session.id] = session
+        return session
+
+    def get(self, session_id: int) -> QuizSession:
+        return self.sessions[session_id]
+
+    def submit(self, session_id: int, answer: Union[int, list]) -> bool:
+        return self.sessions[session_id].submit(answer)
+
+    def finish(self, session_id: int) -> dict:
+        """Close the session and store its attempt"""
+        session = self.sessions.pop(session_id)
+        session.result = session.build_result()
+        self.app.record_attempt(session.username, session.result)
+        return session.result
+
+    def discard(self, session_id: int):
+        """Drop an unfinished session without storing anything"""
+        self.sessions.pop(session_id, None)
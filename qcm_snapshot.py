@@ -0,0 +1,459 @@
+"""Compact binary snapshot of users, scores and history, memory-mapped at startup.
+
+The JSON snapshot parses users.json and scores.json (written with indent=4)
+and the index of its history file at startup, so starting takes longer as
+users are added. The binary snapshot (state.<id>.bin) holds the same data in
+fixed-size records:
+
+    header      magic, section count, then (name, offset, length) per section
+    strings     every distinct string once (names, hashes, dates, categories, titles)
+    users       (name, password) per user, in registration order
+    scores      (name, total_score, quizzes_taken) per user
+    history     (name, first attempt, attempt count) per user
+    attempts    (date, category, title, score, time taken, questions, correct, answers, extra)
+    answers     int64 per answer: the option for single choice, -(bitmask | 1) for multiple choice, 0 if none
+    extra       JSON of whatever does not fit the fixed fields (the sources of an adaptive quiz, ...)
+
+Each keyed section also stores its record numbers sorted by name, so a lookup
+is a binary search in the mapped file. Opening a snapshot only maps the file
+and reads the header; a user's password, scores or history are decoded each
+time they are asked for and never kept. Only the values events changed since
+the snapshot was written stay in memory, until the next compaction writes a
+new snapshot and maps it in place of this one.
+
+JSONStorage uses this format once a data directory is converted (snapshot.json
+then says "format": "binary") and keeps writing it at each compaction:
+
+    python qcm_snapshot.py to-binary [--data-dir qcm_data]
+    python qcm_snapshot.py to-json [--data-dir qcm_data]
+    python qcm_snapshot.py bench [--sizes small,medium,large]   # cold start, JSON against binary
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+from array import array
+from collections.abc import ItemsView, MutableMapping
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+MAGIC = b'QCMSNAP1'
+HEADER = struct.Struct('<8sI')
+SECTION = struct.Struct('<8sQQ')
+USER = struct.Struct('<II')
+SCORES = struct.Struct('<IdI')
+HISTORY = struct.Struct('<III')
+ATTEMPT = struct.Struct('<IIIddIIIIQI')
+# Date of an attempt kept whole in `extra`, because its fields do not fit the record
+RAW = 0xFFFFFFFF
+ATTEMPT_FIELDS = ('date', 'category', 'title', 'score', 'time_taken', 'answers', 'total_questions',
+                  'correct_answers')
+MAX_OPTION = 62
+
+
+def encode_answer(answer: Any) -> Optional[int]:
+    """int64 form of one answer, None when it has no such form"""
+    if answer is None:
+        return 0
+    if type(answer) is int:
+        return answer if 0 < answer < 1 << 62 else None
+    if type(answer) is list:
+        mask = 1
+        previous = 0
+        for option in answer:
+            # Sorted, distinct options only, so decoding gives back the same list
+            if type(option) is not int or not previous < option <= MAX_OPTION:
+                return None
+            mask |= 1 << option
+            previous = option
+        return -mask
+    return None
+
+
+def decode_answer(value: int) -> Any:
+    if value > 0:
+        return value
+    if value == 0:
+        return None
+    mask = -value
+    return [option for option in range(1, MAX_OPTION + 1) if mask >> option & 1]
+
+
+class _Strings:
+    """Distinct strings of a snapshot being written"""
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.offsets = array('Q', [0])
+        self.blob = bytearray()
+
+    def __call__(self, text: str) -> int:
+        sid = self.ids.get(text)
+        if sid is None:
+            sid = self.ids[text] = len(self.ids)
+            self.blob += text.encode('utf-8')
+            self.offsets.append(len(self.blob))
+        return sid
+
+    def section(self) -> bytes:
+        return struct.pack('<I', len(self.ids)) + self.offsets.tobytes() + bytes(self.blob)
+
+
+def _sorted_order(names: List[str]) -> bytes:
+    return array('I', sorted(range(len(names)), key=lambda i: names[i].encode('utf-8'))).tobytes()
+
+
+def encode_snapshot(users: Dict[str, str], history: Dict[str, List[dict]], scores: Dict[str, dict]) -> bytes:
+    """The snapshot file for these users, history and scores"""
+    strings = _Strings()
+    sections = []
+
+    # Read through items(): a mapped table streams its records in file order, decoding each once
+    names = []
+    records = bytearray()
+    for name, password in users.items():
+        names.append(name)
+        records += USER.pack(strings(name), strings(password))
+    sections.append((b'users', struct.pack('<I', len(names)) + bytes(records) + _sorted_order(names)))
+
+    names = []
+    records = bytearray()
+    for name, stats in scores.items():
+        names.append(name)
+        records += SCORES.pack(strings(name), stats['total_score'], stats['quizzes_taken'])
+    sections.append((b'scores', struct.pack('<I', len(names)) + bytes(records) + _sorted_order(names)))
+
+    names = []
+    records = bytearray()
+    attempts = bytearray()
+    answers = array('q')
+    extra = bytearray()
+    count = 0
+    for name, results in history.items():
+        names.append(name)
+        records += HISTORY.pack(strings(name), count, len(results))
+        count += len(results)
+        for result in results:
+            attempts += _encode_attempt(result, strings, answers, extra)
+    sections.append((b'history', struct.pack('<I', len(names)) + bytes(records) + _sorted_order(names)))
+    sections.append((b'attempts', bytes(attempts)))
+    sections.append((b'answers', answers.tobytes()))
+    sections.append((b'extra', bytes(extra)))
+    sections.insert(0, (b'strings', strings.section()))
+
+    offset = HEADER.size + SECTION.size * len(sections)
+    header = bytearray(HEADER.pack(MAGIC, len(sections)))
+    for name, data in sections:
+        header += SECTION.pack(name, offset, len(data))
+        offset += len(data)
+    return bytes(header) + b''.join(data for _, data in sections)
+
+
+def _encode_attempt(result: dict, strings: _Strings, answers: array, extra: bytearray) -> bytes:
+    try:
+        encoded = [encode_answer(answer) for answer in result['answers']]
+        fields = (strings(result['date']), strings(result['category']), strings(result['title']),
+                  float(result['score']), float(result['time_taken']), result['total_questions'],
+                  result['correct_answers'])
+        plain = (None not in encoded and type(fields[5]) is int and type(fields[6]) is int
+                 and all(type(result[key]) is str for key in ATTEMPT_FIELDS[:3]))
+    except (KeyError, TypeError):
+        plain = False
+    start = len(extra)
+    if plain:
+        others = {key: value for key, value in result.items() if key not in ATTEMPT_FIELDS}
+        others = json.dumps(others, ensure_ascii=False).encode('utf-8') if others else b''
+        try:
+            record = ATTEMPT.pack(*fields, len(answers), len(encoded), start, len(others))
+        except struct.error:
+            # Counts out of the record's range
+            plain = False
+    if not plain:
+        extra += json.dumps(result, ensure_ascii=False).encode('utf-8')
+        return ATTEMPT.pack(RAW, 0, 0, 0.0, 0.0, 0, 0, 0, 0, start, len(extra) - start)
+    extra += others
+    answers.extend(encoded)
+    return record
+
+
+def write_snapshot(path: str, users: Dict[str, str], history: Dict[str, List[dict]], scores: Dict[str, dict]):
+    """Write the snapshot file and fsync it; the caller installs it (see JSONStorage.compact)"""
+    with open(path, 'wb') as f:
+        f.write(encode_snapshot(users, history, scores))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class Snapshot:
+    """A snapshot file mapped in memory, records decoded on access"""
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a QCM snapshot")
+        self.sections: Dict[bytes, Tuple[int, int]] = {}
+        for i in range(count):
+            name, offset, length = SECTION.unpack_from(self.map, HEADER.size + i * SECTION.size)
+            self.sections[name.rstrip(b'\0')] = (offset, length)
+        self._strings_at = self.sections[b'strings'][0]
+        self.string_count = struct.unpack_from('<I', self.map, self._strings_at)[0]
+        self._blob_at = self._strings_at + 4 + 8 * (self.string_count + 1)
+        self._answers_at = self.sections[b'answers'][0]
+        self._extra_at = self.sections[b'extra'][0]
+        self._attempts_at = self.sections[b'attempts'][0]
+
+    def close(self):
+        self.map.close()
+
+    def _string_bytes(self, sid: int) -> bytes:
+        start, end = struct.unpack_from('<QQ', self.map, self._strings_at + 4 + 8 * sid)
+        return self.map[self._blob_at + start:self._blob_at + end]
+
+    def string(self, sid: int) -> str:
+        return self._string_bytes(sid).decode('utf-8')
+
+    def table(self, name: str) -> 'SnapshotTable':
+        record = {'users': USER, 'scores': SCORES, 'history': HISTORY}[name]
+        decode = {'users': self._password, 'scores': self._scores, 'history': self._history}[name]
+        cls = HistoryTable if name == 'history' else SnapshotTable
+        return cls(self, self.sections[name.encode()][0], record, decode)
+
+    def _password(self, values: tuple) -> str:
+        return self.string(values[1])
+
+    @staticmethod
+    def _scores(values: tuple) -> dict:
+        return {'total_score': values[1], 'quizzes_taken': values[2]}
+
+    def _history(self, values: tuple) -> List[dict]:
+        _, first, count = values
+        return [self.attempt(first + i) for i in range(count)]
+
+    def attempt(self, index: int) -> dict:
+        (date, category, title, score, time_taken, total, correct,
+         first, count, extra_at, extra_length) = ATTEMPT.unpack_from(self.map, self._attempts_at + index * ATTEMPT.size)
+        extra = None
+        if extra_length:
+            start = self._extra_at + extra_at
+            extra = json.loads(self.map[start:start + extra_length].decode('utf-8'))
+        if date == RAW:
+            return extra
+        start = self._answers_at + 8 * first
+        result = {
+            'date': self.string(date),
+            'category': self.string(category),
+            'title': self.string(title),
+            'score': score,
+            'time_taken': time_taken,
+            'answers': [decode_answer(value) for value in array('q', self.map[start:start + 8 * count])],
+            'total_questions': total,
+            'correct_answers': correct
+        }
+        if extra:
+            result.update(extra)
+        return result
+
+
+class SnapshotTable(MutableMapping):
+    """One keyed section of a snapshot as a dict: a value is decoded from the
+    file each time it is read. Values set since the snapshot was written are
+    kept in `changed`, with the keys `added` to the file's"""
+
+    def __init__(self, snapshot: Snapshot, offset: int, record: struct.Struct, decode: Callable[[tuple], Any]):
+        self.snapshot = snapshot
+        self.record = record
+        self.decode = decode
+        self.count = struct.unpack_from('<I', snapshot.map, offset)[0]
+        self._records_at = offset + 4
+        self._order_at = self._records_at + record.size * self.count
+        self.changed: Dict[str, Any] = {}
+        self.added: List[str] = []
+
+    def _values(self, index: int) -> tuple:
+        return self.record.unpack_from(self.snapshot.map, self._records_at + index * self.record.size)
+
+    def find(self, key: str) -> int:
+        """Record number of `key` in the file, -1 if it is not there"""
+        target = key.encode('utf-8')
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            index = struct.unpack_from('<I', self.snapshot.map, self._order_at + 4 * middle)[0]
+            name = self.snapshot._string_bytes(self._values(index)[0])
+            if name < target:
+                low = middle + 1
+            elif name > target:
+                high = middle
+            else:
+                return index
+        return -1
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return self.changed[key]
+        except KeyError:
+            pass
+        index = self.find(key)
+        if index < 0:
+            raise KeyError(key)
+        return self.decode(self._values(index))
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.changed or (isinstance(key, str) and self.find(key) >= 0)
+
+    def __setitem__(self, key: str, value: Any):
+        if key not in self:
+            self.added.append(key)
+        self.changed[key] = value
+
+    def __delitem__(self, key: str):
+        raise TypeError("snapshot entries cannot be removed")
+
+    def __iter__(self) -> Iterator[str]:
+        for index in range(self.count):
+            yield self.snapshot.string(self._values(index)[0])
+        yield from self.added
+
+    def __len__(self) -> int:
+        return self.count + len(self.added)
+
+    def items(self) -> '_Items':
+        return _Items(self)
+
+    def _iter_items(self) -> Iterator[Tuple[str, Any]]:
+        # Records in file order, without a lookup per key
+        for index in range(self.count):
+            values = self._values(index)
+            key = self.snapshot.string(values[0])
+            value = self.changed.get(key)
+            yield key, value if value is not None else self.decode(values)
+        for key in self.added:
+            yield key, self.changed[key]
+
+    def close(self):
+        """Unmap the snapshot file, shared by the tables of the same snapshot"""
+        self.snapshot.close()
+
+
+class HistoryTable(SnapshotTable):
+    """The history section, whose attempt counts are read without decoding the attempts"""
+
+    def length(self, key: str) -> int:
+        """Number of attempts of `key`, KeyError if it has no history"""
+        if key in self.changed:
+            return len(self.changed[key])
+        index = self.find(key)
+        if index < 0:
+            raise KeyError(key)
+        return self._values(index)[2]
+
+    def lengths(self) -> Iterator[Tuple[str, int]]:
+        """(key, number of attempts) of every key, in order"""
+        for index in range(self.count):
+            values = self._values(index)
+            key = self.snapshot.string(values[0])
+            value = self.changed.get(key)
+            yield key, len(value) if value is not None else values[2]
+        for key in self.added:
+            yield key, len(self.changed[key])
+
+
+class _Items(ItemsView):
+    def __iter__(self) -> Iterator[Tuple[str, Any]]:
+        return self._mapping._iter_items()
+
+
+def convert(data_dir: str, fmt: str):
+    """Rewrite the data directory's snapshot as 'binary' (state.<id>.bin) or 'json' (see JSONStorage)"""
+    from qcm_storage import JSONStorage
+
+    storage = JSONStorage(data_dir)
+    try:
+        storage.convert(fmt)
+    finally:
+        storage.close()
+
+
+def bench(sizes: List[str], repeat: int) -> List[Tuple[str, str, dict, dict]]:
+    """(size, step, JSON timings, binary timings) of a cold start on generated data sets"""
+    import random
+    import shutil
+    import tempfile
+
+    from qcm_app import QCMApp
+    from qcm_bench import SIZES, timed, write_dataset
+    from qcm_storage import JSONStorage
+
+    rows = []
+    for size in sizes:
+        users, qcm_count, attempts = SIZES[size]
+        directory = tempfile.mkdtemp(prefix=f"qcm-snapshot-{size}-")
+        try:
+            data_dir, qcms_file = write_dataset(directory, users, qcm_count, attempts)
+            # The bank is imported from qcms.json once, outside the timings
+            QCMApp(data_dir, qcms_file).close()
+            user = f"user{random.Random(0).randrange(users)}"
+            figures = {}
+            for fmt in ('json', 'binary'):
+                convert(data_dir, fmt)
+                figures[fmt] = {
+                    'open': timed(lambda: JSONStorage(data_dir).attempt_log.close(), repeat),
+                    'first_user': timed(lambda: _first_user(JSONStorage(data_dir), user), repeat),
+                    'startup': timed(lambda: _startup(QCMApp(data_dir, qcms_file)), repeat),
+                    'bytes': _snapshot_size(data_dir)
+                }
+            for step in ('open', 'first_user', 'startup'):
+                rows.append((size, step, figures['json'][step], figures['binary'][step]))
+            rows.append((size, 'bytes', figures['json']['bytes'], figures['binary']['bytes']))
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    return rows
+
+
+def _snapshot_size(data_dir: str) -> int:
+    from qcm_storage import JSONStorage, history_index_name, load_json
+
+    manifest = load_json(os.path.join(data_dir, 'snapshot.json'), {})
+    if manifest.get('format') == 'binary':
+        names = [manifest['file']]
+    else:
+        history = manifest['history']
+        names = [*JSONStorage.SNAPSHOT_FILES, history, history_index_name(history)]
+    return sum(os.path.getsize(os.path.join(data_dir, name)) for name in names)
+
+
+def _first_user(storage, username: str):
+    # What a login and a look at one's history need, and nothing else
+    storage.get_password(username)
+    storage.get_scores(username)
+    storage.user_history(username)
+    storage.attempt_log.close()
+
+
+def _startup(app):
+    # Closed without compacting, which would rewrite the whole snapshot
+    app.auth.close()
+    app.storage.attempt_log.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert the data directory between the JSON and binary snapshots")
+    parser.add_argument('action', choices=['to-binary', 'to-json', 'bench'])
+    parser.add_argument('--data-dir', default='qcm_data')
+    parser.add_argument('--sizes', default='small,medium', help="bench: comma separated, among small, medium, large")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.action == 'bench':
+        print(f"{'size':<8} {'step':<12} {'json':>12} {'binary':>12} {'speedup':>8}")
+        for size, step, before, after in bench(args.sizes.split(','), args.repeat):
+            if step == 'bytes':
+                print(f"{size:<8} {'size':<12} {before / 1e6:>10.2f}MB {after / 1e6:>10.2f}MB {before / after:>7.2f}x")
+            else:
+                print(f"{size:<8} {step:<12} {before['best'] * 1000:>10.2f}ms {after['best'] * 1000:>10.2f}ms "
+                      f"{before['best'] / after['best']:>7.2f}x")
+    else:
+        convert(args.data_dir, 'binary' if args.action == 'to-binary' else 'json')
+        print(f"{args.data_dir} now uses the {'binary' if args.action == 'to-binary' else 'JSON'} snapshot")
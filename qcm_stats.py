@@ -0,0 +1,170 @@
+"""Per-user statistics: best/last/average per QCM, per-category averages and streaks.
+
+A user's statistics are built from one pass over their own history the first
+time they are needed, then updated on every new attempt, so showing them never
+rescans the history.
+
+scores.json keeps running totals written apart from the history, so the two
+can drift. The verify command rebuilds every user's statistics in one
+streaming pass over the history and compares them with the stored scores;
+--fix writes the rebuilt totals back:
+
+    python qcm_stats.py verify [--fix] [--data-dir qcm_data] [--storage json|sqlite]
+"""
+import argparse
+import os
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from qcm_storage import StorageBackend, attempt_category, attempt_qcm, load_json, open_storage
+
+# An attempt at or above this score extends the streak, below it breaks the streak
+PASS_SCORE = 50.0
+SCORE_TOLERANCE = 1e-6
+
+
+class QCMStats:
+    """Attempts of one user at one QCM"""
+
+    __slots__ = ('attempts', 'total', 'best', 'last', 'last_date')
+
+    def __init__(self):
+        self.attempts = 0
+        self.total = 0.0
+        self.best = 0.0
+        self.last = 0.0
+        self.last_date = ''
+
+    def add(self, result: dict):
+        self.attempts += 1
+        self.total += result['score']
+        self.best = max(self.best, result['score'])
+        self.last = result['score']
+        self.last_date = result['date']
+
+    @property
+    def average(self) -> float:
+        return self.total / self.attempts if self.attempts else 0.0
+
+
+class UserStats:
+    """Everything shown about one user, kept up to date attempt by attempt"""
+
+    def __init__(self):
+        self.attempts = 0
+        self.total_score = 0.0
+        self.qcms: Dict[Tuple[str, str], QCMStats] = {}
+        self.categories: Dict[str, List[float]] = {}
+        self.streak = 0
+        self.best_streak = 0
+
+    def add(self, result: dict):
+        self.attempts += 1
+        self.total_score += result['score']
+        # Generated quizzes count in the totals and streaks, not as a QCM of their own
+        key = attempt_qcm(result)
+        if key is not None:
+            qcm = self.qcms.get(key)
+            if qcm is None:
+                qcm = self.qcms[key] = QCMStats()
+            qcm.add(result)
+        name = attempt_category(result)
+        if name is not None:
+            category = self.categories.setdefault(name, [0.0, 0])
+            category[0] += result['score']
+            category[1] += 1
+        if result['score'] >= PASS_SCORE:
+            self.streak += 1
+            self.best_streak = max(self.best_streak, self.streak)
+        else:
+            self.streak = 0
+
+    @property
+    def average(self) -> float:
+        return self.total_score / self.attempts if self.attempts else 0.0
+
+    def category_averages(self) -> Dict[str, float]:
+        return {category: total / count for category, (total, count) in self.categories.items()}
+
+
+class StatsIndex:
+    """Statistics of the users seen so far, kept in sync with new attempts"""
+
+    def __init__(self, storage: StorageBackend):
+        self.storage = storage
+        self.users: Dict[str, UserStats] = {}
+
+    def get(self, username: str) -> UserStats:
+        stats = self.users.get(username)
+        if stats is None:
+            stats = UserStats()
+            for _, result in self.storage.scan_history(username):
+                stats.add(result)
+            self.users[username] = stats
+        return stats
+
+    def record(self, username: str, result: dict):
+        stats = self.users.get(username)
+        if stats is not None:
+            stats.add(result)
+
+    def replace(self, username: str, result: dict):
+        """One of the user's attempts was regraded in place: their statistics are rebuilt on next use"""
+        self.users.pop(username, None)
+
+
+def rebuild(history: Iterable[Tuple[str, dict]]) -> Dict[str, UserStats]:
+    """Statistics of every user from one pass over the (username, result) stream"""
+    users: Dict[str, UserStats] = {}
+    for username, result in history:
+        stats = users.get(username)
+        if stats is None:
+            stats = users[username] = UserStats()
+        stats.add(result)
+    return users
+
+
+def verify(storage: StorageBackend) -> Tuple[Dict[str, UserStats], List[Tuple[str, dict, dict]]]:
+    """Rebuild from the history and list (username, stored scores, rebuilt scores) that disagree"""
+    users = rebuild(storage.iter_history())
+    mismatches = []
+    stored = dict(storage.iter_scores())
+    for username in sorted(set(stored) | set(users)):
+        stats = users.get(username, UserStats())
+        expected = {'total_score': stats.total_score, 'quizzes_taken': stats.attempts}
+        scores = stored.get(username, {'total_score': 0, 'quizzes_taken': 0})
+        if (scores['quizzes_taken'] != expected['quizzes_taken']
+                or abs(scores['total_score'] - expected['total_score']) > SCORE_TOLERANCE):
+            mismatches.append((username, scores, expected))
+    return users, mismatches
+
+
+def iter_report(users: Dict[str, UserStats]) -> Iterator[str]:
+    for username, stats in sorted(users.items()):
+        yield (f"{username}: {stats.attempts} attempts, average {stats.average:.1f}%, "
+               f"best streak {stats.best_streak}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check scores.json against the history, or rebuild it")
+    parser.add_argument('action', choices=['verify'])
+    parser.add_argument('--fix', action='store_true', help="Write the totals rebuilt from the history")
+    parser.add_argument('--data-dir', default='qcm_data')
+    parser.add_argument('--storage', choices=['json', 'sqlite'], default=None)
+    parser.add_argument('--verbose', action='store_true', help="Print every user's rebuilt statistics")
+    args = parser.parse_args()
+
+    storage = open_storage(args.storage or os.environ.get('QCM_STORAGE', 'json'), args.data_dir, load_json)
+    try:
+        users, mismatches = verify(storage)
+        if args.verbose:
+            for line in iter_report(users):
+                print(line)
+        for username, scores, expected in mismatches:
+            print(f"{username}: stored {scores['total_score']:.2f} over {scores['quizzes_taken']} quizzes, "
+                  f"history gives {expected['total_score']:.2f} over {expected['quizzes_taken']}")
+        print(f"{len(users)} users checked, {len(mismatches)} mismatches")
+        if mismatches and args.fix:
+            storage.replace_scores({username: expected for username, _, expected in mismatches})
+            print("Scores rebuilt from the history")
+    finally:
+        storage.close()
@@ -0,0 +1,1089 @@
+import json
+import os
+import re
+import sqlite3
+import time
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from qcm_metrics import metrics
+from qcm_snapshot import HistoryTable, Snapshot, write_snapshot
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+
+def load_json(filename: str, default: Any) -> Any:
+    if not os.path.exists(filename):
+        return default
+    with open(filename, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_json(filename: str, data: Any):
+    """Write a JSON file atomically: a crash leaves either the old or the new file, never half of one"""
+    start = time.perf_counter()
+    tmp = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=4, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    os.replace(tmp, filename)
+    _fsync_dir(os.path.dirname(filename))
+    if metrics.enabled:
+        metrics.observe('save_json_bytes', size)
+        metrics.observe('save_json_seconds', time.perf_counter() - start)
+
+
+def _fsync_dir(dirname: str):
+    # Makes the rename itself durable, not possible (nor needed) on Windows
+    if os.name == 'nt':
+        return
+    fd = os.open(dirname or '.', os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class FileLock:
+    """Exclusive lock shared by every process using the same lock file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self._depth = 0
+
+    def __enter__(self) -> 'FileLock':
+        if self._depth == 0:
+            self._file = open(self.path, 'a+b')
+            if os.name == 'nt':
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+            else:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        if self._depth == 0:
+            if os.name == 'nt':
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+def apply_event(users: Dict[str, str], history: Dict[str, List[dict]], user_scores: Dict[str, dict], event: dict):
+    """Apply one logged event to the in-memory users, history and scores.
+
+    Values are assigned back rather than changed in place, so that a snapshot
+    table (see qcm_snapshot), which decodes a fresh copy on every read, keeps them.
+    """
+    username = event['user']
+    if 'password' in event:
+        users[username] = event['password']
+    if username not in history:
+        history[username] = []
+    if username not in user_scores:
+        user_scores[username] = {'total_score': 0, 'quizzes_taken': 0}
+    if event['op'] == 'scores':
+        user_scores[username] = {'total_score': event['total_score'], 'quizzes_taken': event['quizzes_taken']}
+    elif event['op'] == 'attempt':
+        result = event['result']
+        results = history[username]
+        results.append(result)
+        history[username] = results
+        scores = user_scores[username]
+        user_scores[username] = {'total_score': scores['total_score'] + result['score'],
+                                 'quizzes_taken': scores['quizzes_taken'] + 1}
+    elif event['op'] == 'replace':
+        # A regraded attempt, its score difference comes with a 'scores' event
+        results = history[username]
+        results[event['index']] = event['result']
+        history[username] = results
+
+
+class AttemptLog:
+    """Append-only, line-delimited log of user and history events.
+
+    Each finished quiz costs one appended line instead of a rewrite of the
+    history and scores.json. The JSON files act as a snapshot: at startup
+    the log is replayed on top of them, and once it grows past `compact_every`
+    events it is folded back into the snapshot and replaced by an empty log.
+
+    Several processes may share the log. Writers hold the lock file while
+    appending, every event carries a sequence number, and readers follow the
+    file (and its replacement after a compaction) from where they stopped.
+    fsync is coalesced: at most one every `fsync_interval` seconds, plus one
+    on close.
+    """
+
+    def __init__(self, path: str, compact_every: int = 500, fsync_interval: float = 0.05):
+        self.path = path
+        self.lock = FileLock(f"{path}.lock")
+        self.compact_every = compact_every
+        self.fsync_interval = fsync_interval
+        self.pending = 0
+        self.seq = 0
+        self._reader = None
+        self._reader_ino = None
+        self.rotated = False
+        self._last_fsync = 0.0
+        self._unsynced = None
+
+    def reopen(self):
+        """Start reading the current log file from its beginning"""
+        if self._reader is not None:
+            self._reader.close()
+        if not os.path.exists(self.path):
+            open(self.path, 'ab').close()
+        self.rotated = False
+        self._reader = open(self.path, 'rb')
+        self._reader_ino = os.fstat(self._reader.fileno()).st_ino
+        self.pending = 0
+
+    def read_new(self, repair: bool = False) -> Iterator[dict]:
+        """Yield the events appended since the last call, skipping those already applied.
+
+        With `repair` (only under the lock) an incomplete last line is a
+        record that never completed because of a crash, and is cut off.
+        Reading stops once the file was replaced by a compaction, with
+        `rotated` set: the caller catches up from the snapshot, then calls reopen().
+        """
+        if self._reader is None:
+            self.reopen()
+        while True:
+            start = self._reader.tell()
+            line = self._reader.readline()
+            if not line:
+                break
+            if not line.endswith(b'\n'):
+                self._reader.seek(start)
+                if repair:
+                    with open(self.path, 'r+b') as f:
+                        f.truncate(start)
+                break
+            try:
+                event = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            self.pending += 1
+            seq = event.get('seq')
+            if seq is not None:
+                if seq <= self.seq:
+                    continue
+                self.seq = seq
+            yield event
+        try:
+            current_ino = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            current_ino = None
+        if current_ino != self._reader_ino:
+            self.rotated = True
+
+    def write(self, events: List[dict]):
+        """Append events with a single write. The caller holds the lock and has read every earlier event"""
+        for event in events:
+            self.seq += 1
+            event['seq'] = self.seq
+        data = ''.join(json.dumps(event, ensure_ascii=False) + '\n' for event in events).encode('utf-8')
+        if metrics.enabled:
+            metrics.observe('attempt_log_append_bytes', len(data))
+        with open(self.path, 'ab') as f:
+            f.write(data)
+            f.flush()
+            if time.monotonic() - self._last_fsync >= self.fsync_interval:
+                os.fsync(f.fileno())
+                self._last_fsync = time.monotonic()
+                self._unsynced = None
+            else:
+                self._unsynced = self.path
+        # Our own lines are already applied, the reader skips over them
+        self._reader.seek(0, os.SEEK_END)
+        self.pending += len(events)
+
+    def sync(self):
+        """fsync the appends left unsynced by the coalescing"""
+        if self._unsynced and os.path.exists(self._unsynced):
+            with open(self._unsynced, 'ab') as f:
+                os.fsync(f.fileno())
+        self._unsynced = None
+
+    def needs_compaction(self) -> bool:
+        return self.pending >= self.compact_every
+
+    def reset(self):
+        """Replace the log by an empty one, under the lock, once it is folded into the snapshot"""
+        self.sync()
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        open(tmp, 'wb').close()
+        os.replace(tmp, self.path)
+        _fsync_dir(os.path.dirname(self.path))
+        self.reopen()
+
+    def close(self):
+        self.sync()
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+
+class StorageBackend:
+    """Interface shared by the storage engines behind QCMApp.
+
+    Listeners registered with subscribe() see every 'register', 'attempt',
+    'replace' (an attempt regraded in place) and 'scores' event, including
+    those written by other processes sharing the data, once refresh() picked
+    them up. A listener that builds an index from the history scans it with
+    scan_history(), so that each attempt reaches it once: in the scan or as
+    an event afterwards.
+    """
+
+    def __init__(self):
+        self.listeners: List[Callable[[dict], None]] = []
+
+    def subscribe(self, listener: Callable[[dict], None]):
+        self.listeners.append(listener)
+
+    def _notify(self, event: dict):
+        for listener in self.listeners:
+            listener(event)
+
+    def refresh(self):
+        """Pick up what other processes wrote"""
+        pass
+
+    def user_exists(self, username: str) -> bool:
+        return self.get_password(username) is not None
+
+    def get_password(self, username: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def add_user(self, username: str, password: str):
+        """Create an account, ValueError if the name is already taken"""
+        raise NotImplementedError
+
+    def set_password(self, username: str, password: str):
+        raise NotImplementedError
+
+    def record_attempt(self, username: str, result: dict):
+        self.record_attempts([(username, result)])
+
+    def record_attempts(self, attempts: Iterable[Tuple[str, dict]]):
+        """Store several attempts in one batch"""
+        raise NotImplementedError
+
+    def replace_attempts(self, replacements: Iterable[Tuple[str, int, dict]]):
+        """Overwrite stored attempts, given as (username, position in their history, new result),
+        and carry the score differences into the running totals"""
+        raise NotImplementedError
+
+    def iter_users(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def user_history(self, username: str) -> List[dict]:
+        raise NotImplementedError
+
+    def history_page(self, username: str, offset: int = 0, limit: int = 10) -> List[dict]:
+        """Attempts of a user, most recent first, skipping the `offset` most recent ones"""
+        history = self.user_history(username)
+        end = max(len(history) - offset, 0)
+        return history[max(end - limit, 0):end][::-1]
+
+    def iter_history(self, username: Optional[str] = None) -> Iterator[Tuple[str, dict]]:
+        """Yield (username, result) pairs, in insertion order"""
+        raise NotImplementedError
+
+    def scan_history(self, username: Optional[str] = None) -> Iterator[Tuple[str, dict]]:
+        """(username, result) pairs of one consistent view of the history, for a listener building an index.
+
+        New events are picked up (and sent to the listeners) when this is
+        called, none while the view is iterated. The caller creates the table
+        its listener fills after this call: events sent before are in the
+        view, later ones reach the listener.
+        """
+        self.refresh()
+        return iter(list(self.iter_history(username)))
+
+    def find_attempts(self, username: Optional[str] = None, category: Optional[str] = None,
+                      title: Optional[str] = None, date_from: Optional[str] = None,
+                      date_to: Optional[str] = None) -> Iterator[Tuple[str, dict]]:
+        """Yield the (username, result) pairs matching every given filter"""
+        for user, result in self.iter_history(username):
+            if category is not None and result['category'] != category:
+                continue
+            if title is not None and result['title'] != title:
+                continue
+            if date_from is not None and result['date'] < date_from:
+                continue
+            if date_to is not None and result['date'][:len(date_to)] > date_to:
+                continue
+            yield user, result
+
+    def get_scores(self, username: str) -> dict:
+        raise NotImplementedError
+
+    def iter_scores(self) -> Iterator[Tuple[str, dict]]:
+        raise NotImplementedError
+
+    def top_scores(self, limit: int) -> List[Tuple[str, dict]]:
+        """Best users by average score"""
+        raise NotImplementedError
+
+    def replace_scores(self, scores: Dict[str, dict]):
+        """Overwrite the running totals of some users, see qcm_stats verify --fix"""
+        raise NotImplementedError
+
+    @contextmanager
+    def transaction(self):
+        """Group many record_attempts calls into one commit"""
+        yield
+
+    def close(self):
+        pass
+
+
+def average_score(stats: dict) -> float:
+    return stats['total_score'] / max(stats['quizzes_taken'], 1)
+
+
+def attempt_qcm(result: dict) -> Optional[Tuple[str, str]]:
+    """(category, title) of the QCM an attempt was taken on, None for a generated quiz
+    whose "questions" come from several QCMs (see qcm_quizgen)"""
+    if 'questions' in result:
+        return None
+    return result['category'], result['title']
+
+
+def attempt_category(result: dict) -> Optional[str]:
+    """Category of an attempt, None for a generated quiz drawing from several categories (a tag)"""
+    if 'questions' in result and any(category != result['category'] for category, _, _ in result['questions']):
+        return None
+    return result['category']
+
+
+def write_history(path: str, history: Dict[str, List[dict]]) -> Dict[str, List[int]]:
+    """Write the history as one JSON document with a user per line, and fsync it.
+
+    Returns the index HistoryFile reads it with: the [offset, length, attempt
+    count] of each user's list of attempts in the file.
+    """
+    index = {}
+    with open(path, 'wb') as f:
+        f.write(b'{')
+        separator = b'\n'
+        for username, results in history.items():
+            f.write(separator + json.dumps(username, ensure_ascii=False).encode('utf-8') + b': ')
+            data = json.dumps(results, ensure_ascii=False).encode('utf-8')
+            index[username] = [f.tell(), len(data), len(results)]
+            f.write(data)
+            separator = b',\n'
+        f.write(b'\n}\n')
+        f.flush()
+        os.fsync(f.fileno())
+    return index
+
+
+def history_index_name(filename: str) -> str:
+    """Name of the index written next to a history file"""
+    return f"{os.path.splitext(filename)[0]}.index.json"
+
+
+class HistoryFile(MutableMapping):
+    """History of the JSON snapshot as a dict, read one user at a time from its file.
+
+    Only the index of the file (see write_history) is held in memory, each
+    read parses that user's line again. Histories set since the file was
+    written are kept in `changed`, with the users `added` to the file's.
+    Without a file (`path` None) it holds only those.
+    """
+
+    def __init__(self, path: Optional[str], index: Dict[str, List[int]]):
+        self.path = path
+        self.index = index
+        self._file = open(path, 'rb') if path is not None else None
+        self.changed: Dict[str, List[dict]] = {}
+        self.added: List[str] = []
+
+    def _read(self, key: str) -> List[dict]:
+        offset, length, _ = self.index[key]
+        self._file.seek(offset)
+        return json.loads(self._file.read(length).decode('utf-8'))
+
+    def __getitem__(self, key: str) -> List[dict]:
+        try:
+            return self.changed[key]
+        except KeyError:
+            pass
+        if key not in self.index:
+            raise KeyError(key)
+        return self._read(key)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.changed or key in self.index
+
+    def __setitem__(self, key: str, value: List[dict]):
+        if key not in self:
+            self.added.append(key)
+        self.changed[key] = value
+
+    def __delitem__(self, key: str):
+        raise TypeError("history entries cannot be removed")
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self.index
+        yield from self.added
+
+    def __len__(self) -> int:
+        return len(self.index) + len(self.added)
+
+    def length(self, key: str) -> int:
+        """Number of attempts of `key`, KeyError if it has no history"""
+        if key in self.changed:
+            return len(self.changed[key])
+        return self.index[key][2]
+
+    def lengths(self) -> Iterator[Tuple[str, int]]:
+        """(key, number of attempts) of every key, in order"""
+        for key in self:
+            yield key, self.length(key)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class JSONStorage(StorageBackend):
+    """users.json, scores.json and a history.<id>.json file plus the append-only attempt log.
+
+    The JSON files are a snapshot written by compaction. A compaction first
+    writes new snapshots next to the old ones, then commits them by writing
+    snapshot.json (the last folded sequence number, the files to install and
+    the history file), then installs them. If it crashes, the next start
+    finishes the installation, and log events already folded are skipped by
+    sequence number.
+
+    The history file holds one user per line, with an index of where each
+    one starts (history.<id>.index.json). HistoryFile reads a user's history
+    from it when asked and keeps only what changed since, so history_page()
+    and iter_history() never hold more than one user's attempts. Like the
+    binary snapshot below, every compaction writes a new one, as an open file
+    cannot be replaced on every platform. The single history.json of older
+    data directories is loaded once and rewritten that way at startup.
+
+    Once converted (see qcm_snapshot), the snapshot is one memory-mapped
+    state.<id>.bin file named by snapshot.json. Every compaction writes a new
+    one, switches to it by rewriting snapshot.json, since a mapped file cannot
+    be replaced on every platform, and maps it in place of the old one, which
+    is removed once unused. Records are decoded on each read, only what
+    changed since the last compaction is held in memory.
+    The JSON files it replaces are renamed *.obsolete once snapshot.json
+    commits the first binary snapshot, and removed when converting back.
+    """
+
+    SNAPSHOT_FILES = ('users.json', 'scores.json')
+    # The whole history in one document, as written before HistoryFile
+    LEGACY_HISTORY = 'history.json'
+    HISTORY_FILE = re.compile(r'history\.[0-9a-f]+(\.index)?\.json')
+
+    def __init__(self, data_dir: str, load: Callable[[str, Any], Any] = load_json):
+        super().__init__()
+        self.data_dir = data_dir
+        self._deferred = False
+        self.attempt_log = AttemptLog(self._path('history.log'))
+        self.snapshot: Optional[Snapshot] = None
+
+        self.load = load
+        with self.attempt_log.lock:
+            self._load_snapshot()
+            upgrade = self.format == 'json' and self.history.path is None and os.path.exists(
+                self._path(self.LEGACY_HISTORY))
+        self.refresh()
+        if upgrade:
+            self.compact(force=True)
+
+    def _path(self, filename: str) -> str:
+        return os.path.join(self.data_dir, filename)
+
+    def _load_snapshot(self) -> Tuple[Dict[str, List[dict]], Dict[str, dict]]:
+        """Read the snapshot and the log it continues into, under the lock. Returns the previous history and scores"""
+        previous = getattr(self, 'history', {}), getattr(self, 'user_scores', {})
+        manifest = load_json(self._path('snapshot.json'), {'seq': 0})
+        self._install_snapshots(manifest)
+        # The previous mapping stays open as long as `previous` needs it, _catch_up() closes it
+        self._open_snapshot(manifest)
+        self.attempt_log.seq = manifest['seq']
+        self.attempt_log.reopen()
+        return previous
+
+    def _open_snapshot(self, manifest: dict):
+        """Serve users, history and scores from the snapshot `manifest` names"""
+        self.format = manifest.get('format', 'json')
+        if self.format == 'binary':
+            self.snapshot = Snapshot(self._path(manifest['file']))
+            self.users = self.snapshot.table('users')
+            self.history = self.snapshot.table('history')
+            self.user_scores = self.snapshot.table('scores')
+        else:
+            self.snapshot = None
+            self.users = self.load(self._path('users.json'), {})
+            self.user_scores = self.load(self._path('scores.json'), {})
+            if 'history' in manifest:
+                filename = manifest['history']
+                index = load_json(self._path(history_index_name(filename)), {})
+                self.history = HistoryFile(self._path(filename), index)
+            else:
+                # Read whole this once, __init__ rewrites it as a history file
+                self.history = HistoryFile(None, {})
+                for username, results in self.load(self._path(self.LEGACY_HISTORY), {}).items():
+                    self.history[username] = results
+
+    @staticmethod
+    def _close_snapshot(history: Dict[str, List[dict]]):
+        # The tables of a binary snapshot share one mapping, closed through any of them
+        if isinstance(history, (HistoryTable, HistoryFile)):
+            history.close()
+
+    def _catch_up(self):
+        with self.attempt_log.lock:
+            if load_json(self._path('snapshot.json'), {'seq': 0})['seq'] <= self.attempt_log.seq:
+                # Nothing was folded that we have not read, the new log follows on
+                self.attempt_log.reopen()
+                return
+            history, user_scores = self._load_snapshot()
+        for username, results in self.history.items():
+            if username not in history:
+                self._notify({'op': 'register', 'user': username})
+            known = history.get(username, [])
+            for index, (result, previous_result) in enumerate(zip(results, known)):
+                if result != previous_result:
+                    self._notify({'op': 'replace', 'user': username, 'index': index, 'result': result})
+            missed = results[len(known):]
+            for result in missed:
+                self._notify({'op': 'attempt', 'user': username, 'result': result})
+            # Totals replaced meanwhile (qcm_stats verify --fix) are not implied by the attempts
+            previous = user_scores.get(username, {'total_score': 0, 'quizzes_taken': 0})
+            scores = self.user_scores.get(username)
+            if scores is not None and (
+                scores['quizzes_taken'] != previous['quizzes_taken'] + len(missed)
+                or abs(scores['total_score'] - previous['total_score'] - sum(r['score'] for r in missed)) > 1e-6
+            ):
+                self._notify(dict(scores, op='scores', user=username))
+        self._close_snapshot(history)
+
+    def _install_snapshots(self, manifest: dict):
+        for filename in manifest.get('pending', []):
+            staged = self._path(f"{filename}.staged")
+            if os.path.exists(staged):
+                os.replace(staged, self._path(filename))
+        if manifest.get('pending'):
+            save_json(self._path('snapshot.json'), {key: value for key, value in manifest.items() if key != 'pending'})
+
+    def _apply(self, event: dict):
+        apply_event(self.users, self.history, self.user_scores, event)
+        self._notify(event)
+
+    def refresh(self, repair: bool = False):
+        while True:
+            for event in self.attempt_log.read_new(repair):
+                self._apply(event)
+            if not self.attempt_log.rotated:
+                return
+            self._catch_up()
+
+    def _log(self, events: List[dict]):
+        with self.attempt_log.lock:
+            # Catch up first, so the new events come after everything already logged
+            self.refresh(repair=True)
+            self.attempt_log.write(events)
+        for event in events:
+            self._apply(event)
+        if self.attempt_log.needs_compaction() and not self._deferred:
+            self.compact()
+
+    @contextmanager
+    def transaction(self):
+        # Log appends are written as they come, compaction waits for the end of the batch
+        self._deferred = True
+        try:
+            yield
+        finally:
+            self._deferred = False
+            if self.attempt_log.needs_compaction():
+                self.compact()
+
+    def compact(self, force: bool = False):
+        """Fold the attempt log into a new snapshot and start an empty log"""
+        with self.attempt_log.lock:
+            self.refresh(repair=True)
+            if not self.attempt_log.pending and not force:
+                return
+            start = time.perf_counter()
+            if self.format == 'binary':
+                filename = f"state.{time.time_ns():x}.bin"
+                write_snapshot(self._path(filename), self.users, self.history, self.user_scores)
+                _fsync_dir(self.data_dir)
+                manifest = {'seq': self.attempt_log.seq, 'format': 'binary', 'file': filename}
+            else:
+                filename = f"history.{time.time_ns():x}.json"
+                save_json(self._path(history_index_name(filename)), write_history(self._path(filename), self.history))
+                data = {'users.json': self.users, 'scores.json': self.user_scores}
+                for name in self.SNAPSHOT_FILES:
+                    save_json(self._path(f"{name}.staged"), dict(data[name]))
+                manifest = {'seq': self.attempt_log.seq, 'pending': list(self.SNAPSHOT_FILES), 'history': filename}
+            save_json(self._path('snapshot.json'), manifest)
+            self._install_snapshots(manifest)
+            self.attempt_log.reset()
+            # Served from the new snapshot from now on, what changed meanwhile is in it and let go
+            previous = self.history
+            self._open_snapshot(manifest)
+            self._close_snapshot(previous)
+            self._remove_snapshots(keep=filename)
+            self._retire_json_snapshots(self.format == 'binary')
+            if metrics.enabled:
+                metrics.count('compactions')
+                metrics.observe('compact_seconds', time.perf_counter() - start)
+
+    def _remove_snapshots(self, keep: str):
+        """Remove the state.<id>.bin and history.<id>.json files of older snapshots"""
+        kept = (keep, history_index_name(keep))
+        for name in os.listdir(self.data_dir):
+            older = name.startswith('state.') and name.endswith('.bin') or self.HISTORY_FILE.fullmatch(name)
+            if older and name not in kept:
+                try:
+                    os.remove(self._path(name))
+                except OSError:
+                    # Still open in another process on Windows, removed by a later compaction
+                    pass
+
+    def _retire_json_snapshots(self, binary: bool):
+        """Rename the JSON files a newer snapshot superseded (all of them once binary, history.json
+        of an older data directory otherwise), or drop those leftovers once back to JSON"""
+        for name in self.SNAPSHOT_FILES + (self.LEGACY_HISTORY,):
+            path = self._path(name)
+            if (binary or name == self.LEGACY_HISTORY) and os.path.exists(path):
+                os.replace(path, f"{path}.obsolete")
+            elif not binary and os.path.exists(f"{path}.obsolete"):
+                os.remove(f"{path}.obsolete")
+
+    def convert(self, fmt: str):
+        """Write the snapshot in `fmt` ('json' or 'binary') and use that format from now on"""
+        if fmt not in ('json', 'binary'):
+            raise ValueError(f"Unknown snapshot format: {fmt}")
+        with self.attempt_log.lock:
+            self.refresh(repair=True)
+            self.format = fmt
+            self.compact(force=True)
+
+    def get_password(self, username: str) -> Optional[str]:
+        self.refresh()
+        return self.users.get(username)
+
+    def add_user(self, username: str, password: str):
+        with self.attempt_log.lock:
+            # Checked under the lock: another process may have taken the name meanwhile
+            self.refresh(repair=True)
+            if username in self.users:
+                raise ValueError("Username already exists!")
+            self._log([{'op': 'register', 'user': username, 'password': password}])
+
+    def set_password(self, username: str, password: str):
+        self._log([{'op': 'password', 'user': username, 'password': password}])
+
+    def replace_scores(self, scores: Dict[str, dict]):
+        self._log([{'op': 'scores', 'user': username, 'total_score': stats['total_score'],
+                    'quizzes_taken': stats['quizzes_taken']} for username, stats in scores.items()])
+
+    def record_attempts(self, attempts: Iterable[Tuple[str, dict]]):
+        self._log([{'op': 'attempt', 'user': username, 'result': result} for username, result in attempts])
+
+    def replace_attempts(self, replacements: Iterable[Tuple[str, int, dict]]):
+        with self.attempt_log.lock:
+            self.refresh(repair=True)
+            events, differences = [], {}
+            for username, index, result in replacements:
+                events.append({'op': 'replace', 'user': username, 'index': index, 'result': result})
+                differences[username] = (differences.get(username, 0)
+                                         + result['score'] - self.history[username][index]['score'])
+            for username, difference in differences.items():
+                scores = self.user_scores.get(username, {'total_score': 0, 'quizzes_taken': 0})
+                events.append({'op': 'scores', 'user': username, 'total_score': scores['total_score'] + difference,
+                               'quizzes_taken': scores['quizzes_taken']})
+            if events:
+                self._log(events)
+
+    def iter_users(self) -> Iterator[str]:
+        self.refresh()
+        return iter(list(self.history))
+
+    def user_history(self, username: str) -> List[dict]:
+        self.refresh()
+        return self.history.get(username, [])
+
+    def iter_history(self, username: Optional[str] = None) -> Iterator[Tuple[str, dict]]:
+        self.refresh()
+        return self._iter_loaded(username)
+
+    def scan_history(self, username: Optional[str] = None) -> Iterator[Tuple[str, dict]]:
+        with self.attempt_log.lock:
+            self.refresh(repair=True)
+            return self._iter_loaded(username)
+
+    def _iter_loaded(self, username: Optional[str]) -> Iterator[Tuple[str, dict]]:
+        """The attempts loaded now, even if a refresh appends more while they are iterated"""
+        # Counted from the snapshot's index, the attempts are only read as they are iterated
+        if username is None:
+            counts = list(self.history.lengths())
+        else:
+            counts = [(username, self.history.length(username) if username in self.history else 0)]
+        counts = [(user, count) for user, count in counts if count]
+
+        def attempts() -> Iterator[Tuple[str, dict]]:
+            for user, count in counts:
+                results = self.history[user]
+                for i in range(count):
+                    yield user, results[i]
+        return attempts()
+
+    def get_scores(self, username: str) -> dict:
+        self.refresh()
+        return self.user_scores.get(username, {'total_score': 0, 'quizzes_taken': 0})
+
+    def iter_scores(self) -> Iterator[Tuple[str, dict]]:
+        self.refresh()
+        return iter(list(self.user_scores.items()))
+
+    def top_scores(self, limit: int) -> List[Tuple[str, dict]]:
+        self.refresh()
+        return sorted(self.user_scores.items(), key=lambda x: average_score(x[1]), reverse=True)[:limit]
+
+    def close(self):
+        self.compact()
+        self.attempt_log.close()
+        self._close_snapshot(self.history)
+
+
+class SQLiteStorage(StorageBackend):
+    """Embedded SQLite database, queried per user instead of loaded in RAM"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            username TEXT PRIMARY KEY,
+            password TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS attempts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            date TEXT NOT NULL,
+            category TEXT NOT NULL,
+            title TEXT NOT NULL,
+            score REAL NOT NULL,
+            time_taken REAL NOT NULL,
+            answers TEXT NOT NULL,
+            total_questions INTEGER NOT NULL,
+            correct_answers INTEGER NOT NULL,
+            questions TEXT
+        );
+        CREATE TABLE IF NOT EXISTS scores (
+            username TEXT PRIMARY KEY,
+            total_score REAL NOT NULL DEFAULT 0,
+            quizzes_taken INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS replacements (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            attempt_id INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS attempts_user ON attempts(username, id);
+        CREATE INDEX IF NOT EXISTS attempts_qcm ON attempts(category, title);
+        CREATE INDEX IF NOT EXISTS attempts_date ON attempts(date);
+        CREATE INDEX IF NOT EXISTS scores_average ON scores(total_score / max(quizzes_taken, 1));
+    """
+    COLUMNS = "date, category, title, score, time_taken, answers, total_questions, correct_answers, questions"
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._in_transaction = False
+        # SQLite serializes writers from several processes itself, waiting up to `timeout` for the lock
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        # Databases created before generated quizzes lack the column listing their questions
+        if 'questions' not in {row[1] for row in self.conn.execute("PRAGMA table_info(attempts)")}:
+            self.conn.execute("ALTER TABLE attempts ADD COLUMN questions TEXT")
+        self._last_user = self.conn.execute("SELECT coalesce(max(rowid), 0) FROM users").fetchone()[0]
+        self._last_attempt = self.conn.execute("SELECT coalesce(max(id), 0) FROM attempts").fetchone()[0]
+        self._last_replacement = self.conn.execute("SELECT coalesce(max(id), 0) FROM replacements").fetchone()[0]
+
+    def refresh(self):
+        # New rows, whichever process wrote them, become events for the listeners
+        if not self.listeners:
+            return
+        notified = self._last_attempt
+        for rowid, username in self.conn.execute(
+            "SELECT rowid, username FROM users WHERE rowid > ? ORDER BY rowid", (self._last_user,)
+        ).fetchall():
+            self._last_user = rowid
+            self._notify({'op': 'register', 'user': username})
+        for row in self.conn.execute(
+            f"SELECT id, username, {self.COLUMNS} FROM attempts WHERE id > ? ORDER BY id", (self._last_attempt,)
+        ).fetchall():
+            self._last_attempt = row[0]
+            self._notify({'op': 'attempt', 'user': row[1], 'result': self._row_to_result(row[2:])})
+        # Attempts regraded in place (replace_attempts), each followed by the new totals of its user
+        for rowid, attempt_id in self.conn.execute(
+            "SELECT id, attempt_id FROM replacements WHERE id > ? ORDER BY id", (self._last_replacement,)
+        ).fetchall():
+            self._last_replacement = rowid
+            if attempt_id > notified:
+                # Sent just above, already regraded
+                continue
+            row = self.conn.execute(f"SELECT username, {self.COLUMNS} FROM attempts WHERE id = ?",
+                                    (attempt_id,)).fetchone()
+            index = self.conn.execute("SELECT count(*) FROM attempts WHERE username = ? AND id < ?",
+                                      (row[0], attempt_id)).fetchone()[0]
+            self._notify({'op': 'replace', 'user': row[0], 'index': index, 'result': self._row_to_result(row[1:])})
+            self._notify(dict(self.get_scores(row[0]), op='scores', user=row[0]))
+
+    @staticmethod
+    def _row_to_result(row: tuple) -> dict:
+        return {
+            'date': row[0],
+            'category': row[1],
+            'title': row[2],
+            'score': row[3],
+            'time_taken': row[4],
+            'answers': json.loads(row[5]),
+            'total_questions': row[6],
+            'correct_answers': row[7],
+            **({'questions': json.loads(row[8])} if row[8] is not None else {})
+        }
+
+    @staticmethod
+    def _result_to_row(username: str, result: dict) -> tuple:
+        return (
+            username, result['date'], result['category'], result['title'], result['score'],
+            result['time_taken'], json.dumps(result['answers']),
+            result['total_questions'], result['correct_answers'],
+            json.dumps(result['questions']) if 'questions' in result else None
+        )
+
+    def get_password(self, username: str) -> Optional[str]:
+        row = self.conn.execute("SELECT password FROM users WHERE username = ?", (username,)).fetchone()
+        return row[0] if row else None
+
+    def add_user(self, username: str, password: str):
+        try:
+            with self.conn:
+                self.conn.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, password))
+                self.conn.execute("INSERT OR IGNORE INTO scores (username) VALUES (?)", (username,))
+        except sqlite3.IntegrityError:
+            raise ValueError("Username already exists!")
+        self.refresh()
+
+    def set_password(self, username: str, password: str):
+        with self.conn:
+            self.conn.execute("UPDATE users SET password = ? WHERE username = ?", (password, username))
+
+    def record_attempts(self, attempts: Iterable[Tuple[str, dict]]):
+        # One transaction for the whole batch: one journal sync instead of one per attempt
+        if self._in_transaction:
+            self.insert_attempts(attempts)
+        else:
+            with self.conn:
+                self.insert_attempts(attempts)
+        self.refresh()
+
+    def replace_attempts(self, replacements: Iterable[Tuple[str, int, dict]]):
+        assignments = ', '.join(f"{column.strip()} = ?" for column in self.COLUMNS.split(','))
+        with self.conn:
+            for username, index, result in replacements:
+                row = self.conn.execute(
+                    "SELECT id, score FROM attempts WHERE username = ? ORDER BY id LIMIT 1 OFFSET ?", (username, index)
+                ).fetchone()
+                if row is None:
+                    raise IndexError(f"{username} has no attempt #{index}")
+                self.conn.execute(f"UPDATE attempts SET {assignments} WHERE id = ?",
+                                  (*self._result_to_row(username, result)[1:], row[0]))
+                self.conn.execute("UPDATE scores SET total_score = total_score + ? WHERE username = ?",
+                                  (result['score'] - row[1], username))
+                # Tells the listeners of every process, see refresh()
+                self.conn.execute("INSERT INTO replacements (attempt_id) VALUES (?)", (row[0],))
+        self.refresh()
+
+    @contextmanager
+    def transaction(self):
+        self._in_transaction = True
+        try:
+            with self.conn:
+                yield
+        finally:
+            self._in_transaction = False
+
+    def insert_attempts(self, attempts: Iterable[Tuple[str, dict]]):
+        """Insert attempts and update scores inside the caller's transaction"""
+        rows = [self._result_to_row(username, result) for username, result in attempts]
+        self.conn.executemany(
+            f"INSERT INTO attempts (username, {self.COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+        )
+        self.conn.executemany(
+            "INSERT INTO scores (username, total_score, quizzes_taken) VALUES (?, ?, 1) "
+            "ON CONFLICT(username) DO UPDATE SET "
+            "total_score = total_score + excluded.total_score, quizzes_taken = quizzes_taken + 1",
+            [(row[0], row[4]) for row in rows]
+        )
+
+    def iter_users(self) -> Iterator[str]:
+        for (username,) in self.conn.execute("SELECT username FROM users ORDER BY rowid"):
+            yield username
+
+    def user_history(self, username: str) -> List[dict]:
+        rows = self.conn.execute(
+            f"SELECT {self.COLUMNS} FROM attempts WHERE username = ? ORDER BY id", (username,)
+        )
+        return [self._row_to_result(row) for row in rows]
+
+    def history_page(self, username: str, offset: int = 0, limit: int = 10) -> List[dict]:
+        rows = self.conn.execute(
+            f"SELECT {self.COLUMNS} FROM attempts WHERE username = ? ORDER BY id DESC LIMIT ? OFFSET ?",
+            (username, limit, offset)
+        )
+        return [self._row_to_result(row) for row in rows]
+
+    def iter_history(self, username: Optional[str] = None) -> Iterator[Tuple[str, dict]]:
+        return self._select_history(username)
+
+    def scan_history(self, username: Optional[str] = None) -> Iterator[Tuple[str, dict]]:
+        self.refresh()
+        # Rows inserted since, by another process, go to the listeners with the next refresh instead
+        return self._select_history(username, self._last_attempt if self.listeners else None)
+
+    def _select_history(self, username: Optional[str], last_id: Optional[int] = None) -> Iterator[Tuple[str, dict]]:
+        conditions, params = [], []
+        if username is not None:
+            conditions.append("username = ?")
+            params.append(username)
+        if last_id is not None:
+            conditions.append("id <= ?")
+            params.append(last_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        for row in self.conn.execute(f"SELECT username, {self.COLUMNS} FROM attempts {where} ORDER BY id", params):
+            yield row[0], self._row_to_result(row[1:])
+
+    def find_attempts(self, username: Optional[str] = None, category: Optional[str] = None,
+                      title: Optional[str] = None, date_from: Optional[str] = None,
+                      date_to: Optional[str] = None) -> Iterator[Tuple[str, dict]]:
+        # Filters go to SQL so the user, category/title and date indexes do the work
+        conditions, params = [], []
+        for column, value in (('username', username), ('category', category), ('title', title)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if date_from is not None:
+            conditions.append("date >= ?")
+            params.append(date_from)
+        if date_to is not None:
+            conditions.append("substr(date, 1, ?) <= ?")
+            params.extend([len(date_to), date_to])
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        for row in self.conn.execute(f"SELECT username, {self.COLUMNS} FROM attempts {where} ORDER BY id", params):
+            yield row[0], self._row_to_result(row[1:])
+
+    def get_scores(self, username: str) -> dict:
+        row = self.conn.execute(
+            "SELECT total_score, quizzes_taken FROM scores WHERE username = ?", (username,)
+        ).fetchone()
+        if not row:
+            return {'total_score': 0, 'quizzes_taken': 0}
+        return {'total_score': row[0], 'quizzes_taken': row[1]}
+
+    def iter_scores(self) -> Iterator[Tuple[str, dict]]:
+        for username, total, taken in self.conn.execute("SELECT username, total_score, quizzes_taken FROM scores"):
+            yield username, {'total_score': total, 'quizzes_taken': taken}
+
+    def top_scores(self, limit: int) -> List[Tuple[str, dict]]:
+        rows = self.conn.execute(
+            "SELECT username, total_score, quizzes_taken FROM scores "
+            "ORDER BY total_score / max(quizzes_taken, 1) DESC LIMIT ?", (limit,)
+        )
+        return [(username, {'total_score': total, 'quizzes_taken': taken}) for username, total, taken in rows]
+
+    def replace_scores(self, scores: Dict[str, dict]):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO scores (username, total_score, quizzes_taken) VALUES (?, ?, ?)",
+                [(username, stats['total_score'], stats['quizzes_taken']) for username, stats in scores.items()]
+            )
+        for username, stats in scores.items():
+            self._notify(dict(stats, op='scores', user=username))
+
+    def close(self):
+        self.conn.close()
+
+
+def open_storage(kind: str, data_dir: str, load: Callable[[str, Any], Any] = load_json) -> StorageBackend:
+    """Create the storage engine named by `kind` ('json' or 'sqlite')"""
+    if kind == 'json':
+        return JSONStorage(data_dir, load)
+    if kind == 'sqlite':
+        return SQLiteStorage(os.path.join(data_dir, 'qcm.db'))
+    raise ValueError(f"Unknown storage backend: {kind}")
+
+
+def migrate_json_to_sqlite(data_dir: str, db_path: str, batch_size: int = 1000) -> int:
+    """Copy users, history and scores from the JSON files into a new SQLite database.
+
+    ValueError if the database already holds users or attempts: running the
+    migration twice would count every attempt twice.
+    """
+    target = SQLiteStorage(db_path)
+    if target.conn.execute("SELECT EXISTS(SELECT 1 FROM users) OR EXISTS(SELECT 1 FROM attempts)").fetchone()[0]:
+        target.close()
+        raise ValueError(f"{db_path} already holds data, migrate into a new database")
+    source = JSONStorage(data_dir)
+    migrated = 0
+    with target.conn:
+        target.conn.executemany(
+            "INSERT OR REPLACE INTO users (username, password) VALUES (?, ?)", source.users.items()
+        )
+        batch = []
+        for username, result in source.iter_history():
+            batch.append((username, result))
+            if len(batch) >= batch_size:
+                target.insert_attempts(batch)
+                migrated += len(batch)
+                batch = []
+        target.insert_attempts(batch)
+        migrated += len(batch)
+        # scores.json is authoritative, it may hold scores without matching history
+        target.conn.executemany(
+            "INSERT OR REPLACE INTO scores (username, total_score, quizzes_taken) VALUES (?, ?, ?)",
+            [(username, stats['total_score'], stats['quizzes_taken']) for username, stats in source.user_scores.items()]
+        )
+    target.close()
+    source.close()
+    return migrated
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Migrate the JSON data files to a SQLite database")
+    parser.add_argument('data_dir', nargs='?', default='qcm_data')
+    parser.add_argument('db_path', nargs='?', default=os.path.join('qcm_data', 'qcm.db'))
+    args = parser.parse_args()
+    try:
+        count = migrate_json_to_sqlite(args.data_dir, args.db_path)
+    except ValueError as e:
+        parser.exit(1, f"{e}\n")
+    print(f"Migrated {count} attempts to {args.db_path}")
@@ -0,0 +1,63 @@
+import json
+import os
+import sys
+
+import pytest
+
+# The modules live at the repository root, next to qcm_app.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+QCMS = {
+    'Info': {
+        'Python': [
+            {'question': 'Which keyword defines a function?', 'options': ['def', 'fun', 'lambda', 'func'], 'correct': 1},
+            {'question': 'Which types are mutable?', 'options': ['list', 'tuple', 'dict', 'str'],
+             'correct': [1, 3], 'type': 'multiple'},
+            {'question': 'What does len return for an empty list?', 'options': ['None', '0', '-1'], 'correct': 2},
+        ],
+    },
+    'Games': {
+        'Elden Ring': [
+            {'question': 'Who is the first demigod most players defeat?', 'options': ['Godrick', 'Radahn', 'Malenia'],
+             'correct': 1},
+        ],
+    },
+}
+
+
+def make_result(category: str = 'Info', title: str = 'Python', answers=None, correct: int = 1, total: int = 3,
+                date: str = '2024-01-01 10:00:00') -> dict:
+    """History entry shaped like the ones QuizSession stores"""
+    return {
+        'date': date,
+        'category': category,
+        'title': title,
+        'score': correct / total * 100,
+        'time_taken': 12.5,
+        'answers': answers if answers is not None else [1, [1, 3], 3],
+        'total_questions': total,
+        'correct_answers': correct,
+    }
+
+
+@pytest.fixture
+def qcms_file(tmp_path):
+    path = tmp_path / 'qcms.json'
+    path.write_text(json.dumps(QCMS), encoding='utf-8')
+    return str(path)
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    path = tmp_path / 'qcm_data'
+    path.mkdir()
+    return str(path)
+
+
+@pytest.fixture
+def app(data_dir, qcms_file):
+    from qcm_app import QCMApp
+
+    app = QCMApp(data_dir, qcms_file, 'json')
+    yield app
+    app.close()
@@ -0,0 +1,52 @@
+import time
+
+import pytest
+
+from qcm_app import Colors, Renderer
+
+
+def test_instant_mode_writes_each_line_at_once(capsys, monkeypatch):
+    renderer = Renderer('instant')
+    monkeypatch.setattr(time, 'sleep', lambda seconds: pytest.fail("instant mode never sleeps"))
+    renderer.fancy("Bonjour", Colors.GREEN, True, 0.5)
+    renderer.pause(1)
+    assert capsys.readouterr().out == f"{Colors.GREEN}{Colors.BOLD}Bonjour{Colors.ENDC}\n"
+
+
+def test_typewriter_only_animates_a_terminal(capsys):
+    # The captured stdout is not a terminal: scripted runs never wait
+    renderer = Renderer('typewriter')
+    assert renderer.instant
+    renderer.fancy("Score", Colors.BLUE, False, 0.5)
+    assert capsys.readouterr().out == f"{Colors.BLUE}Score{Colors.ENDC}\n"
+
+
+def test_unknown_mode_from_the_environment_falls_back_to_auto(monkeypatch):
+    monkeypatch.setenv('QCM_RENDER', 'fast')
+    with pytest.warns(UserWarning, match="QCM_RENDER"):
+        renderer = Renderer()
+    assert renderer.instant
+    with pytest.raises(ValueError):
+        renderer.set_mode('fast')
+
+
+def test_answer_keys_follow_a_qcm_rewritten_by_another_process(app):
+    from qcm_bank import QuestionBank
+
+    assert len(app.answer_key('Info', 'Python').masks) == 3
+    questions = [question.to_dict() for question in app.qcms['Info']['Python']]
+    questions.append({'question': 'Which one is a tuple?', 'options': ['[]', '()', '{}'], 'correct': 2})
+    # Another process rewrites the QCM with a fourth question
+    other = QuestionBank(app.qcms.bank_dir)
+    other.save_qcm('Info', 'Python', questions)
+
+    session = app.engine.start('alice', 'Info', 'Python')
+    assert len(session.questions) == 4
+    for answer in (1, [1, 3], 2, 2):
+        assert app.engine.submit(session.id, answer)
+    assert app.engine.finish(session.id)['correct_answers'] == 4
+
+    # Bounded by the bank cache: a key leaves with its questions
+    app.qcms.cache_size = 1
+    app.answer_key('Games', 'Elden Ring')
+    assert list(app.answer_keys) == [('Games', 'Elden Ring')]
@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from qcm_auth import Authenticator, hash_password, verify_password
+from qcm_storage import JSONStorage
+
+
+@pytest.fixture
+def auth(data_dir):
+    storage = JSONStorage(data_dir)
+    auth = Authenticator(storage, workers=1, cache_size=2)
+    yield auth
+    auth.close()
+    storage.close()
+
+
+def test_hashes_are_salted_and_verified():
+    first, second = hash_password('secret', n=2 ** 8), hash_password('secret', n=2 ** 8)
+    assert first != second and first.startswith('scrypt$256$')
+    assert verify_password(first, 'secret') == (True, True)
+    assert verify_password(first, 'Secret')[0] is False
+    assert verify_password(hash_password('secret'), 'secret') == (True, False)
+
+
+def test_plaintext_password_is_rehashed_at_login(auth):
+    auth.storage.add_user('alice', 'legacy')
+    assert auth.verify('alice', 'wrong') is None
+    assert auth.storage.get_password('alice') == 'legacy'
+    assert auth.verify('alice', 'legacy') is not None
+    stored = auth.storage.get_password('alice')
+    assert stored.startswith('scrypt$') and verify_password(stored, 'legacy') == (True, False)
+
+
+def test_unknown_users_are_refused(auth):
+    assert auth.verify('nobody', 'anything') is None
+    assert asyncio.run(auth.verify_async('nobody', 'anything')) is None
+
+
+def test_tokens_are_kept_in_a_bounded_cache(auth):
+    auth.storage.add_user('alice', asyncio.run(auth.hash_async('pw')))
+    first = asyncio.run(auth.verify_async('alice', 'pw'))
+    second = auth.issue_token('bob')
+    assert auth.check_token(first) == 'alice'
+    # The least recently used token leaves first
+    third = auth.issue_token('carol')
+    assert auth.check_token(second) is None
+    assert auth.check_token(first) == 'alice' and auth.check_token(third) == 'carol'
+    auth.revoke_token(first)
+    assert auth.check_token(first) is None
+
+
+def test_signed_tokens_are_checked_by_any_worker(data_dir):
+    storage = JSONStorage(data_dir)
+    issuer = Authenticator(storage, workers=1, secret=b'shared')
+    other = Authenticator(storage, workers=1, secret=b'shared')
+    stranger = Authenticator(storage, workers=1, secret=b'other')
+    try:
+        token = issuer.issue_token('alice')
+        assert other.check_token(token) == 'alice'
+        assert stranger.check_token(token) is None
+        assert other.check_token(token[:-1] + ('0' if token[-1] != '0' else '1')) is None
+        assert other.check_token('not a token') is None
+        other.token_ttl = -1
+        assert other.check_token(token) is None
+    finally:
+        for auth in (issuer, other, stranger):
+            auth.close()
+        storage.close()
@@ -0,0 +1,65 @@
+import json
+import os
+
+from conftest import QCMS
+from qcm_bank import QuestionBank
+
+
+def test_only_the_index_is_read_until_a_qcm_is_used(tmp_path, qcms_file):
+    bank = QuestionBank(str(tmp_path / 'bank'), qcms_file)
+    assert sorted(bank) == ['Games', 'Info'] and list(bank['Info']) == ['Python']
+    assert not bank.cache
+    assert bank.question_count('Info', 'Python') == 3 and not bank.cache
+    assert bank['Info']['Python'][0].question == QCMS['Info']['Python'][0]['question']
+    assert list(bank.cache) == [('Info', 'Python')]
+
+    exported = str(tmp_path / 'export.json')
+    bank.export_json(exported)
+    with open(exported, encoding='utf-8') as f:
+        assert json.load(f) == QCMS
+
+
+def test_cache_keeps_the_most_recently_used_qcms(tmp_path, qcms_file):
+    bank = QuestionBank(str(tmp_path / 'bank'), qcms_file, cache_size=1)
+    evicted = []
+    bank.subscribe(evicted.append)
+    bank.questions('Info', 'Python')
+    bank.questions('Games', 'Elden Ring')
+    assert list(bank.cache) == [('Games', 'Elden Ring')] and evicted == [('Info', 'Python')]
+
+
+def test_a_qcm_rewritten_by_another_process_is_reloaded(tmp_path, qcms_file):
+    bank = QuestionBank(str(tmp_path / 'bank'), qcms_file)
+    other = QuestionBank(str(tmp_path / 'bank'))
+    assert len(bank['Games']['Elden Ring']) == 1
+    other.save_qcm('Games', 'Elden Ring', QCMS['Games']['Elden Ring'] * 2)
+    other.save_qcm('Games', 'Hades', QCMS['Games']['Elden Ring'])
+    assert len(bank['Games']['Elden Ring']) == 2
+    assert 'Hades' in bank['Games']
+    # A rewrite replaces the QCM's file and appends an index line
+    assert len(os.listdir(tmp_path / 'bank' / 'qcms')) == 3
+    assert len((tmp_path / 'bank' / 'index.jsonl').read_bytes().splitlines()) == 4
+
+
+def test_questions_are_compact_records(tmp_path, qcms_file):
+    bank = QuestionBank(str(tmp_path / 'bank'), qcms_file)
+    single, multiple, _ = bank['Info']['Python']
+    assert (single.mask, single.correct, single['correct'], single.get('type')) == (0b1, 1, 1, None)
+    assert (multiple.mask, multiple.correct, multiple['type'], multiple.answer_count) == (0b101, [1, 3], 'multiple', 2)
+    assert [q.to_dict() for q in bank['Info']['Python']] == QCMS['Info']['Python']
+
+
+def test_equal_option_lists_are_shared_while_cached(tmp_path):
+    bank = QuestionBank(str(tmp_path / 'bank'), cache_size=2)
+    question = {'question': 'Pick one', 'options': ['yes', 'no'], 'correct': 1, 'tags': ['easy']}
+    for title in ('A', 'B', 'C'):
+        bank.save_qcm('Quiz', title, [question, dict(question, question='Pick again')])
+    a, b = bank.questions('Quiz', 'A'), bank.questions('Quiz', 'B')
+    assert a[0].options is b[1].options and a[0]['tags'] == ['easy']
+    assert bank.option_refs == {('yes', 'no'): 4}
+    # Counted down as QCMs leave the cache, dropped with the last one using them
+    bank.questions('Quiz', 'C')
+    assert bank.option_refs == {('yes', 'no'): 4}
+    bank._evict(('Quiz', 'B'))
+    bank._evict(('Quiz', 'C'))
+    assert bank.option_refs == {} and bank.option_sets == {}
@@ -0,0 +1,79 @@
+import argparse
+import io
+import json
+
+import pytest
+
+from qcm_app import grade_sheets
+from qcm_batch import run_batch
+
+
+CSV = """user,q1,q2,q3
+alice,1,1 3,2
+bob,1,3 1,1
+single,1,3,1
+zero,0,1 3,2
+word,x,1 3,2
+range,1,1 3,99
+twice,1,1 1,2
+extra,1,1 3,2,1
+,1,1 3,2
+carol,,1 3,
+"""
+
+
+def test_invalid_csv_lines_are_skipped_with_their_line_number(app):
+    results = io.StringIO()
+    report = run_batch(app, 'Info', 'Python', io.StringIO(CSV), 'csv', batch_size=2, results_file=results)
+    assert report['sheets'] == 3
+    assert report['rejected'] == 7
+    assert [number for number, _ in report['rejected_lines']] == [4, 5, 6, 7, 8, 9, 10]
+    assert 'question 3' in dict(report['rejected_lines'])[7]
+    # Same rule as in a quiz: a multiple choice question needs all of its answers
+    assert 'Select 2 answers' in dict(report['rejected_lines'])[4]
+
+    graded = [json.loads(line) for line in results.getvalue().splitlines()]
+    assert [(sheet['user'], sheet['correct_answers']) for sheet in graded] == [('alice', 3), ('bob', 2), ('carol', 1)]
+    assert app.storage.user_history('bob')[0]['answers'] == [1, [3, 1], 1]
+    assert app.storage.get_scores('alice') == {'total_score': 100.0, 'quizzes_taken': 1}
+    assert app.storage.user_history('zero') == []
+
+
+def test_invalid_jsonl_lines_are_skipped(app):
+    lines = [
+        {'user': 'alice', 'answers': [1, [1, 3], 2], 'time_taken': 30},
+        [1, 2],
+        {'user': 'bob', 'answers': [1, 2, 2]},
+        {'user': 'carol', 'answers': [1, [1, 3]], 'time_taken': 'slow'},
+        {'user': 'dave', 'answers': [None, [3, 1]]},
+    ]
+    sheets = '\n'.join(json.dumps(line) for line in lines) + '\nnot json\n\n'
+    report = run_batch(app, 'Info', 'Python', io.StringIO(sheets), 'jsonl')
+    assert report['sheets'] == 2
+    assert [number for number, _ in report['rejected_lines']] == [2, 3, 4, 6]
+    assert app.storage.user_history('alice')[0]['time_taken'] == 30.0
+    assert app.storage.user_history('dave')[0]['correct_answers'] == 1
+
+
+def test_unknown_qcm(app, tmp_path):
+    with pytest.raises(KeyError):
+        run_batch(app, 'Info', 'Nope', io.StringIO(''), 'jsonl')
+    sheets = tmp_path / 'sheets.csv'
+    sheets.write_text(CSV, encoding='utf-8')
+    args = argparse.Namespace(category='Nope', title='Python', sheets=str(sheets), format='csv', batch_size=10,
+                              results=None)
+    assert grade_sheets(app, args) == 2
+    args.category = 'Info'
+    assert grade_sheets(app, args) == 1
+
+
+def test_unreadable_files_end_with_an_error_line(app, tmp_path, capsys):
+    args = argparse.Namespace(category='Info', title='Python', sheets=str(tmp_path / 'missing.csv'), format='csv',
+                              batch_size=10, results=None)
+    assert grade_sheets(app, args) == 2
+    assert 'missing.csv' in capsys.readouterr().out
+    sheets = tmp_path / 'sheets.csv'
+    sheets.write_text("alice,1,1 3,2\n", encoding='utf-8')
+    args.sheets, args.results = str(sheets), str(tmp_path / 'no-such-dir' / 'results.jsonl')
+    assert grade_sheets(app, args) == 2
+    assert app.storage.user_history('alice') == []
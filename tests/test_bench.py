@@ -0,0 +1,45 @@
+import json
+import os
+import random
+
+import pytest
+
+import qcm_bench
+from qcm_grading import AnswerKey
+
+
+def test_dataset_is_shaped_like_the_data_files(tmp_path):
+    data_dir, qcms_file = qcm_bench.write_dataset(str(tmp_path), users=12, qcm_count=4, attempts=3)
+    with open(qcms_file, encoding='utf-8') as f:
+        qcms = json.load(f)
+    assert sum(len(titles) for titles in qcms.values()) == 4
+    with open(os.path.join(data_dir, 'history.json'), encoding='utf-8') as f:
+        history = json.load(f)
+    with open(os.path.join(data_dir, 'scores.json'), encoding='utf-8') as f:
+        scores = json.load(f)
+    assert len(history) == 12
+    for username, results in history.items():
+        assert len(results) == 3
+        for result in results:
+            key = AnswerKey(qcms[result['category']][result['title']])
+            assert key.grade(result['answers']) == result['correct_answers']
+        assert scores[username]['quizzes_taken'] == 3
+        assert scores[username]['total_score'] == pytest.approx(sum(result['score'] for result in results))
+
+
+def test_every_benchmark_runs(tmp_path):
+    data_dir, qcms_file = qcm_bench.write_dataset(str(tmp_path), users=20, qcm_count=3, attempts=4)
+    results = qcm_bench._run_benchmarks(data_dir, qcms_file, 1, random.Random(0))
+    assert set(results) == {'load_data', 'save_data', 'startup', 'check_answer', 'leaderboard',
+                            'display_leaderboard', 'report', 'submission'}
+    assert results['check_answer']['ops'] == 10000
+    assert all(figures['best'] > 0 for figures in results.values())
+
+
+def test_only_slowdowns_past_the_tolerance_are_regressions():
+    baseline = {'small': {'startup': {'best': 0.1}, 'report': {'best': 0.01}, 'leaderboard': {'best': 0.0001}}}
+    results = {'small': {'startup': {'best': 0.12}, 'report': {'best': 0.02}, 'leaderboard': {'best': 0.0003},
+                         'submission': {'best': 1.0}}}
+    rows = {benchmark: regressed for _, benchmark, _, _, regressed in qcm_bench.compare(results, baseline, 0.25)}
+    # Not in the baseline: nothing to compare with
+    assert rows == {'startup': False, 'report': True, 'leaderboard': False}
@@ -0,0 +1,120 @@
+import os
+import random
+
+import pytest
+
+from conftest import QCMS, make_result
+from qcm_bank import Question
+from qcm_grading import (AnswerKey, answer_mask, check_answer, compile_answer_keys, grade_batch, grade_masks,
+                         regrade_history, regrade_json_history, regrade_results)
+from qcm_storage import JSONStorage, SQLiteStorage
+
+
+def test_answer_masks():
+    assert answer_mask(1) == 0b1
+    assert answer_mask(3) == 0b100
+    assert answer_mask([1, 3]) == answer_mask([3, 1]) == 0b101
+
+
+@pytest.mark.parametrize('question', [dict(q) for q in QCMS['Info']['Python']]
+                         + [Question.from_dict(q, {}) for q in QCMS['Info']['Python']])
+def test_check_answer_against_dicts_and_records(question):
+    correct = question['correct']
+    assert check_answer(question, correct)
+    wrong = [1, 2] if isinstance(correct, list) else (1 if correct != 1 else 2)
+    assert not check_answer(question, wrong)
+
+
+def test_single_choice_stored_as_a_list():
+    question = {'question': 'q', 'options': ['a', 'b'], 'correct': [2]}
+    assert check_answer(question, 2)
+    assert AnswerKey([question]).grade([2]) == 1
+
+
+def random_sheet(rng, questions):
+    sheet = []
+    for question in questions:
+        options = range(1, len(question['options']) + 1)
+        if rng.random() < 0.1:
+            sheet.append(None)
+        elif question.get('type') == 'multiple':
+            sheet.append(sorted(rng.sample(options, len(question['correct']))))
+        else:
+            sheet.append(rng.choice(options))
+    return sheet
+
+
+def test_bitmask_grading_matches_question_by_question_checks():
+    rng = random.Random(7)
+    questions = QCMS['Info']['Python']
+    key = AnswerKey(questions)
+    sheets = [random_sheet(rng, questions) for _ in range(500)]
+    expected = [sum(answer is not None and check_answer(question, answer) for question, answer in zip(questions, sheet))
+                for sheet in sheets]
+    assert grade_batch(key, sheets) == expected
+    assert [key.grade(sheet) for sheet in sheets] == expected
+    assert grade_masks(key, [key.encode(sheet) for sheet in sheets]) == expected
+    assert key.correct_flags(sheets[0]) == [answer is not None and check_answer(question, answer)
+                                           for question, answer in zip(questions, sheets[0])]
+
+
+def test_short_sheets_count_missing_answers_as_wrong():
+    key = AnswerKey(QCMS['Info']['Python'])
+    assert key.encode([1]) == [0b1, 0, 0]
+    assert key.grade([1]) == 1
+
+
+def test_regrade_results_only_flags_changes():
+    keys = compile_answer_keys(QCMS)
+    unchanged = make_result(answers=[1, [1, 3], 2], correct=3)
+    stale = make_result(answers=[1, [1, 3], 3], correct=3)
+    unknown = make_result('Gone', 'Removed', correct=1)
+    regraded = list(regrade_results([unchanged, stale, unknown], keys, batch_size=2))
+    assert [changed for _, changed in regraded] == [False, True, False]
+    assert regraded[1][0]['correct_answers'] == 2
+    assert regraded[1][0]['score'] == pytest.approx(200 / 3)
+
+
+@pytest.mark.parametrize('fmt', ['json', 'binary'])
+def test_regrade_reaches_processes_already_running(data_dir, fmt):
+    storage = JSONStorage(data_dir)
+    storage.add_user('alice', 'hash')
+    storage.record_attempts([('alice', make_result(answers=[1, [1, 3], 3], correct=3)) for _ in range(7)])
+    storage.convert(fmt)
+    other = JSONStorage(data_dir)
+    events = []
+    other.subscribe(events.append)
+
+    qcms = {'Info': {'Python': [dict(q) for q in QCMS['Info']['Python']]}}
+    qcms['Info']['Python'][2]['correct'] = 3
+    storage.close()
+    assert regrade_json_history(data_dir, qcms) == 0
+    qcms['Info']['Python'][2]['correct'] = 1
+    assert regrade_json_history(data_dir, qcms) == 7
+
+    other.refresh()
+    assert other.get_scores('alice') == {'total_score': pytest.approx(7 * 200 / 3), 'quizzes_taken': 7}
+    assert [event['op'] for event in events].count('replace') == 7
+    # Its next compaction must not fold the old scores back in
+    other.add_user('bob', 'hash')
+    other.compact(force=True)
+    other.close()
+    reopened = JSONStorage(data_dir)
+    assert reopened.get_scores('alice')['total_score'] == pytest.approx(7 * 200 / 3)
+    assert {result['correct_answers'] for result in reopened.user_history('alice')} == {2}
+    reopened.close()
+
+
+def test_regrade_of_a_sqlite_database(data_dir):
+    storage = SQLiteStorage(os.path.join(data_dir, 'qcm.db'))
+    events = []
+    storage.subscribe(events.append)
+    storage.add_user('alice', 'hash')
+    storage.record_attempts([('alice', make_result(answers=[1, [1, 3], 3], correct=3)),
+                             ('alice', make_result(answers=[1, [1, 3], 2], correct=3))])
+    qcms = {'Info': {'Python': QCMS['Info']['Python']}}
+    assert regrade_history(storage, qcms) == 1
+    assert [result['correct_answers'] for result in storage.user_history('alice')] == [2, 3]
+    assert storage.get_scores('alice')['total_score'] == pytest.approx(100 + 200 / 3)
+    assert [event['op'] for event in events] == ['register', 'attempt', 'attempt', 'replace', 'scores']
+    storage.close()
@@ -0,0 +1,55 @@
+import random
+
+import pytest
+
+from conftest import make_result
+from qcm_leaderboard import IndexableSkipList, Leaderboard, LeaderboardIndex
+from qcm_storage import JSONStorage
+
+
+def test_skip_list_matches_a_sorted_list():
+    rng = random.Random(0)
+    skip_list, expected = IndexableSkipList(), []
+    for _ in range(2000):
+        key = rng.randrange(500)
+        if key in expected:
+            skip_list.remove(key)
+            expected.remove(key)
+        else:
+            skip_list.insert(key)
+            expected.append(key)
+            expected.sort()
+    assert list(skip_list) == expected and len(skip_list) == len(expected)
+    assert [skip_list[i] for i in range(len(expected))] == expected
+    assert all(skip_list.rank(key) == i for i, key in enumerate(expected))
+
+
+def test_board_ranks_by_average_and_refreshes_its_top():
+    board = Leaderboard()
+    board.set('alice', 150, 2)
+    board.set('bob', 90, 1)
+    board.add('carol', 60)
+    assert board.top(2) == [('bob', 90.0), ('alice', 75.0)]
+    assert board.rank('carol') == 3 and board.rank('dave') is None
+    # A new score moves a user past the cached top entries
+    board.add('carol', 100)
+    assert board.top(3) == [('bob', 90.0), ('carol', 80.0), ('alice', 75.0)]
+    assert board.rank('carol') == 2 and len(board) == 3
+
+
+def test_index_follows_categories_and_qcms(data_dir):
+    storage = JSONStorage(data_dir)
+    storage.record_attempts([('alice', make_result(correct=3)), ('bob', make_result(correct=1)),
+                             ('bob', make_result('Games', 'Elden Ring', answers=[1], correct=1, total=1))])
+    index = LeaderboardIndex(storage)
+    assert index.board().top(2) == [('alice', 100.0), ('bob', pytest.approx(200 / 3))]
+    assert index.board('Games').top(5) == [('bob', 100.0)]
+    assert index.board('Info', 'Python').rank('bob') == 2
+
+    result = make_result(correct=3)
+    storage.record_attempt('bob', result)
+    index.record('bob', result)
+    assert [user for user, _ in index.board('Info', 'Python').top(2)] == ['alice', 'bob']
+    assert index.board('Info').rank('bob') == 2 and index.board().rank('bob') == 2
+    assert len(index.board('Nothing')) == 0
+    storage.close()
@@ -0,0 +1,70 @@
+import asyncio
+import json
+import pstats
+
+import pytest
+
+from qcm_metrics import Metrics, Summary
+
+
+class Service:
+    def work(self, fail: bool = False) -> str:
+        if fail:
+            raise ValueError("failed")
+        return 'done'
+
+    async def work_async(self) -> str:
+        return 'done'
+
+
+def test_disabled_metrics_leave_methods_alone():
+    metrics, service = Metrics(), Service()
+    metrics.instrument(service, ('work',))
+    assert 'work' not in vars(service)
+    assert service.work() == 'done' and metrics.summaries == {}
+
+
+def test_timers_counters_and_gauges():
+    metrics, service = Metrics(), Service()
+    metrics.enable()
+    metrics.instrument(service, ('work', 'work_async'), 'service_')
+    assert service.work() == 'done'
+    with pytest.raises(ValueError):
+        service.work(fail=True)
+    assert asyncio.run(service.work_async()) == 'done'
+    metrics.count('compactions')
+    metrics.gauge('active_sessions', lambda: 3)
+
+    snapshot = metrics.snapshot()
+    assert snapshot['summaries']['service_work_seconds']['count'] == 2
+    assert snapshot['summaries']['service_work_seconds']['errors'] == 1
+    assert snapshot['summaries']['service_work_async_seconds']['count'] == 1
+    assert snapshot['counters'] == {'compactions': 1} and snapshot['gauges'] == {'active_sessions': 3}
+    text = metrics.prometheus()
+    assert '# TYPE qcm_service_work_seconds summary' in text
+    assert 'qcm_service_work_seconds_errors_total 1' in text and 'qcm_compactions_total 1' in text
+
+
+def test_percentiles_of_a_bounded_window():
+    summary = Summary(window=100)
+    for value in range(1000):
+        summary.observe(value)
+    assert summary.count == 1000 and len(summary.samples) == 100
+    assert summary.percentiles() == {'p50': 950, 'p95': 995, 'p99': 999}
+    assert Summary().percentiles() == {'p50': 0.0, 'p95': 0.0, 'p99': 0.0}
+
+
+def test_dump_and_profile_next(tmp_path):
+    metrics, service = Metrics(), Service()
+    metrics.enable(str(tmp_path / 'qcm.json'))
+    metrics.instrument(service, ('work',))
+    metrics.profile_next('work', str(tmp_path / 'work.prof'))
+    service.work()
+    service.work()
+    assert pstats.Stats(str(tmp_path / 'work.prof')).total_calls > 0
+    metrics.dump()
+    with open(tmp_path / 'qcm.json', encoding='utf-8') as f:
+        assert json.load(f)['summaries']['work_seconds']['count'] == 2
+    metrics.dump(str(tmp_path / 'qcm.prom'))
+    assert (tmp_path / 'qcm.prom').read_text(encoding='utf-8').startswith('qcm_uptime_seconds')
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['qcm.json', 'qcm.prom', 'work.prof']
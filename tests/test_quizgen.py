@@ -0,0 +1,93 @@
+import random
+
+from conftest import make_result
+from qcm_grading import AnswerKey, regrade_results
+from qcm_quizgen import ADAPTIVE_TITLE, AliasTable
+
+
+def test_alias_table_draws_in_proportion_to_the_weights():
+    table = AliasTable([1.0, 3.0, 0.0, 4.0])
+    rng = random.Random(0)
+    counts = [0] * 4
+    for _ in range(40000):
+        counts[table.draw(rng)] += 1
+    assert counts[2] == 0
+    assert [round(count / 40000, 1) for count in counts] == [0.1, 0.4, 0.0, 0.5]
+
+
+def take_generated_quiz(app, username, answers, pool='Info'):
+    app.storage.add_user(username, 'hash')
+    questions, sources = app.quizgen.generate(username, len(answers), category=pool, rng=random.Random(1))
+    session = app.engine.start_generated(username, pool, ADAPTIVE_TITLE, questions, sources)
+    for answer in answers:
+        session.submit(answer(questions[session.index]))
+    return app.engine.finish(session.id)
+
+
+def right(question):
+    return question.correct
+
+
+def wrong(question):
+    return question.correct_indexes()[0] % len(question.options) + 1 if not question.multiple else [4]
+
+
+def test_generated_attempts_record_their_questions(app):
+    result = take_generated_quiz(app, 'alice', [right, wrong, right])
+    assert sorted(map(tuple, result['questions'])) == [('Info', 'Python', 0), ('Info', 'Python', 1),
+                                                        ('Info', 'Python', 2)]
+    assert result['correct_answers'] == 2
+    missed = [tuple(ref) for ref, answer in zip(result['questions'], result['answers'])
+              if not AnswerKey(app.qcms['Info']['Python']).is_correct(ref[2], answer)]
+    assert app.difficulty.difficulty(missed[0]) == 2 / 3
+    assert app.difficulty.user('alice')[missed[0]] == [1, 1]
+
+
+def test_missed_questions_come_back_more_often(app):
+    questions = [{'question': f"Question {i}", 'options': ['yes', 'no'], 'correct': 1} for i in range(40)]
+    app.qcms.save_qcm('Maths', 'Drill', questions)
+    app.storage.add_user('alice', 'hash')
+    missed = ['Maths', 'Drill', 7]
+    app.record_attempt('alice', dict(make_result('Maths', ADAPTIVE_TITLE, [2], 0, 1), questions=[missed]))
+    rng = random.Random(0)
+    picks = sum(('Maths', 'Drill', 7) in app.quizgen.pick('alice', 5, 'Maths', rng=rng) for _ in range(200))
+    picks_other = sum(('Maths', 'Drill', 8) in app.quizgen.pick('bob', 5, 'Maths', rng=rng) for _ in range(200))
+    assert picks > 2 * picks_other
+
+
+def test_pools_follow_the_bank(app):
+    assert len(app.quizgen.pool('Games').refs) == 1
+    app.qcms.save_qcm('Games', 'Zelda', [{'question': 'Hero?', 'options': ['Link', 'Zelda'], 'correct': 1}])
+    assert ('Games', 'Zelda', 0) in app.quizgen.pool('Games').refs
+
+
+def test_generated_attempts_are_not_a_qcm(app):
+    app.qcms.save_qcm('Info', ADAPTIVE_TITLE, app.qcms['Games']['Elden Ring'])
+    take_generated_quiz(app, 'alice', [right, right, right])
+    assert len(app.leaderboards.board('Info')) == 1
+    assert len(app.leaderboards.board('Info', ADAPTIVE_TITLE)) == 0
+    assert ('Info', ADAPTIVE_TITLE) not in app.reports.all()
+    stats = app.stats.get('alice')
+    assert stats.attempts == 1 and stats.qcms == {}
+    assert stats.category_averages() == {'Info': 100.0}
+
+
+def test_a_tag_quiz_ranks_in_no_category(app):
+    app.storage.add_user('alice', 'hash')
+    sources = [['Info', 'Python', 0], ['Games', 'Elden Ring', 0]]
+    app.record_attempt('alice', dict(make_result('#basics', ADAPTIVE_TITLE, [1, 1], 2, 2), questions=sources))
+    assert len(app.leaderboards.board('#basics')) == 0
+    assert app.stats.get('alice').categories == {}
+    assert app.leaderboards.board().rank('alice') == 1
+
+
+def test_regrade_grades_generated_attempts_question_by_question(app):
+    # The QCM named like generated quizzes must not be used to grade them
+    keys = {('Info', ADAPTIVE_TITLE): AnswerKey([{'options': ['a', 'b'], 'correct': 2}] * 2),
+            ('Info', 'Python'): AnswerKey(app.qcms['Info']['Python'])}
+    generated = dict(make_result('Info', ADAPTIVE_TITLE, [1, 2], 1, 2),
+                     questions=[['Info', 'Python', 0], ['Info', 'Python', 2]])
+    [(regraded, changed)] = regrade_results([generated], keys)
+    assert changed and regraded['correct_answers'] == 2 and regraded['score'] == 100.0
+    unknown = dict(generated, questions=[['Info', 'Python', 0], ['Info', 'Gone', 0]])
+    assert list(regrade_results([unknown], keys)) == [(unknown, False)]
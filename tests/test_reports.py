@@ -0,0 +1,53 @@
+import io
+
+import pytest
+
+from conftest import QCMS, make_result
+from qcm_grading import AnswerKey
+from qcm_reports import ReportIndex, export_csv, iter_attempts, iter_pages
+from qcm_storage import JSONStorage
+
+
+@pytest.fixture
+def storage(data_dir):
+    storage = JSONStorage(data_dir)
+    storage.record_attempts([
+        ('alice', make_result(answers=[1, [1, 3], 2], correct=3, date='2024-01-01 09:00:00')),
+        ('bob', make_result(answers=[2, [1, 3], 2], correct=2, date='2024-01-02 09:00:00')),
+        ('bob', make_result('Games', 'Elden Ring', answers=[1], correct=1, total=1, date='2024-01-03 09:00:00')),
+    ])
+    yield storage
+    storage.close()
+
+
+def test_filters_pages_and_csv(storage):
+    assert [user for user, _ in iter_attempts(storage, category='Info')] == ['alice', 'bob']
+    assert [user for user, _ in iter_attempts(storage, date_from='2024-01-02', date_to='2024-01-02')] == ['bob']
+    assert [len(page) for page in iter_pages(iter_attempts(storage), page_size=2)] == [2, 1]
+
+    f = io.StringIO()
+    assert export_csv(iter_attempts(storage, username='bob'), f) == 2
+    lines = f.getvalue().splitlines()
+    assert lines[0].startswith('user,date,category') and lines[1].startswith('bob,2024-01-02 09:00:00,Info')
+
+
+def test_aggregates_follow_new_attempts(storage):
+    keys = {(category, title): AnswerKey(questions) for category, titles in QCMS.items()
+            for title, questions in titles.items()}
+    index = ReportIndex(storage, lambda category, title: keys.get((category, title)))
+    python = index.aggregate('Info', 'Python')
+    assert python.count == 2 and python.median() == pytest.approx(500 / 6)
+    # bob missed the first question, both answered the other two right
+    assert python.success_rates() == [50.0, 100.0, 100.0]
+
+    result = make_result(answers=[1, None, 1], correct=1, date='2024-01-04 09:00:00')
+    result['time_taken'] = 90
+    storage.record_attempt('carol', result)
+    index.record('carol', result)
+    assert python.count == 3 and python.median() == pytest.approx(200 / 3)
+    assert python.success_rates() == [pytest.approx(200 / 3), pytest.approx(200 / 3), pytest.approx(200 / 3)]
+    assert dict(python.time_distribution()) == {'0-30s': 2, '30-60s': 0, '60-120s': 1, '120-300s': 0,
+                                                '300-600s': 0, '>600s': 0}
+    # A generated quiz is no QCM of its own
+    index.record('carol', dict(make_result(), questions=[['Info', 'Python', 0]] * 3))
+    assert set(index.all()) == {('Info', 'Python'), ('Games', 'Elden Ring')}
@@ -0,0 +1,159 @@
+import random
+
+import pytest
+
+import qcm_search
+from qcm_bank import QuestionBank
+from qcm_search import SearchIndex, tokenize
+
+
+def question(text, options):
+    return {'question': text, 'options': options, 'correct': 1}
+
+
+@pytest.fixture
+def bank(tmp_path):
+    bank = QuestionBank(str(tmp_path / 'bank'))
+    bank.save_qcm('Info', 'Python basics', [
+        question('Which keyword defines a function?', ['def', 'fun', 'lambda']),
+        question('Is a list mutable?', ['yes', 'no']),
+    ])
+    bank.save_qcm('Info', 'Data structures', [
+        question('Which python type is a mapping?', ['dict', 'list', 'tuple']),
+    ])
+    bank.save_qcm('Nature', 'Reptiles', [
+        question('Which snake is the longest?', ['reticulated python', 'cobra', 'boa']),
+        question('Où vit le caméléon ?', ['Madagascar', 'Antarctique']),
+    ])
+    return bank
+
+
+def test_tokenize_drops_case_and_accents():
+    assert tokenize("Où vit le Caméléon ?") == ['ou', 'vit', 'le', 'cameleon']
+
+
+def test_title_and_question_beat_option(bank):
+    hits = {title: (score, index) for score, _, title, index in SearchIndex(bank).search('python')}
+    assert set(hits) == {'Python basics', 'Data structures', 'Reptiles'}
+    # A word of the title weighs as much as one of the question text, an option less
+    assert hits['Python basics'][0] == pytest.approx(hits['Data structures'][0])
+    assert hits['Reptiles'][0] < hits['Data structures'][0]
+    # The best matching question of each QCM is given, None when only the title matched
+    assert hits['Python basics'][1] is None
+    assert hits['Data structures'][1] == 0 and hits['Reptiles'][1] == 0
+
+
+def test_every_word_must_match(bank):
+    index = SearchIndex(bank)
+    assert [hit[2] for hit in index.search('python mapping')] == ['Data structures']
+    assert index.search('python zebra') == []
+    assert index.search('') == []
+
+
+def test_last_word_matches_as_a_prefix(bank):
+    index = SearchIndex(bank)
+    assert [hit[2] for hit in index.search('longest sna')] == ['Reptiles']
+    assert [hit[2] for hit in index.search('cameleon madag')] == ['Reptiles']
+    # Only the word being typed is a prefix
+    assert index.search('sna longest') == []
+
+
+def test_typos_are_matched_with_a_lower_weight(bank):
+    index = SearchIndex(bank)
+    exact = index.search('mapping')
+    for typo in ('mappnig', 'maping', 'mappiing', 'mapqing'):
+        hits = index.search(typo)
+        assert [hit[2] for hit in hits] == ['Data structures'], typo
+        assert hits[0][0] < exact[0][0]
+    assert index.search('mqpqing') == []
+
+
+def test_follows_qcms_written_after_the_first_search(bank):
+    index = SearchIndex(bank)
+    assert index.search('kotlin') == []
+    bank.save_qcm('Info', 'JVM', [question('Who designed Kotlin?', ['JetBrains', 'Oracle'])])
+    assert [hit[2] for hit in index.search('kotlin')] == ['JVM']
+    bank.save_qcm('Info', 'JVM', [question('Who designed Scala?', ['Odersky', 'Gosling'])])
+    assert index.search('kotlin') == []
+    assert [hit[2] for hit in index.search('scala')] == ['JVM']
+
+
+def test_background_build_leaves_the_bank_cache_alone(bank):
+    index = SearchIndex(bank)
+    index.start()
+    bank.save_qcm('Info', 'JVM', [question('Who designed Kotlin?', ['JetBrains', 'Oracle'])])
+    assert [hit[2] for hit in index.search('kotlin')] == ['JVM']
+    assert [hit[2] for hit in index.search('longest')] == ['Reptiles']
+    # Typos of words indexed after the build are found too
+    assert [hit[2] for hit in index.search('kotiln')] == ['JVM']
+    assert not bank.cache
+
+
+def test_similar_questions(bank):
+    similar = SearchIndex(bank).similar_questions('Which snake is the longest one?')
+    assert [(title, index) for _, _, title, index in similar] == [('Reptiles', 0)]
+
+
+def brute_force(index, query, limit=10):
+    """Scores of the best QCMs, by checking every question against every query word"""
+    words = list(dict.fromkeys(tokenize(query)))
+    expansions = [index._expand(word, i == len(words) - 1) for i, word in enumerate(words)]
+    if not words or not all(expansions):
+        return []
+    weighted = []
+    for expansion in expansions:
+        idf = index.idf(sum(len(index.postings.get(word, ())) for word, _ in expansion))
+        weighted.append([(word, weight * idf) for word, weight in expansion])
+    best = {}
+    for doc in index.docs:
+        if doc is None:
+            continue
+        qcm, _, text, options = doc
+        score = 0.0
+        for matches in weighted:
+            value = 0.0
+            for word, weight in matches:
+                if word in text:
+                    value = max(value, weight * qcm_search.FIELD_WEIGHTS[qcm_search.QUESTION_FIELD])
+                elif word in options:
+                    value = max(value, weight * qcm_search.FIELD_WEIGHTS[qcm_search.OPTION_FIELD])
+                if qcm in index.title_postings.get(word, ()):
+                    value = max(value, qcm_search.TITLE_WEIGHT * weight)
+            if not value:
+                break
+            score += value
+        else:
+            best[qcm] = max(best.get(qcm, 0.0), score)
+    return sorted(best.values(), reverse=True)[:limit]
+
+
+def test_ranking_matches_a_brute_force_search(tmp_path):
+    rng = random.Random(3)
+    vocabulary = [''.join(rng.choice('abcdefghijklmnopr') for _ in range(rng.randint(3, 8))) for _ in range(150)]
+    # Skewed, so some words are everywhere and others rare
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+
+    def sentence(length):
+        return ' '.join(rng.choices(vocabulary, weights, k=length))
+
+    bank = QuestionBank(str(tmp_path / 'bank'))
+    for i in range(80):
+        bank.save_qcm(f"category {i % 5}", f"{sentence(2)} {i}",
+                      [question(sentence(8), [sentence(2) for _ in range(4)]) for _ in range(rng.randint(1, 8))])
+    index = SearchIndex(bank)
+    queries = ([sentence(2) for _ in range(60)] + [sentence(1)[:3] for _ in range(30)]
+               + [f"{sentence(1)} {sentence(1)[:2]}" for _ in range(30)]
+               + [qcm_search._typo(rng.choice(vocabulary), rng) for _ in range(30)])
+
+    def check():
+        for query in queries:
+            assert [round(hit[0], 6) for hit in index.search(query)] == \
+                [round(score, 6) for score in brute_force(index, query)], query
+
+    check()
+    # Rewritten QCMs leave dead documents behind, which must never match
+    for i in rng.sample(range(80), 20):
+        category, title = index.qcms[i]
+        bank.save_qcm(category, title, [question(sentence(8), [sentence(2)]) for _ in range(rng.randint(0, 4))])
+    index.refresh()
+    check()
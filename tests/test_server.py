@@ -0,0 +1,97 @@
+import asyncio
+import json
+
+from qcm_server import listen, serve
+
+
+class Client:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    async def send(self, request) -> dict:
+        line = request if isinstance(request, bytes) else json.dumps(request).encode('utf-8') + b'\n'
+        self.writer.write(line)
+        await self.writer.drain()
+        return json.loads(await self.reader.readline())
+
+
+def run_server(app, scenario):
+    """Serve the app on a free port while `scenario(connect)` runs, then stop the server"""
+
+    async def main():
+        sock = listen('127.0.0.1', 0)
+        port = sock.getsockname()[1]
+        server = asyncio.ensure_future(serve(app, sock=sock))
+
+        async def connect() -> Client:
+            return Client(*await asyncio.open_connection('127.0.0.1', port))
+
+        try:
+            return await scenario(connect)
+        finally:
+            server.cancel()
+            await asyncio.gather(server, return_exceptions=True)
+
+    return asyncio.run(main())
+
+
+def test_a_quiz_over_the_line_protocol(app):
+    async def scenario(connect):
+        client = await connect()
+        assert (await client.send({'cmd': 'start', 'category': 'Info', 'title': 'Python'}))['error'] == \
+            "Please login first!"
+        assert (await client.send({'cmd': 'register', 'username': 'alice', 'password': 'secret'}))['ok']
+        assert not (await client.send({'cmd': 'register', 'username': 'alice', 'password': 'other'}))['ok']
+        assert not (await client.send({'cmd': 'login', 'username': 'alice', 'password': 'wrong'}))['ok']
+        login = await client.send({'cmd': 'login', 'username': 'alice', 'password': 'secret'})
+        assert login['ok']
+
+        assert 'Info' in (await client.send({'cmd': 'categories'}))['categories']
+        started = await client.send({'cmd': 'start', 'category': 'Info', 'title': 'Python'})
+        assert started['question']['number'] == 1 and 'correct' not in started['question']
+        assert (await client.send({'cmd': 'answer', 'answer': 2}))['correct_answer'] == ['def']
+        invalid = await client.send({'cmd': 'answer', 'answer': [1]})
+        assert not invalid['ok'] and invalid['error'] == "Select 2 answers"
+        assert (await client.send({'cmd': 'answer', 'answer': [1, 3]}))['correct']
+        last = await client.send({'cmd': 'answer', 'answer': 2})
+        assert last['question'] is None
+        assert last['result']['correct_answers'] == 2 and last['result']['rank'] == 1
+
+        # Another connection resumes with the token, without the password
+        other = await connect()
+        assert (await other.send({'cmd': 'resume', 'token': login['token']}))['username'] == 'alice'
+        assert not (await other.send({'cmd': 'resume', 'token': 'forged'}))['ok']
+
+    run_server(app, scenario)
+    assert app.storage.get_scores('alice')['quizzes_taken'] == 1
+
+
+def test_malformed_requests_get_an_error(app):
+    async def scenario(connect):
+        client = await connect()
+        for request in (b'not json\n', b'[1, 2]\n', b'"start"\n'):
+            assert (await client.send(request)) == {'ok': False, 'error': "Requests are one JSON object per line"}
+        assert (await client.send({'cmd': 'dance'}))['error'] == "Unknown command: dance"
+        assert not (await client.send({'cmd': 'titles', 'category': 'Nope'}))['ok']
+        assert not (await client.send({'cmd': 'login'}))['ok']
+        # Still served after the errors
+        assert (await client.send({'cmd': 'categories'}))['ok']
+
+    run_server(app, scenario)
+
+
+def test_shutdown_discards_the_sessions_of_connected_clients(app):
+    async def scenario(connect):
+        clients = []
+        for name in ('alice', 'bob'):
+            client = await connect()
+            await client.send({'cmd': 'register', 'username': name, 'password': 'secret'})
+            await client.send({'cmd': 'login', 'username': name, 'password': 'secret'})
+            await client.send({'cmd': 'start', 'category': 'Info', 'title': 'Python'})
+            clients.append(client)
+        assert len(app.engine.sessions) == 2
+
+    run_server(app, scenario)
+    assert app.engine.sessions == {}
+    assert app.storage.user_history('alice') == []
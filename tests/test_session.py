@@ -0,0 +1,73 @@
+import pytest
+
+import qcm_app
+from qcm_session import validate_answer
+
+
+@pytest.fixture
+def session(app):
+    return app.engine.start('alice', 'Info', 'Python', time_limit=60)
+
+
+def test_answers_are_checked_before_being_counted(app, session):
+    question = session.next_question()
+    assert validate_answer(question, 5) is not None
+    assert validate_answer(question, True) is not None
+    with pytest.raises(ValueError):
+        app.engine.submit(session.id, [1, 2])
+    assert session.index == 0
+
+    assert app.engine.submit(session.id, 1) is True
+    with pytest.raises(ValueError, match="Select 2 answers"):
+        app.engine.submit(session.id, [1])
+    assert app.engine.submit(session.id, [3, 1]) is True
+    assert app.engine.submit(session.id, 1) is False
+    assert session.next_question() is None
+
+
+def test_finish_stores_the_attempt_and_closes_the_session(app, session):
+    app.engine.submit(session.id, 1)
+    result = app.engine.finish(session.id)
+    assert result['answers'] == [1] and result['correct_answers'] == 1
+    assert result['score'] == pytest.approx(100 / 3)
+    assert session.id not in app.engine.sessions
+    assert app.storage.user_history('alice') == [result]
+    assert app.storage.get_scores('alice')['quizzes_taken'] == 1
+
+
+def test_sessions_run_side_by_side(app):
+    first = app.engine.start('alice', 'Info', 'Python')
+    second = app.engine.start('bob', 'Games', 'Elden Ring')
+    app.engine.submit(second.id, 1)
+    assert first.index == 0 and second.done()
+    app.engine.discard(first.id)
+    app.engine.finish(second.id)
+    assert app.engine.sessions == {}
+    assert app.storage.user_history('alice') == []
+    assert app.storage.get_scores('bob')['total_score'] == 100.0
+
+
+def test_no_answer_is_taken_once_the_time_is_up(app, session):
+    session.end_time = session.start_time
+    assert session.expired() and session.next_question() is None
+    with pytest.raises(ValueError):
+        app.engine.submit(session.id, 1)
+
+
+def test_terminal_quiz_stops_at_the_time_limit_and_keeps_the_answers_given(app, monkeypatch, capsys):
+    app.current_user = 'alice'
+    answers = iter([1, [1, 3]])
+
+    def answer_late(question):
+        answer = next(answers)
+        if isinstance(answer, list):
+            # The second answer comes after the time limit
+            app.engine.sessions[max(app.engine.sessions)].end_time = 0
+        return answer
+
+    monkeypatch.setattr(qcm_app, 'handle_question_input', answer_late)
+    assert app.take_qcm('Info', 'Python') == (True, "")
+    assert "Time's up" in capsys.readouterr().out
+    assert app.engine.sessions == {}
+    [result] = app.storage.user_history('alice')
+    assert result['answers'] == [1] and result['correct_answers'] == 1
@@ -0,0 +1,63 @@
+import pytest
+
+from conftest import make_result
+from qcm_snapshot import MAX_OPTION, Snapshot, decode_answer, encode_answer, write_snapshot
+
+
+@pytest.mark.parametrize('answer', [None, 1, 4, 2 ** 40, [1], [1, 3], [2, 5, MAX_OPTION]])
+def test_answers_round_trip(answer):
+    assert decode_answer(encode_answer(answer)) == answer
+
+
+@pytest.mark.parametrize('answer', [0, -1, True, [3, 1], [1, 1], [MAX_OPTION + 1], 'a', 1.5])
+def test_answers_without_a_compact_form(answer):
+    assert encode_answer(answer) is None
+
+
+def test_snapshot_round_trip(tmp_path):
+    generated = dict(make_result(answers=[None, [1, 3]]), questions=[['Info', 'Python', 0], ['Info', 'Python', 1]])
+    odd = dict(make_result(answers=[[3, 1], 'x']), note='kept whole')
+    users = {'alice': 'scrypt$hash', 'zoé': 'mot de passe', 'bob': 'plain'}
+    history = {
+        'alice': [make_result(correct=3), generated],
+        'zoé': [make_result('Jeux', 'Élden Ring ⚔', answers=[1], correct=1, total=1), odd],
+        'bob': [],
+    }
+    scores = {'alice': {'total_score': 166.66666666666669, 'quizzes_taken': 2},
+              'zoé': {'total_score': 100.0, 'quizzes_taken': 2}, 'bob': {'total_score': 0, 'quizzes_taken': 0}}
+    path = str(tmp_path / 'state.bin')
+    write_snapshot(path, users, history, scores)
+
+    snapshot = Snapshot(path)
+    assert dict(snapshot.table('users').items()) == users
+    assert dict(snapshot.table('history').items()) == history
+    assert dict(snapshot.table('scores').items()) == scores
+    table = snapshot.table('history')
+    assert 'zoé' in table and 'carol' not in table
+    assert list(table) == list(history)
+    snapshot.close()
+
+
+def test_snapshot_table_keeps_changes_in_memory(tmp_path):
+    path = str(tmp_path / 'state.bin')
+    write_snapshot(path, {'alice': 'h'}, {'alice': [make_result()]}, {'alice': {'total_score': 33.3, 'quizzes_taken': 1}})
+    snapshot = Snapshot(path)
+    history = snapshot.table('history')
+    # Every read decodes a fresh copy, a change is kept once assigned back
+    history['alice'].append(make_result(correct=2))
+    assert len(history['alice']) == 1 and not history.changed
+    history['alice'] = history['alice'] + [make_result(correct=2)]
+    history['bob'] = [make_result(correct=0)]
+    assert len(history['alice']) == 2
+    assert sorted(history) == ['alice', 'bob'] and len(history) == 2
+    assert dict(history.lengths()) == {'alice': 2, 'bob': 1}
+    with pytest.raises(KeyError):
+        history['carol']
+    snapshot.close()
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / 'state.bin'
+    path.write_bytes(b'\0' * 64)
+    with pytest.raises(ValueError):
+        Snapshot(str(path))
@@ -0,0 +1,42 @@
+import pytest
+
+from conftest import make_result
+from qcm_stats import StatsIndex, verify
+from qcm_storage import JSONStorage
+
+
+def test_user_stats_follow_new_attempts(data_dir):
+    storage = JSONStorage(data_dir)
+    storage.record_attempts([('alice', make_result(correct=3, date='2024-01-01 09:00:00')),
+                             ('alice', make_result(correct=1, date='2024-01-02 09:00:00')),
+                             ('alice', make_result('Games', 'Elden Ring', answers=[1], correct=1, total=1))])
+    index = StatsIndex(storage)
+    stats = index.get('alice')
+    python = stats.qcms[('Info', 'Python')]
+    assert (python.attempts, python.best, python.last_date) == (2, 100.0, '2024-01-02 09:00:00')
+    assert python.average == pytest.approx(200 / 3)
+    assert stats.category_averages() == {'Info': pytest.approx(200 / 3), 'Games': 100.0}
+    assert (stats.streak, stats.best_streak) == (1, 1)
+
+    result = make_result(correct=2, date='2024-01-03 09:00:00')
+    storage.record_attempt('alice', result)
+    index.record('alice', result)
+    assert index.get('alice') is stats and (stats.attempts, stats.streak, stats.best_streak) == (4, 2, 2)
+    assert python.last == pytest.approx(200 / 3)
+    # A generated quiz counts in the totals and its category, not as a QCM
+    quiz = dict(make_result(correct=3), questions=[['Info', 'Python', 0]] * 3)
+    index.record('alice', quiz)
+    assert python.attempts == 3 and stats.attempts == 5 and stats.categories['Info'][1] == 4
+    storage.close()
+
+
+def test_verify_finds_and_fixes_drifted_scores(data_dir):
+    storage = JSONStorage(data_dir)
+    storage.record_attempts([('alice', make_result(correct=3)), ('bob', make_result(correct=0))])
+    assert verify(storage)[1] == []
+    storage.replace_scores({'bob': {'total_score': 40.0, 'quizzes_taken': 3}})
+    users, mismatches = verify(storage)
+    assert mismatches == [('bob', {'total_score': 40.0, 'quizzes_taken': 3}, {'total_score': 0.0, 'quizzes_taken': 1})]
+    storage.replace_scores({username: expected for username, _, expected in mismatches})
+    assert verify(storage)[1] == [] and users['alice'].attempts == 1
+    storage.close()
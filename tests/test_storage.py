@@ -0,0 +1,329 @@
+import json
+import multiprocessing
+import os
+
+import pytest
+
+from conftest import make_result
+from qcm_storage import JSONStorage, SQLiteStorage, load_json, migrate_json_to_sqlite, save_json
+
+
+def state(storage):
+    """Everything a storage engine serves, in a comparable form"""
+    users = sorted(storage.iter_users())
+    return {
+        'users': users,
+        'passwords': {user: storage.get_password(user) for user in users},
+        'history': {user: storage.user_history(user) for user in users},
+        'scores': dict(storage.iter_scores()),
+    }
+
+
+def fill(storage):
+    storage.add_user('alice', 'hash-a')
+    storage.add_user('bob', 'hash-b')
+    storage.record_attempts([('alice', make_result(correct=3)), ('bob', make_result(correct=1))])
+    storage.record_attempt('alice', make_result('Games', 'Elden Ring', answers=[1], correct=1, total=1))
+    storage.set_password('bob', 'hash-b2')
+
+
+def test_log_is_replayed_on_top_of_the_snapshot(data_dir):
+    storage = JSONStorage(data_dir)
+    fill(storage)
+    expected = state(storage)
+    # No compaction: everything is still only in history.log
+    storage.attempt_log.close()
+    assert not os.path.exists(os.path.join(data_dir, 'history.json'))
+
+    reopened = JSONStorage(data_dir)
+    assert state(reopened) == expected
+    assert reopened.get_scores('alice') == {'total_score': 200.0, 'quizzes_taken': 2}
+    reopened.close()
+
+
+def test_incomplete_last_line_is_dropped_and_repaired(data_dir):
+    storage = JSONStorage(data_dir)
+    fill(storage)
+    expected = state(storage)
+    storage.attempt_log.close()
+    # A crash in the middle of an append leaves half a line
+    with open(os.path.join(data_dir, 'history.log'), 'ab') as f:
+        f.write(b'{"op": "attempt", "user": "alice", "res')
+
+    reopened = JSONStorage(data_dir)
+    assert state(reopened) == expected
+    # The next write cuts the broken line off before appending after it
+    reopened.record_attempt('bob', make_result(correct=2))
+    reopened.attempt_log.close()
+    with open(os.path.join(data_dir, 'history.log'), 'rb') as f:
+        for line in f:
+            json.loads(line)
+    assert JSONStorage(data_dir).get_scores('bob')['quizzes_taken'] == 2
+
+
+def test_interrupted_compaction_is_finished_without_counting_twice(data_dir):
+    storage = JSONStorage(data_dir)
+    fill(storage)
+    expected = state(storage)
+
+    def crash(manifest):
+        raise RuntimeError("power cut")
+
+    # Dies once snapshot.json names the staged files, before installing them or emptying the log
+    storage._install_snapshots = crash
+    with pytest.raises(RuntimeError):
+        storage.compact(force=True)
+    assert load_json(os.path.join(data_dir, 'snapshot.json'), {})['pending']
+    storage.attempt_log.close()
+
+    reopened = JSONStorage(data_dir)
+    assert state(reopened) == expected
+    assert not any(name.endswith('.staged') for name in os.listdir(data_dir))
+    reopened.close()
+
+
+def test_compaction_folds_the_log_and_keeps_the_data(data_dir):
+    storage = JSONStorage(data_dir)
+    storage.attempt_log.compact_every = 3
+    fill(storage)
+    expected = state(storage)
+    storage.close()
+    assert os.path.getsize(os.path.join(data_dir, 'history.log')) == 0
+    # Still one JSON document, with a user per line
+    history_file = os.path.join(data_dir, load_json(os.path.join(data_dir, 'snapshot.json'), {})['history'])
+    assert load_json(history_file, {})['alice'] == expected['history']['alice']
+    assert state(JSONStorage(data_dir)) == expected
+
+
+def test_history_is_read_one_user_at_a_time(data_dir):
+    storage = JSONStorage(data_dir)
+    fill(storage)
+    storage.compact(force=True)
+    # Nothing but the file's index is held once compacted
+    assert not storage.history.changed
+    assert storage.history_page('alice', 0, 1) == [make_result('Games', 'Elden Ring', answers=[1], correct=1, total=1)]
+    assert not storage.history.changed
+    # A new attempt keeps only that user's history in memory, until the next compaction
+    storage.record_attempt('bob', make_result(correct=2))
+    assert list(storage.history.changed) == ['bob']
+    assert [result['correct_answers'] for _, result in storage.iter_history('bob')] == [1, 2]
+    storage.close()
+    assert len([name for name in os.listdir(data_dir) if JSONStorage.HISTORY_FILE.fullmatch(name)]) == 2
+
+
+def test_single_history_json_is_rewritten_per_user(data_dir):
+    storage = JSONStorage(data_dir)
+    fill(storage)
+    expected = state(storage)
+    storage.close()
+    # A data directory from before the per-user history file
+    history = expected['history']
+    for name in os.listdir(data_dir):
+        if JSONStorage.HISTORY_FILE.fullmatch(name) or name == 'snapshot.json':
+            os.remove(os.path.join(data_dir, name))
+    save_json(os.path.join(data_dir, 'history.json'), history)
+
+    reopened = JSONStorage(data_dir)
+    assert 'history' in load_json(os.path.join(data_dir, 'snapshot.json'), {})
+    assert os.path.exists(os.path.join(data_dir, 'history.json.obsolete'))
+    assert state(reopened) == expected
+    reopened.close()
+
+
+def test_other_process_catches_up_after_a_compaction(data_dir):
+    writer = JSONStorage(data_dir)
+    reader = JSONStorage(data_dir)
+    events = []
+    reader.subscribe(events.append)
+
+    fill(writer)
+    writer.compact(force=True)
+    # The log the reader was following is gone: it reloads the snapshot and reports what it missed
+    reader.refresh()
+    assert state(reader) == state(writer)
+    assert sorted(e['user'] for e in events if e['op'] == 'register') == ['alice', 'bob']
+    assert len([e for e in events if e['op'] == 'attempt']) == 3
+
+    # Both keep writing to the new log without losing each other's events
+    reader.record_attempt('bob', make_result(correct=3))
+    writer.record_attempt('alice', make_result(correct=0))
+    reader.refresh()
+    assert state(reader) == state(writer)
+    assert len([e for e in events if e['op'] == 'attempt']) == 5
+    writer.close()
+    reader.close()
+
+
+def _write_attempts(data_dir, username, count):
+    storage = JSONStorage(data_dir)
+    # Small enough that the writers compact under each other's feet
+    storage.attempt_log.compact_every = 7
+    storage.add_user(username, 'hash')
+    for i in range(count):
+        storage.record_attempt(username, make_result(correct=i % 4, date=f"2024-01-01 10:00:{i:02d}"))
+    storage.close()
+
+
+def test_concurrent_writers_lose_nothing(data_dir):
+    context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn')
+    writers = [context.Process(target=_write_attempts, args=(data_dir, f"user{i}", 40)) for i in range(4)]
+    for process in writers:
+        process.start()
+    for process in writers:
+        process.join(60)
+        assert process.exitcode == 0
+
+    storage = JSONStorage(data_dir)
+    assert sorted(storage.iter_users()) == [f"user{i}" for i in range(4)]
+    for i in range(4):
+        history = storage.user_history(f"user{i}")
+        assert [result['date'][-2:] for result in history] == [f"{n:02d}" for n in range(40)]
+        scores = storage.get_scores(f"user{i}")
+        assert scores['quizzes_taken'] == 40
+        assert scores['total_score'] == pytest.approx(sum(result['score'] for result in history))
+    storage.close()
+
+
+def open_engine(kind, directory):
+    if kind == 'sqlite':
+        return SQLiteStorage(os.path.join(directory, 'qcm.db'))
+    return JSONStorage(directory)
+
+
+@pytest.mark.parametrize('kind', ['json', 'binary', 'sqlite'])
+def test_engines_serve_the_same_data(tmp_path, kind):
+    os.makedirs(tmp_path / 'reference')
+    reference = JSONStorage(str(tmp_path / 'reference'))
+    fill(reference)
+    directory = str(tmp_path / kind)
+    os.makedirs(directory)
+    storage = open_engine(kind, directory)
+    fill(storage)
+    if kind == 'binary':
+        storage.convert('binary')
+        storage.close()
+        # Served from the mapped state.<id>.bin, not from what was written in this process
+        storage = open_engine(kind, directory)
+        assert storage.format == 'binary'
+
+    assert state(storage) == state(reference)
+    assert storage.history_page('alice', 0, 1) == reference.history_page('alice', 0, 1)
+    assert storage.history_page('alice', 1, 5) == reference.history_page('alice', 1, 5)
+    assert storage.top_scores(1) == reference.top_scores(1)
+    assert list(storage.find_attempts(category='Games')) == list(reference.find_attempts(category='Games'))
+
+    # And once written back and reopened
+    storage.close()
+    reopened = open_engine(kind, directory)
+    assert state(reopened) == state(reference)
+    reopened.close()
+    reference.close()
+
+
+def test_binary_snapshot_leaves_no_stale_json_files(data_dir):
+    storage = JSONStorage(data_dir)
+    fill(storage)
+    storage.compact(force=True)
+    storage.convert('binary')
+    names = os.listdir(data_dir)
+    assert not set(JSONStorage.SNAPSHOT_FILES) & set(names)
+    assert sum(name.endswith('.bin') for name in names) == 1
+
+    storage.convert('json')
+    names = os.listdir(data_dir)
+    assert set(JSONStorage.SNAPSHOT_FILES) <= set(names)
+    assert not any(name.endswith(('.bin', '.obsolete')) for name in names)
+    storage.close()
+
+
+def test_binary_compaction_maps_the_new_snapshot(data_dir):
+    storage = JSONStorage(data_dir)
+    fill(storage)
+    storage.convert('binary')
+    storage.record_attempt('alice', make_result(correct=2))
+    assert storage.history.changed and storage.user_scores.changed
+    expected = state(storage)
+
+    storage.compact()
+    # What changed is now read from the new file, nothing decoded is kept
+    assert not storage.history.changed and not storage.user_scores.changed
+    assert state(storage) == expected
+    assert not storage.history.changed
+    assert sum(name.endswith('.bin') for name in os.listdir(data_dir)) == 1
+    storage.close()
+
+
+def test_save_json_replaces_the_file_whole(tmp_path):
+    path = str(tmp_path / 'data.json')
+    save_json(path, {'a': 1})
+    save_json(path, {'b': [1, 2]})
+    assert load_json(path, None) == {'b': [1, 2]}
+    assert os.listdir(tmp_path) == ['data.json']
+
+
+@pytest.mark.parametrize('kind', ['json', 'sqlite'])
+def test_indexes_built_from_a_scan_count_each_attempt_once(data_dir, kind):
+    from qcm_stats import StatsIndex
+    writer = open_engine(kind, data_dir)
+    reader = open_engine(kind, data_dir)
+    index = StatsIndex(reader)
+    reader.subscribe(lambda event: event['op'] == 'attempt' and index.record(event['user'], event['result']))
+    writer.add_user('alice', 'hash')
+    writer.record_attempts([('alice', make_result(correct=3)) for _ in range(3)])
+
+    # The attempts the reader has not seen yet are picked up by the scan, not sent to the index as well
+    assert index.get('alice').attempts == 3
+    history = reader.scan_history('alice')
+    writer.record_attempt('alice', make_result(correct=1))
+    # Nor are those written while a scan is iterated
+    reader.refresh()
+    assert len(list(history)) == 3
+    assert index.get('alice').attempts == 4
+    # A user without attempts, or unknown, has an empty history
+    writer.add_user('bob', 'hash')
+    assert list(reader.scan_history('bob')) == list(reader.scan_history('carol')) == []
+    writer.close()
+    reader.close()
+
+
+@pytest.mark.parametrize('kind', ['json', 'sqlite'])
+def test_replaced_attempts_reach_the_other_processes(data_dir, kind):
+    storage = open_engine(kind, data_dir)
+    fill(storage)
+    other = open_engine(kind, data_dir)
+    events = []
+    other.subscribe(events.append)
+    other.refresh()
+    del events[:]
+
+    regraded = make_result(correct=2)
+    storage.replace_attempts([('alice', 0, regraded)])
+    assert storage.user_history('alice')[0] == regraded
+    assert storage.get_scores('alice') == {'total_score': pytest.approx(100 + 200 / 3), 'quizzes_taken': 2}
+    other.refresh()
+    assert [(event['op'], event['user']) for event in events] == [('replace', 'alice'), ('scores', 'alice')]
+    assert events[0]['index'] == 0 and events[0]['result'] == regraded
+    assert events[1]['total_score'] == pytest.approx(100 + 200 / 3)
+    other.close()
+    storage.close()
+
+
+def test_migration_copies_every_user_once(data_dir, tmp_path):
+    storage = JSONStorage(data_dir)
+    fill(storage)
+    storage.add_user('carol', 'hash-c')
+    storage.close()
+    # An account without any scores entry, as left by older versions
+    scores = load_json(os.path.join(data_dir, 'scores.json'), {})
+    del scores['carol']
+    save_json(os.path.join(data_dir, 'scores.json'), scores)
+
+    db_path = str(tmp_path / 'qcm.db')
+    assert migrate_json_to_sqlite(data_dir, db_path) == 3
+    with pytest.raises(ValueError):
+        migrate_json_to_sqlite(data_dir, db_path)
+    database = SQLiteStorage(db_path)
+    assert list(database.iter_users()) == ['alice', 'bob', 'carol']
+    assert database.get_scores('alice') == {'total_score': 200.0, 'quizzes_taken': 2}
+    assert len(database.user_history('alice')) == 2
+    database.close()